@@ -0,0 +1,241 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Benchmark of the sampling / parse / history / record pipeline with synthetic top frames.
+Results (throughput and peak memory traced by tracemalloc) are written in json.
+  python3 src/benchmark/benchmark_rotop.py --output result.json
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Callable
+import argparse
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+# rotop and visualizer in this repository are used if rotop is not installed
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from rotop.csv_writer import CsvWriter
+from rotop.data_container import DataContainer
+from rotop.proc_runner import ProcRunner
+from rotop.top_runner import TopRunnerBase
+
+
+COMMAND_TEMPLATE_LIST = [
+  '/opt/ros/humble/lib/rclcpp_components/component_container_mt --ros-args -r __node:=container_{i} -r __ns:=/perception/object_recognition/detection_{i} -p use_sim_time:=False',
+  '/opt/ros/humble/lib/rclcpp_components/component_container --ros-args -r __node:=container_{i} -r __ns:=/planning/scenario_planning/lane_driving_{i} --params-file /tmp/launch_params_{i}',
+  '/usr/bin/python3 /opt/ros/humble/bin/ros2 launch autoware_launch planning_simulator_{i}.launch.xml map_path:=/home/user/map',
+  '/usr/bin/python3 /opt/autoware/lib/system_monitor/node_{i}.py --ros-args -r __node:=monitor_{i} --params-file /tmp/params_{i}.yaml',
+  'python3 -u /home/user/tools/script_{i}.py',
+  '/opt/autoware/lib/behavior_path_planner/behavior_path_planner_node_{i} --ros-args -r __node:=behavior_path_planner -r __ns:=/planning',
+  '/usr/lib/xorg/Xorg vt2 -displayfd 3 -auth /run/user/1000/gdm/Xauthority_{i}',
+  '[kworker/{i}:1-events]',
+]
+
+
+# modules which should not be imported by the CUI core
+HEAVY_MODULE_LIST = ['numpy', 'pandas', 'dearpygui', 'pexpect']
+
+
+def create_command(index: int) -> str:
+  return COMMAND_TEMPLATE_LIST[index % len(COMMAND_TEMPLATE_LIST)].format(i=index)
+
+
+def create_frame(num_process: int, frame_index: int, churn: float) -> list[str]:
+  """Frame in the same format as top / ProcRunner. `churn` of processes are replaced by new ones in each frame"""
+  rng = random.Random(frame_index)
+  num_replaced = int(num_process * churn * frame_index)
+  lines = [
+    f'top - 12:{frame_index // 60 % 60:02d}:{frame_index % 60:02d} up 1 day,  2:03,  load average: 1.00, 1.00, 1.00',
+    f'Tasks: {num_process:>3} total,   1 running, {num_process - 1:>3} sleeping,   0 stopped,   0 zombie',
+    '%Cpu(s): 12.3 us,  4.5 sy,  0.0 ni, 83.2 id,  0.0 wa,  0.0 hi,  0.0 si,  0.0 st',
+    'MiB Mem :  31900.0 total,  10000.0 free,  12000.0 used,   9900.0 buff/cache',
+    'MiB Swap:   2048.0 total,   2048.0 free,      0.0 used.  19000.0 avail Mem',
+    '',
+    ProcRunner.HEADER,
+  ]
+  process_list = []
+  for i in range(num_process):
+    index = i + num_process if i < num_replaced else i
+    process_list.append((rng.random() * 100 if i % 4 == 0 else 0.0, index + 100, create_command(index)))
+  process_list.sort(reverse=True)
+  for cpu, pid, command in process_list:
+    lines.append(ProcRunner.LINE_FORMAT.format(pid, 'user', 20, 0, '1.2g', 123456, 45678, 'S', f'{cpu:.1f}', f'{cpu / 10:.1f}', '12:34.56', command))
+  return lines
+
+
+class SyntheticRunner(TopRunnerBase):
+  """Feed prepared frames in a loop, so only the post-processing common to all backends is measured"""
+  def __init__(self, frame_list: list[list[str]]):
+    super().__init__(1, '.*')
+    self.frame_list = frame_list
+    self.frame_index = 0
+
+
+  def read_frame(self) -> list[str]:
+    frame = self.frame_list[self.frame_index % len(self.frame_list)]
+    self.frame_index += 1
+    return frame
+
+
+def measure(name: str, num_process: int, num_iteration: int, num_item: int, func: Callable[[int], None]) -> dict:
+  """Measure time without tracing first, then peak memory of one more iteration with tracemalloc"""
+  start_time = time.perf_counter()
+  for i in range(num_iteration):
+    func(i)
+  elapsed = time.perf_counter() - start_time
+
+  tracemalloc.start()
+  func(num_iteration)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  result = {
+    'name': name,
+    'num_process': num_process,
+    'num_iteration': num_iteration,
+    'sec': elapsed,
+    'iteration_per_sec': num_iteration / elapsed,
+    'item_per_sec': num_iteration * num_item / elapsed,
+    'peak_kib': peak / 1024,
+  }
+  print(f'{name:<24} {num_process:>6} {result["iteration_per_sec"]:>12.1f} iter/s {result["item_per_sec"]:>14.1f} item/s {result["peak_kib"]:>10.1f} KiB', file=sys.stderr)
+  return result
+
+
+def benchmark_top_runner_run(num_process: int, frame_list: list[list[str]]) -> dict:
+  runner = SyntheticRunner(frame_list)
+  return measure('TopRunner.run', num_process, len(frame_list), num_process,
+                 lambda i: runner.run(num_process, True))
+
+
+def benchmark_parse_command_str(num_process: int) -> dict:
+  command_list = [create_command(i) for i in range(num_process)]
+  def func(i):
+    for command in command_list:
+      TopRunnerBase.parse_command_str(command)
+  return measure('parse_command_str', num_process, 10, num_process, func)
+
+
+def benchmark_data_container_run(num_process: int, frame_list: list[list[str]]) -> dict:
+  runner = SyntheticRunner(frame_list)
+  result_list = [runner.run(num_process, True)[1] for _ in frame_list]
+  data_container = DataContainer(max_num_history=DataContainer.MAX_NUM_HISTORY)
+  return measure('DataContainer.run', num_process, len(result_list), num_process,
+                 lambda i: data_container.run(runner, result_list[i % len(result_list)], num_process))
+
+
+def benchmark_csv_writer(num_process: int, frame_list: list[list[str]], dir_name: str) -> dict:
+  runner = SyntheticRunner(frame_list)
+  parsed_list = [DataContainer.parse_top(runner, runner.run(num_process, True)[1], num_process) for _ in frame_list]
+  csv_writer = CsvWriter(dir_name, f'bench_{num_process}', max_row=100)
+  def func(i):
+    now, _, process_list, cpu_list, _, _, _ = parsed_list[i % len(parsed_list)]
+    csv_writer.write(now + i, process_list, cpu_list)
+  result = measure('CsvWriter.write', num_process, len(parsed_list), num_process, func)
+  csv_writer.close()
+  return result
+
+
+def benchmark_create_df_from_csv_files(num_process: int, num_chunk: int, dir_name: str) -> dict:
+  try:
+    from visualizer.visualize_csv import create_df_from_csv_files
+  except ImportError as e:
+    print(f'create_df_from_csv_files is skipped: {e}', file=sys.stderr)
+    return None
+
+  # chunks of a few rows, like a long recording with small --csv_max_row
+  num_row = 5
+  runner = SyntheticRunner([create_frame(num_process, i, 0.01) for i in range(4)])
+  csv_writer = CsvWriter(dir_name, f'chunk_{num_process}', max_row=num_row, flush_interval=num_row)
+  for i in range(num_chunk * num_row):
+    now, _, process_list, cpu_list, _, _, _ = DataContainer.parse_top(runner, runner.run(num_process, True)[1], num_process)
+    csv_writer.write(now + i, process_list, cpu_list)
+  csv_writer.close()
+  file_list = sorted(Path(dir_name).glob(f'chunk_{num_process}_*.csv'))
+  return measure('create_df_from_csv_files', num_process, 1, len(file_list),
+                 lambda i: create_df_from_csv_files(file_list))
+
+
+def benchmark_import_time() -> dict:
+  """Time to import rotop package in a new interpreter, and heavy modules imported by it"""
+  import subprocess
+  package_dir = str(Path(__file__).resolve().parent.parent)
+  command = [sys.executable, '-X', 'importtime', '-c', 'import rotop']
+  start_time = time.perf_counter()
+  completed = subprocess.run(command, cwd=package_dir, capture_output=True, text=True)
+  elapsed = time.perf_counter() - start_time
+  cumulative_us = 0
+  heavy_module_list = []
+  for line in completed.stderr.splitlines():
+    # import time: self [us] | cumulative | imported package
+    fields = line.split('|')
+    if len(fields) != 3:
+      continue
+    module = fields[2].strip()
+    if module == 'rotop':
+      cumulative_us = int(fields[1])
+    elif module in HEAVY_MODULE_LIST:
+      heavy_module_list.append(module)
+  result = {'name': 'import rotop', 'sec': elapsed, 'import_sec': cumulative_us / 1e6, 'heavy_modules': heavy_module_list}
+  print(f'{"import rotop":<24} {result["import_sec"]:>12.3f} sec {" ".join(heavy_module_list)}', file=sys.stderr)
+  return result
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(
+    description=f'rotop benchmark')
+  parser.add_argument('--num_process_list', type=int, nargs='+', default=[100, 1000, 10000], help="Number of processes in a synthetic frame.")
+  parser.add_argument('--num_frame', type=int, default=20, help="Number of frames to process in each benchmark.")
+  parser.add_argument('--num_chunk', type=int, default=200, help="Number of csv files read by create_df_from_csv_files.")
+  parser.add_argument('--max_num_process_csv_files', type=int, default=1000, help="create_df_from_csv_files is skipped for frames with more processes than this, as it takes minutes.")
+  parser.add_argument('--churn', type=float, default=0.01, help="Ratio of processes replaced by new processes in each frame.")
+  parser.add_argument('--output', type=str, default=None, help="Json file to save results. Default is stdout.")
+  return parser.parse_args()
+
+
+def main():
+  args = parse_args()
+  result_list = [benchmark_import_time()]
+  with tempfile.TemporaryDirectory() as dir_name:
+    for num_process in args.num_process_list:
+      frame_list = [create_frame(num_process, i, args.churn) for i in range(args.num_frame)]
+      result_list.append(benchmark_top_runner_run(num_process, frame_list))
+      result_list.append(benchmark_parse_command_str(num_process))
+      result_list.append(benchmark_data_container_run(num_process, frame_list))
+      result_list.append(benchmark_csv_writer(num_process, frame_list, dir_name))
+      if num_process <= args.max_num_process_csv_files:
+        result_list.append(benchmark_create_df_from_csv_files(num_process, args.num_chunk, dir_name))
+
+  result = {
+    'python': platform.python_version(),
+    'machine': platform.machine(),
+    'num_frame': args.num_frame,
+    'num_chunk': args.num_chunk,
+    'churn': args.churn,
+    'results': [result for result in result_list if result],
+  }
+  if args.output:
+    with open(args.output, 'w', encoding='utf-8') as f:
+      json.dump(result, f, indent=2)
+  else:
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+  main()
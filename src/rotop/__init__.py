@@ -11,8 +11,10 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+# gui_main (Dear PyGui), headless_main and modules using numpy/pandas are imported only when needed
 from . import data_container
-from . import gui_main
+from . import proc_runner
+from . import replay_runner
 from . import rotop
 from . import top_runner
 from . import utility
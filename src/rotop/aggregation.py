@@ -0,0 +1,112 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+from typing import Hashable
+
+
+class AggregateNode:
+  __slots__ = ('name', 'parent', 'depth', 'cpu', 'mem', 'num_process', 'children')
+
+  def __init__(self, name: str, parent: AggregateNode):
+    self.name = name
+    self.parent = parent
+    self.depth = parent.depth + 1 if parent else 0
+    self.cpu = 0.0
+    self.mem = 0.0
+    self.num_process = 0
+    self.children: set[AggregateNode] = set()
+
+
+class AggregationTree:
+  """
+  Sums of %CPU and %MEM of groups of processes (e.g. ROS namespace, launch subtree).
+  Groups a process belongs to are given only when the process appears for the first time.
+  After that, only differences of its values are added to the groups, and the values of finished processes are subtracted,
+  so the cost per frame doesn't depend on the size of the groups.
+  """
+  def __init__(self):
+    self.node_dict: dict[Hashable, AggregateNode] = {}
+    # key -> [node list, cpu, mem]. Entries not updated during one frame are removed by swapping two generations
+    self.current_entry_dict: dict[Hashable, list] = {}
+    self.previous_entry_dict: dict[Hashable, list] = {}
+
+
+  def __contains__(self, key: Hashable):
+    return key in self.current_entry_dict or key in self.previous_entry_dict
+
+
+  def update(self, key: Hashable, cpu: float, mem: float, group_list: list[tuple[Hashable, str, Hashable]]=None):
+    """
+    group_list is [(node key, name, parent node key)] from root to leaf, needed only for a new process
+    """
+    entry = self.current_entry_dict.get(key)
+    if entry is None:
+      entry = self.previous_entry_dict.pop(key, None)
+      if entry is None:
+        entry = [self.get_node_list(group_list or []), 0.0, 0.0]
+        for node in entry[0]:
+          node.num_process += 1
+      self.current_entry_dict[key] = entry
+    delta_cpu = cpu - entry[1]
+    delta_mem = mem - entry[2]
+    if delta_cpu != 0 or delta_mem != 0:
+      for node in entry[0]:
+        node.cpu += delta_cpu
+        node.mem += delta_mem
+      entry[1] = cpu
+      entry[2] = mem
+
+
+  def get_node_list(self, group_list: list[tuple[Hashable, str, Hashable]]) -> list[AggregateNode]:
+    node_list = []
+    for node_key, name, parent_key in group_list:
+      node = self.node_dict.get(node_key)
+      if node is None:
+        parent = self.node_dict.get(parent_key)
+        node = AggregateNode(name, parent)
+        if parent:
+          parent.children.add(node)
+        self.node_dict[node_key] = node
+      node_list.append(node)
+    return node_list
+
+
+  def next_generation(self):
+    """Call once per frame after all processes are updated"""
+    for node_list, cpu, mem in self.previous_entry_dict.values():
+      for node in node_list:
+        node.cpu -= cpu
+        node.mem -= mem
+        node.num_process -= 1
+    if self.previous_entry_dict:
+      for node_key, node in list(self.node_dict.items()):
+        if node.num_process <= 0:
+          if node.parent:
+            node.parent.children.discard(node)
+          del self.node_dict[node_key]
+    self.previous_entry_dict = self.current_entry_dict
+    self.current_entry_dict = {}
+
+
+  def create_row_list(self, min_num_process: int=1) -> list[AggregateNode]:
+    """Nodes in depth-first order. Siblings are sorted by CPU usage"""
+    row_list = []
+    stack = sorted((node for node in self.node_dict.values() if node.parent is None), key=lambda node: node.cpu)
+    while stack:
+      node = stack.pop()
+      if node.num_process < min_num_process:
+        continue
+      row_list.append(node)
+      stack.extend(sorted(node.children, key=lambda node: node.cpu))
+    return row_list
@@ -0,0 +1,279 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compact binary columnar log (*.rtb)
+
+Data file ({prefix}.rtb):
+  file header : magic 'RTOP', version (u16), reserved (u16)
+  record      : type (4 bytes), payload size (u32), payload
+    'STRS'    : string table entries. [id (u32), length (u16), utf-8 name] * n
+    'BLCK'    : block of samples. num_row (u32), num_column (u32), t_first (f64), t_last (f64),
+                column ids (u32 * num_column), timestamps (f64 * num_row), values (f32 * num_row * num_column, row-major)
+                A value is NaN if the series doesn't have a sample at the time.
+
+Index file ({prefix}.rtb.idx):
+  [type (4 bytes), t_first (f64), t_last (f64), offset of the record in the data file (u64)] * n
+  The index is optional for reading. If it's missing or broken, it's rebuilt by scanning record headers.
+"""
+from __future__ import annotations
+import array
+import math
+import mmap
+import os
+import struct
+import sys
+
+
+MAGIC = b'RTOP'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sHH')
+RECORD_HEADER = struct.Struct('<4sI')
+BLOCK_HEADER = struct.Struct('<IIdd')
+INDEX_ENTRY = struct.Struct('<4sddQ')
+TYPE_STRING = b'STRS'
+TYPE_BLOCK = b'BLCK'
+FILE_SUFFIX = '.rtb'
+INDEX_SUFFIX = '.idx'
+
+
+def to_little_endian_bytes(values: array.array) -> bytes:
+  """The format is little endian regardless of the host"""
+  if sys.byteorder == 'big':
+    values = array.array(values.typecode, values)
+    values.byteswap()
+  return values.tobytes()
+
+
+class BinaryLogWriter:
+  """Write samples as {prefix}.rtb. Has the same interface as CsvWriter"""
+  BLOCK_ROW = 60
+
+  def __init__(self, dir_name: str, prefix: str, block_row: int=BLOCK_ROW):
+    self.file_path = os.path.join(dir_name, prefix + FILE_SUFFIX)
+    self.block_row = max(block_row, 1)
+    self.file = open(self.file_path, 'wb')
+    self.file_index = open(self.file_path + INDEX_SUFFIX, 'wb')
+    self.file.write(FILE_HEADER.pack(MAGIC, VERSION, 0))
+    self.name_id_dict: dict[str, int] = {}
+    self.new_name_list: list[str] = []
+    self.timestamp_list: list[float] = []
+    self.row_list: list[tuple[list[int], list[float]]] = []
+
+
+  def write(self, timestamp: float, name_list: list[str], value_list: list[float]):
+    id_list = []
+    for name in name_list:
+      id = self.name_id_dict.get(name)
+      if id is None:
+        id = len(self.name_id_dict)
+        self.name_id_dict[name] = id
+        self.new_name_list.append(name)
+      id_list.append(id)
+    self.timestamp_list.append(timestamp)
+    self.row_list.append((id_list, value_list))
+    if len(self.row_list) >= self.block_row:
+      self.flush()
+
+
+  def flush(self):
+    if self.new_name_list:
+      self.write_string_table()
+    if self.row_list:
+      self.write_block()
+    self.file.flush()
+    self.file_index.flush()
+
+
+  def close(self):
+    if self.file.closed:
+      return
+    self.flush()
+    self.file.close()
+    self.file_index.close()
+
+
+  def write_record(self, type: bytes, payload: bytes, t_first: float, t_last: float):
+    offset = self.file.tell()
+    self.file.write(RECORD_HEADER.pack(type, len(payload)))
+    self.file.write(payload)
+    self.file_index.write(INDEX_ENTRY.pack(type, t_first, t_last, offset))
+
+
+  def write_string_table(self):
+    payload = bytearray()
+    for name in self.new_name_list:
+      name_bytes = name.encode('utf-8')[:0xFFFF]
+      payload += struct.pack('<IH', self.name_id_dict[name], len(name_bytes)) + name_bytes
+    self.write_record(TYPE_STRING, bytes(payload), math.nan, math.nan)
+    self.new_name_list = []
+
+
+  def write_block(self):
+    column_id_list = sorted(set(id for id_list, _ in self.row_list for id in id_list))
+    column_index_dict = {id: i for i, id in enumerate(column_id_list)}
+    num_row = len(self.row_list)
+    num_column = len(column_id_list)
+    values = array.array('f', [math.nan]) * (num_row * num_column)
+    for row, (id_list, value_list) in enumerate(self.row_list):
+      base = row * num_column
+      for id, value in zip(id_list, value_list):
+        values[base + column_index_dict[id]] = value
+    t_first = self.timestamp_list[0]
+    t_last = self.timestamp_list[-1]
+    payload = (BLOCK_HEADER.pack(num_row, num_column, t_first, t_last)
+               + struct.pack(f'<{num_column}I', *column_id_list)
+               + to_little_endian_bytes(array.array('d', self.timestamp_list))
+               + to_little_endian_bytes(values))
+    self.write_record(TYPE_BLOCK, payload, t_first, t_last)
+    self.timestamp_list = []
+    self.row_list = []
+
+
+class BinaryLogReader:
+  """Read {prefix}.rtb using memory map. Only blocks overlapping the requested time range are touched"""
+  def __init__(self, file_path: str):
+    self.file_path = str(file_path)
+    self.file = open(self.file_path, 'rb')
+    self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self.file_path) > 0 else b''
+    if len(self.mm) < FILE_HEADER.size or FILE_HEADER.unpack_from(self.mm, 0)[0] != MAGIC:
+      raise ValueError(f'{self.file_path} is not a rotop binary log')
+    self.name_dict: dict[int, str] = {}
+    self.block_list: list[tuple[float, float, int]] = []
+    entry_list = self.read_index()
+    if entry_list is None:
+      entry_list = self.scan_records()
+    for type, t_first, t_last, offset in entry_list:
+      if type == TYPE_STRING:
+        self.read_string_table(offset)
+      elif type == TYPE_BLOCK:
+        self.block_list.append((t_first, t_last, offset))
+
+
+  def close(self):
+    if isinstance(self.mm, mmap.mmap):
+      self.mm.close()
+    self.file.close()
+
+
+  def read_index(self) -> list[tuple[bytes, float, float, int]]:
+    index_path = self.file_path + INDEX_SUFFIX
+    if not os.path.exists(index_path):
+      return None
+    with open(index_path, 'rb') as f:
+      data = f.read()
+    num_entry = len(data) // INDEX_ENTRY.size
+    entry_list = [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(num_entry)]
+    # the last entries may point to records not written completely
+    while entry_list and not self.is_record_complete(entry_list[-1][3]):
+      entry_list.pop()
+    return entry_list
+
+
+  def scan_records(self) -> list[tuple[bytes, float, float, int]]:
+    entry_list = []
+    offset = FILE_HEADER.size
+    while self.is_record_complete(offset):
+      type, size = RECORD_HEADER.unpack_from(self.mm, offset)
+      t_first, t_last = math.nan, math.nan
+      if type == TYPE_BLOCK:
+        _, _, t_first, t_last = BLOCK_HEADER.unpack_from(self.mm, offset + RECORD_HEADER.size)
+      entry_list.append((type, t_first, t_last, offset))
+      offset += RECORD_HEADER.size + size
+    return entry_list
+
+
+  def is_record_complete(self, offset: int) -> bool:
+    if offset + RECORD_HEADER.size > len(self.mm):
+      return False
+    _, size = RECORD_HEADER.unpack_from(self.mm, offset)
+    return offset + RECORD_HEADER.size + size <= len(self.mm)
+
+
+  def read_string_table(self, offset: int):
+    _, size = RECORD_HEADER.unpack_from(self.mm, offset)
+    pos = offset + RECORD_HEADER.size
+    end = pos + size
+    while pos < end:
+      id, length = struct.unpack_from('<IH', self.mm, pos)
+      pos += 6
+      self.name_dict[id] = bytes(self.mm[pos:pos + length]).decode('utf-8', errors='replace')
+      pos += length
+
+
+  def get_time_range(self) -> tuple[float, float]:
+    if not self.block_list:
+      return None, None
+    return self.block_list[0][0], self.block_list[-1][1]
+
+
+  def read_block(self, offset: int, start: float=None, end: float=None):
+    """(column ids, timestamps, values) of the block in [start, end]. Arrays are views of the memory map"""
+    import numpy as np   # only the reader needs numpy, so that recording works without it
+    pos = offset + RECORD_HEADER.size
+    num_row, num_column, _, _ = BLOCK_HEADER.unpack_from(self.mm, pos)
+    pos += BLOCK_HEADER.size
+    ids = np.frombuffer(self.mm, dtype='<u4', count=num_column, offset=pos)
+    pos += 4 * num_column
+    timestamps = np.frombuffer(self.mm, dtype='<f8', count=num_row, offset=pos)
+    pos += 8 * num_row
+    values = np.frombuffer(self.mm, dtype='<f4', count=num_row * num_column, offset=pos).reshape(num_row, num_column)
+    if start is None and end is None:
+      return ids, timestamps, values
+    mask = np.ones(num_row, dtype=bool)
+    if start is not None:
+      mask &= timestamps >= start
+    if end is not None:
+      mask &= timestamps <= end
+    return ids, timestamps[mask], values[mask]
+
+
+  def iterate_blocks(self, start: float=None, end: float=None):
+    """
+    Yield (timestamps, names, values) of each block overlapping [start, end], decoding one block at a time.
+    Arrays are copies, so that the reader can be closed while they are used.
+    """
+    for t_first, t_last, offset in self.block_list:
+      if (start is not None and t_last < start) or (end is not None and t_first > end):
+        continue
+      ids, timestamps, values = self.read_block(offset, start, end)
+      block = (timestamps.copy(), [self.name_dict.get(int(id), str(id)) for id in ids], values.copy())
+      # views must be released before yielding, otherwise the memory map can't be closed while this generator is suspended
+      del ids, timestamps, values
+      yield block
+
+
+  def read(self, start: float=None, end: float=None):
+    """
+    Return (timestamps, names, values) in [start, end].
+    values is a 2D float32 array (row: time, column: name), NaN if not sampled.
+    """
+    import numpy as np
+    block_data_list = []
+    for t_first, t_last, offset in self.block_list:
+      if (start is not None and t_last < start) or (end is not None and t_first > end):
+        continue
+      block_data_list.append(self.read_block(offset, start, end))
+
+    all_ids = np.unique(np.concatenate([ids for ids, _, _ in block_data_list])) if block_data_list else np.zeros(0, dtype='<u4')
+    num_row = sum(len(timestamps) for _, timestamps, _ in block_data_list)
+    result_timestamps = np.empty(num_row, dtype=np.float64)
+    result_values = np.full((num_row, len(all_ids)), np.nan, dtype=np.float32)
+    row = 0
+    for ids, timestamps, values in block_data_list:
+      columns = np.searchsorted(all_ids, ids)
+      result_timestamps[row:row + len(timestamps)] = timestamps
+      result_values[row:row + len(timestamps), columns] = values
+      row += len(timestamps)
+    names = [self.name_dict.get(int(id), str(id)) for id in all_ids]
+    return result_timestamps, names, result_values
@@ -0,0 +1,130 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import csv
+import io
+import math
+import os
+
+from .utility import create_logger
+
+
+logger = create_logger(__name__, log_filename='rotop.log')
+
+
+class CsvWriter:
+  """
+  Append-only csv writer. Only the new row is written for each sample, and files are rotated as {prefix}_{index:03d}.csv.
+  When a new column appears in the middle of a file, the current header is saved to a sidecar file ({file}.columns),
+  and the header line in the csv file itself is updated once when the file is closed.
+  Rows written before a column appears are shorter than the header, which is read as empty (NaN).
+  """
+  SIDECAR_SUFFIX = '.columns'
+
+  def __init__(self, dir_name: str, prefix: str, max_row: int=1000, max_bytes: int=0, flush_interval: int=1):
+    self.dir_name = dir_name
+    self.prefix = prefix
+    self.max_row = max_row
+    self.max_bytes = max_bytes
+    self.flush_interval = max(flush_interval, 1)
+    self.index = 0
+    self.file = None
+    self.writer = None
+    self.file_path = None
+    self.column_name_list: list[str] = []
+    self.column_index_dict: dict[str, int] = {}
+    self.num_column_in_file_header = 0
+    self.num_row = 0
+    self.num_row_not_flushed = 0
+    self.num_bytes = 0
+
+
+  def write(self, timestamp: int, name_list: list[str], value_list: list[float]):
+    if self.file is None:
+      self.open(name_list)
+
+    is_column_added = False
+    for name in name_list:
+      if name not in self.column_index_dict:
+        self.column_index_dict[name] = len(self.column_name_list)
+        self.column_name_list.append(name)
+        is_column_added = True
+    if is_column_added:
+      self.write_sidecar()
+
+    row = [''] * len(self.column_name_list)
+    for name, value in zip(name_list, value_list):
+      row[self.column_index_dict[name]] = '' if math.isnan(value) else value
+    # trailing empty cells are omitted because they are read as NaN anyway
+    while row and row[-1] == '':
+      row.pop()
+    # rows contain only numbers (ascii), so the number of characters written is the number of bytes.
+    # file.tell() is not used because it flushes the buffer of a text file
+    self.num_bytes += self.writer.writerow([timestamp] + row)
+    self.num_row += 1
+    self.num_row_not_flushed += 1
+    if self.num_row_not_flushed >= self.flush_interval:
+      self.flush()
+
+    if self.num_row >= self.max_row or (self.max_bytes > 0 and self.num_bytes >= self.max_bytes):
+      self.close()
+      self.index += 1
+
+
+  def open(self, name_list: list[str]):
+    self.file_path = os.path.join(self.dir_name, f'{self.prefix}_{self.index:03d}.csv')
+    self.file = open(self.file_path, 'w', newline='', encoding='utf-8')
+    self.writer = csv.writer(self.file)
+    self.column_name_list = list(dict.fromkeys(name_list))
+    self.column_index_dict = {name: i for i, name in enumerate(self.column_name_list)}
+    self.num_column_in_file_header = len(self.column_name_list)
+    self.num_row = 0
+    self.num_row_not_flushed = 0
+    # header may contain non-ascii process names, so its size is counted in bytes
+    header = io.StringIO()
+    csv.writer(header).writerow(['datetime'] + self.column_name_list)
+    self.file.write(header.getvalue())
+    self.num_bytes = len(header.getvalue().encode('utf-8'))
+
+
+  def write_sidecar(self):
+    with open(self.file_path + self.SIDECAR_SUFFIX, 'w', newline='', encoding='utf-8') as f:
+      csv.writer(f).writerow(['datetime'] + self.column_name_list)
+
+
+  def flush(self):
+    if self.file:
+      self.file.flush()
+    self.num_row_not_flushed = 0
+
+
+  def close(self):
+    if self.file is None:
+      return
+    self.file.close()
+    self.file = None
+    if len(self.column_name_list) > self.num_column_in_file_header:
+      self.finalize_header()
+
+
+  def finalize_header(self):
+    """Replace the header line with the complete one, so that the closed file can be read without the sidecar"""
+    tmp_file_path = self.file_path + '.tmp'
+    with open(self.file_path, 'r', newline='', encoding='utf-8') as f_src, open(tmp_file_path, 'w', newline='', encoding='utf-8') as f_dst:
+      f_src.readline()
+      csv.writer(f_dst).writerow(['datetime'] + self.column_name_list)
+      for line in f_src:
+        f_dst.write(line)
+    os.replace(tmp_file_path, self.file_path)
+    os.remove(self.file_path + self.SIDECAR_SUFFIX)
@@ -0,0 +1,55 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import curses
+
+
+class CursesRenderer:
+  """
+  Render lines to the screen rewriting only lines changed from the previous frame.
+  The screen is never cleared except when the terminal is resized, so curses sends only changed cells to the terminal.
+  """
+  def __init__(self, stdscr):
+    self.stdscr = stdscr
+    self.previous_lines: list[str] = []
+    self.previous_size = None
+
+
+  def invalidate(self):
+    self.previous_lines = []
+    self.previous_size = None
+
+
+  def render(self, lines: list[str]):
+    max_y, max_x = self.stdscr.getmaxyx()
+    if self.previous_size != (max_y, max_x):
+      self.stdscr.clear()
+      self.previous_lines = []
+      self.previous_size = (max_y, max_x)
+
+    new_lines = [line[:max_x] for line in lines[:max_y - 1]]
+    for i, line in enumerate(new_lines):
+      if i < len(self.previous_lines) and self.previous_lines[i] == line:
+        continue
+      self.stdscr.move(i, 0)
+      self.stdscr.clrtoeol()
+      try:
+        self.stdscr.addstr(i, 0, line)
+      except curses.error:
+        pass
+    for i in range(len(new_lines), len(self.previous_lines)):
+      self.stdscr.move(i, 0)
+      self.stdscr.clrtoeol()
+    self.previous_lines = new_lines
+    self.stdscr.refresh()
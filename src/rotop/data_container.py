@@ -12,13 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import annotations
+from typing import TYPE_CHECKING
 import datetime
 import time
 import os
-import pandas as pd
+import re
 
-from .top_runner import TopRunner
+from .csv_writer import CsvWriter
+from .online_stats import StatsTable
+from .process_registry import ProcessRegistry
+from .profiler import StageProfiler
+from .top_runner import TopRunnerBase
 from .utility import create_logger
+if TYPE_CHECKING:
+  import pandas as pd
+  from .metrics_exporter import MetricsExporter
+  from .remote import RemoteAgent
+  from .shared_snapshot import SharedSnapshotWriter
 
 
 logger = create_logger(__name__, log_filename='rotop.log')
@@ -27,81 +37,201 @@ logger = create_logger(__name__, log_filename='rotop.log')
 class DataContainer:
   MAX_ROW_CSV = 1000
   MAX_NUM_HISTORY = 100
+  MAX_NUM_SERIES = 200
+  EVICT_AFTER = 60
+  SUMMARY_INTERVAL = 60
+  SUMMARY_SUFFIX = '.summary'
+  ROLLUP_10S_HISTORY = 360    # 1 hour
+  ROLLUP_1MIN_HISTORY = 1440  # 1 day
+  STATS_HEADER = f'{"MEAN":>6}{"STD":>6}{"MAX":>6}{"P95":>6}{"P99":>6} '
 
-  def __init__(self, write_csv=False):
+  def __init__(self, write_csv=False, max_num_history=MAX_NUM_HISTORY, csv_max_row=MAX_ROW_CSV, csv_max_bytes=0, csv_flush_interval=1,
+               record_format='csv', profiler: StageProfiler=None, max_num_series=MAX_NUM_SERIES, evict_after=EVICT_AFTER,
+               rollup_10s_history=ROLLUP_10S_HISTORY, rollup_1min_history=ROLLUP_1MIN_HISTORY, remote_agent: RemoteAgent=None,
+               shared_snapshot: SharedSnapshotWriter=None, metrics_exporter: MetricsExporter=None):
     now = datetime.datetime.now()
+    self.profiler = profiler if profiler else StageProfiler(enabled=False)
     if write_csv:
       self.csv_dir_name = now.strftime('./rotop_%Y%m%d_%H%M%S')
       os.mkdir(self.csv_dir_name)
+      if record_format == 'binary':
+        from .binary_log import BinaryLogWriter
+        self.csv_writer_total = BinaryLogWriter(self.csv_dir_name, 'total')
+        self.csv_writer_cpu = BinaryLogWriter(self.csv_dir_name, 'cpu')
+        self.csv_writer_mem = BinaryLogWriter(self.csv_dir_name, 'mem')
+      else:
+        self.csv_writer_total = CsvWriter(self.csv_dir_name, 'total', csv_max_row, csv_max_bytes, csv_flush_interval)
+        self.csv_writer_cpu = CsvWriter(self.csv_dir_name, 'cpu', csv_max_row, csv_max_bytes, csv_flush_interval)
+        self.csv_writer_mem = CsvWriter(self.csv_dir_name, 'mem', csv_max_row, csv_max_bytes, csv_flush_interval)
     else:
       self.csv_dir_name = None
-    self.csv_index = 0
-    self.df_total = pd.DataFrame()
-    self.df_cpu = pd.DataFrame()
-    self.df_mem = pd.DataFrame()
-    self.df_total_history = pd.DataFrame()
-    self.df_cpu_history = pd.DataFrame()
-    self.df_mem_history = pd.DataFrame()
-
-  def run(self, top_runner: TopRunner, lines: list[str], num_process: int):
+    self.process_registry = ProcessRegistry(max_num_series, evict_after)
+    self.total_stats = StatsTable()
+    self.cpu_stats = StatsTable()
+    self.mem_stats = StatsTable()
+    self.num_sample = 0
+    self.remote_agent = remote_agent
+    self.shared_snapshot = shared_snapshot
+    self.metrics_exporter = metrics_exporter
+    # history is not kept if max_num_history is 0 (e.g. headless mode)
+    self.keep_history = max_num_history > 0
+    if self.keep_history:
+      # numpy and pandas are imported only when history is used (GUI), so that CUI starts quickly
+      from .history_buffer import TieredHistory
+      # dead processes may stay in history until their values go out of the window, so allow twice as many columns
+      max_num_column = max_num_series * 2 + 1 if max_num_series > 0 else 0
+      # raw samples for the last max_num_history samples, and min/mean/max of 10 seconds and 1 minute for longer ranges
+      tier_list = [(10, rollup_10s_history), (60, rollup_1min_history)]
+      self.total_history = TieredHistory(max_num_history, 0, tier_list)
+      self.cpu_history = TieredHistory(max_num_history, max_num_column, tier_list)
+      self.mem_history = TieredHistory(max_num_history, max_num_column, tier_list)
+
+  def run(self, top_runner: TopRunnerBase, lines: list[str], num_process: int):
     if top_runner.col_range_command and top_runner.col_range_command[0] > 0:
-      df_total_current, df_cpu_current, df_mem_current = self.create_df_from_top(top_runner, lines, num_process)
-      self.df_total = pd.concat([self.df_total, df_total_current], axis=0)
-      self.df_cpu = pd.concat([self.df_cpu, df_cpu_current], axis=0)
-      self.df_mem = pd.concat([self.df_mem, df_mem_current], axis=0)
-      self.df_total_history = pd.concat([self.df_total_history, df_cpu_current], axis=0, ignore_index=True)
-      self.df_cpu_history = pd.concat([self.df_cpu_history, df_cpu_current], axis=0, ignore_index=True)
-      self.df_mem_history = pd.concat([self.df_mem_history, df_mem_current], axis=0, ignore_index=True)
+      with self.profiler.measure('parse'):
+        now, total_list, process_list, cpu_list, mem_list, pid_list, rss_list = self.parse_top(top_runner, lines, num_process)
+        key_list = [(name, top_runner.get_starttime(int(pid)) if pid else None) for name, pid in zip(process_list, pid_list)]
+        if self.shared_snapshot or self.metrics_exporter:
+          process_info_dict = {name: (int(pid) if pid else 0, rss or 0) for name, pid, rss in zip(process_list, pid_list, rss_list)}
+        process_list, cpu_list, mem_list, id_list = self.process_registry.update(key_list, process_list, cpu_list, mem_list)
+      if self.shared_snapshot or self.metrics_exporter:
+        info_list = [process_info_dict.get(name, (0, 0)) for name in process_list]
+        pid_list = [info[0] for info in info_list]
+        rss_list = [info[1] for info in info_list]
+      if self.shared_snapshot:
+        with self.profiler.measure('publish'):
+          self.shared_snapshot.publish(now, total_list, pid_list, id_list, process_list, cpu_list, mem_list, rss_list)
+      if self.metrics_exporter:
+        with self.profiler.measure('metrics'):
+          self.metrics_exporter.update(now, total_list, process_list, pid_list, cpu_list, mem_list, rss_list)
+      with self.profiler.measure('stats'):
+        self.total_stats.update(['user', 'sys', 'idle'], total_list)
+        self.cpu_stats.update(process_list, cpu_list)
+        self.mem_stats.update(process_list, mem_list)
+      self.num_sample += 1
+      if self.remote_agent:
+        with self.profiler.measure('send'):
+          self.remote_agent.send(now, total_list, process_list, cpu_list, mem_list)
+      if self.keep_history:
+        with self.profiler.measure('history'):
+          self.total_history.append(now, ['user', 'sys', 'idle'], total_list)
+          self.cpu_history.append(now, process_list, cpu_list)
+          self.mem_history.append(now, process_list, mem_list)
       if self.csv_dir_name:
-        self.df_total.to_csv(os.path.join(self.csv_dir_name, f'total_{self.csv_index:03d}.csv'), index=False)
-        self.df_cpu.to_csv(os.path.join(self.csv_dir_name, f'cpu_{self.csv_index:03d}.csv'), index=False)
-        self.df_mem.to_csv(os.path.join(self.csv_dir_name, f'mem_{self.csv_index:03d}.csv'), index=False)
-        if len(self.df_total) >= self.MAX_ROW_CSV:
-          self.df_total = pd.DataFrame()
-          self.df_cpu = pd.DataFrame()
-          self.df_mem = pd.DataFrame()
-          self.csv_index += 1
-      if len(self.df_total_history) >= self.MAX_NUM_HISTORY:
-        self.df_total_history = self.df_total_history[1:]
-        self.df_cpu_history = self.df_cpu_history[1:]
-        self.df_mem_history = self.df_mem_history[1:]
+        with self.profiler.measure('persist'):
+          self.csv_writer_total.write(now, ['user', 'sys', 'idle'], total_list)
+          self.csv_writer_cpu.write(now, process_list, cpu_list)
+          self.csv_writer_mem.write(now, process_list, mem_list)
+          if self.num_sample % self.SUMMARY_INTERVAL == 0:
+            self.write_summary()
+
+
+  def close(self):
+    if self.remote_agent:
+      self.remote_agent.close()
+    if self.shared_snapshot:
+      self.shared_snapshot.close()
+    if self.metrics_exporter:
+      self.metrics_exporter.close()
+    if self.csv_dir_name:
+      self.csv_writer_total.close()
+      self.csv_writer_cpu.close()
+      self.csv_writer_mem.close()
+      self.write_summary()
+
+
+  def write_summary(self):
+    """Statistics of the whole capture in csv format (e.g. cpu.summary), so that the visualizer doesn't need to calculate them from raw data"""
+    self.total_stats.write_csv(os.path.join(self.csv_dir_name, 'total' + self.SUMMARY_SUFFIX))
+    self.cpu_stats.write_csv(os.path.join(self.csv_dir_name, 'cpu' + self.SUMMARY_SUFFIX))
+    self.mem_stats.write_csv(os.path.join(self.csv_dir_name, 'mem' + self.SUMMARY_SUFFIX))
+
+
+  def add_stats_columns(self, top_runner: TopRunnerBase, lines: list[str]) -> list[str]:
+    """
+    Insert statistics of %CPU since start (mean, std, max, p95, p99) before COMMAND column of each row of lines shown by top_runner.
+    Rows are matched to series by the same name as parse_top. Columns are blank for rows without statistics (e.g. folded into 'other')
+    """
+    if not top_runner.col_range_list_to_display or not top_runner.col_range_command or top_runner.col_range_command[0] <= 0:
+      return lines
+    # lines shown have only some columns of top (col_range_list_to_display) followed by command
+    command_start = top_runner.col_range_command[0]
+    command_col = sum(max(min(end, command_start) - start, 0) for start, end in top_runner.col_range_list_to_display)
+    pid_end = top_runner.col_range_pid[1]
+    result_lines = []
+    lines_iterator = iter(lines)
+    for line in lines_iterator:
+      if 'PID' in line:
+        result_lines.append(line[:command_col] + self.STATS_HEADER + line[command_col:])
+        break
+      result_lines.append(line)
+    for line in lines_iterator:
+      pid = line[:pid_end].strip()
+      command = line[command_col:].strip()
+      stats = self.cpu_stats.get(f'{command} ({pid})' if pid else command)
+      if stats is None or stats.count == 0:
+        stats_str = ' ' * len(self.STATS_HEADER)
+      else:
+        stats_str = f'{stats.mean:>6.1f}{stats.get_std():>6.1f}{stats.max:>6.1f}{stats.p95.get():>6.1f}{stats.p99.get():>6.1f} '
+      result_lines.append(line[:command_col] + stats_str + line[command_col:])
+    return result_lines
+
+
+  def get_df_total_history(self, time_range: float=None) -> pd.DataFrame:
+    """time_range is the length in seconds to show. None means the raw samples. Rollups (mean) are used for long ranges"""
+    if not self.keep_history:
+      import pandas as pd
+      return pd.DataFrame()
+    return self.total_history.to_dataframe(sort=False, time_range=time_range)
+
 
-    self.df_cpu_history = self.sort_df_in_column(self.df_cpu_history)
-    self.df_mem_history = self.sort_df_in_column(self.df_mem_history)
+  def get_df_cpu_history(self, max_num_process: int=None, time_range: float=None) -> pd.DataFrame:
+    if not self.keep_history:
+      import pandas as pd
+      return pd.DataFrame()
+    return self.cpu_history.to_dataframe(max_num_column=max_num_process, time_range=time_range)
 
-    return self.df_total_history, self.df_cpu_history, self.df_mem_history
+
+  def get_df_mem_history(self, max_num_process: int=None, time_range: float=None) -> pd.DataFrame:
+    if not self.keep_history:
+      import pandas as pd
+      return pd.DataFrame()
+    return self.mem_history.to_dataframe(max_num_column=max_num_process, time_range=time_range)
 
 
   def reset_history(self):
-    self.df_cpu_history = pd.DataFrame()
-    self.df_mem_history = pd.DataFrame()
+    if not self.keep_history:
+      return
+    self.total_history.reset()
+    self.cpu_history.reset()
+    self.mem_history.reset()
 
 
   @staticmethod
-  def sort_df_in_column(df: pd.DataFrame):
-    df = df.sort_values(by=len(df)-1, axis=1, ascending=False)
-    return df
+  def parse_total_value(total_line: str, key: str) -> float:
+    # values may not be separated by space. e.g. "%Cpu(s):100.0 us,  0.0 sy,  0.0 ni,100.0 id"
+    match = re.search(r'([0-9.]+)\s*' + key, total_line)
+    return float(match.group(1)) if match else float('nan')
 
 
   @staticmethod
-  def create_df_from_top(top_runner: TopRunner, lines: list[str], num_process: int):
+  def parse_top(top_runner: TopRunnerBase, lines: list[str], num_process: int):
     # now = datetime.datetime.now()
-    now = int(time.time())
+    now = int(top_runner.frame_time or time.time())
 
     # Get total info
     total_line = None
-    total_user = ''
-    total_sys = ''
-    total_idle = ''
+    total_user = float('nan')
+    total_sys = float('nan')
+    total_idle = float('nan')
     for i, line in enumerate(lines):
       if '%Cpu' in line:
         total_line = line
         break
     if total_line:
-      total_user = total_line.split('us')[0].split()[-1].strip()
-      total_sys = total_line.split('sy')[0].split()[-1].strip()
-      total_idle = total_line.split('id')[0].split()[-1].strip()
-    df_total_current = pd.DataFrame([[now, total_user, total_sys, total_idle]], columns=['datetime', 'user', 'sys', 'idle'])
+      total_user = DataContainer.parse_total_value(total_line, 'us')
+      total_sys = DataContainer.parse_total_value(total_line, 'sy')
+      total_idle = DataContainer.parse_total_value(total_line, 'id')
 
     # Move to line containing process info
     for i, line in enumerate(lines):
@@ -113,19 +243,45 @@ class DataContainer:
     process_list = []
     cpu_list = []
     mem_list = []
-    for i, line in enumerate(lines):
-      if i >= num_process:
-        break
+    pid_list = []
+    rss_list = []
+    # group lines (sums of processes) don't have PID and are not counted in num_process
+    num_process_line = 0
+    for line in lines:
       pid = line[top_runner.col_range_pid[0]:top_runner.col_range_pid[1]].strip()
       command = line[top_runner.col_range_command[0]:].strip()
-      process_name = str(f'{command} ({pid})')
+      if pid:
+        if num_process_line >= num_process:
+          break
+        num_process_line += 1
+        process_name = f'{command} ({pid})'
+      else:
+        process_name = command
       process_list.append(process_name)
+      pid_list.append(pid)
       cpu = float(line[top_runner.col_range_CPU[0]:top_runner.col_range_CPU[1]].strip())
       cpu_list.append(cpu)
       mem = float(line[top_runner.col_range_MEM[0]:top_runner.col_range_MEM[1]].strip())
       mem_list.append(mem)
+      rss_list.append(top_runner.parse_kib(line[top_runner.col_range_RES[0]:top_runner.col_range_RES[1]]))
+
+    return now, [total_user, total_sys, total_idle], process_list, cpu_list, mem_list, pid_list, rss_list
 
-    df_cpu_current = pd.DataFrame([[now] + cpu_list], columns=['datetime'] + process_list)
-    df_mem_current = pd.DataFrame([[now] + mem_list], columns=['datetime'] + process_list)
 
-    return df_total_current, df_cpu_current, df_mem_current
+def create_data_container(args, keep_history=True, profiler: StageProfiler=None) -> DataContainer:
+  remote_agent = None
+  if args.agent:
+    from .remote import RemoteAgent
+    remote_agent = RemoteAgent(args.agent, args.agent_name, args.agent_batch, max_backlog=args.agent_backlog)
+  shared_snapshot = None
+  if args.shm:
+    from .shared_snapshot import SharedSnapshotWriter
+    # IDs of ProcessRegistry are less than max_series
+    shared_snapshot = SharedSnapshotWriter(args.shm, args.max_series if args.max_series > 0 else args.shm_capacity)
+  metrics_exporter = None
+  if args.metrics_port:
+    from .metrics_exporter import MetricsExporter
+    metrics_exporter = MetricsExporter(args.metrics_port, args.metrics_top, args.metrics_allowlist, args.metrics_bind)
+  return DataContainer(args.csv, args.num_history if keep_history else 0, args.csv_max_row, args.csv_max_bytes, args.csv_flush_interval,
+                       args.record_format, profiler, args.max_series, args.evict_after, args.rollup_10s_history, args.rollup_1min_history,
+                       remote_agent, shared_snapshot, metrics_exporter)
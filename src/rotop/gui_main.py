@@ -12,19 +12,37 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import annotations
+from typing import NamedTuple
 import pandas as pd
 import threading
 import time
 import dearpygui.dearpygui as dpg
 
-from .data_container import DataContainer
-from .top_runner import TopRunner
+from .data_container import create_data_container
+from .pipeline import CommandChannel, SnapshotBuffer
+from .profiler import StageProfiler
+from .top_runner import create_top_runner
 from .utility import create_logger
 
 
 logger = create_logger(__name__, log_filename='rotop.log')
 
-g_reset_history_df = False  # todo: add lock
+COMMAND_RESET = 'reset'
+COMMAND_PAUSE = 'pause'
+COMMAND_CPUMEM = 'cpumem'
+COMMAND_PROFILE = 'profile'
+COMMAND_GROUP = 'group'
+GROUP_DEPTH_MAX = 3
+COMMAND_STATS = 'stats'
+COMMAND_RANGE = 'range'
+# time range of graph [sec]. None shows the raw samples kept by --num_history. Longer ranges use rollups
+TIME_RANGE_DICT = {
+  'raw': None,
+  '10 min': 10 * 60,
+  '1 hour': 60 * 60,
+  '6 hours': 6 * 60 * 60,
+  '1 day': 24 * 60 * 60,
+}
 
 COLOR_MAP = (
   # matplotlib.cm.tab20
@@ -72,13 +90,33 @@ COLOR_MAP = (
 )
 
 
+class GuiSnapshot(NamedTuple):
+  result_lines: tuple[str]
+  df_history: pd.DataFrame
+  plot_is_cpu: bool
+  panel_lines: tuple[str]
+
+
 class GuiView:
-  def __init__(self):
+  """
+  Runs in the GUI thread. Takes the latest snapshot from snapshot_buffer at its own frame rate,
+  and sends operations by user to the sampler thread through command_channel.
+  """
+  FIT_AXIS_INTERVAL = 5.0   # [sec]
+
+  def __init__(self, snapshot_buffer: SnapshotBuffer, command_channel: CommandChannel, profiler: StageProfiler):
+    self.snapshot_buffer = snapshot_buffer
+    self.profiler = profiler
+    self.snapshot_version = 0
+    self.command_channel = command_channel
     self.is_exit = False
-    self.pause = False  # todo: add lock
     self.plot_is_cpu = True
     self.dpg_plot_axis_x_id = None
     self.dpg_plot_axis_y_id = None
+    self.dpg_dummy_series_id = None
+    self.series_dict = {}
+    self.is_series_reset_requested = False
+    self.last_fit_time = 0
     self.color_dict = {}
     self.theme_dict = {}
 
@@ -97,11 +135,22 @@ class GuiView:
         self.dpg_button_cpumem = dpg.add_button(label='CPU/MEM', callback=self.cb_button_cpumem)
         self.dpg_button_reset = dpg.add_button(label='RESET', callback=self.cb_button_reset)
         self.dpg_button_pause = dpg.add_button(label='PAUSE', callback=self.cb_button_pause)
+        self.dpg_button_profile = dpg.add_button(label='PROFILE', callback=self.cb_button_profile)
+        self.dpg_button_group = dpg.add_button(label='GROUP', callback=self.cb_button_group)
+        self.dpg_button_stats = dpg.add_button(label='STATS', callback=self.cb_button_stats)
+        self.dpg_combo_range = dpg.add_combo(list(TIME_RANGE_DICT.keys()), default_value='raw', width=80, callback=self.cb_combo_range)
         dpg.add_text('Help(?)')
       with dpg.tooltip(dpg.last_item()):
         dpg.add_text('- CLick "Reset" to clear graph and history.')
+        dpg.add_text('- CLick "Profile" to show timing of rotop itself.')
+        dpg.add_text('- CLick "Group" to change depth of group rows (with --aggregate).')
+        dpg.add_text('- CLick "Stats" to show statistics of processes since start.')
+        dpg.add_text('- Select time range of graph. Mean of 10 seconds or 1 minute is shown for long ranges.')
       with dpg.plot(label=self.get_plot_title(), use_local_time=True, no_title=True) as self.dpg_plot_id:
         self.dpg_plot_axis_x_id =  dpg.add_plot_axis(dpg.mvXAxis, label='datetime', time=True)
+        dpg.add_plot_legend(outside=True, location=dpg.mvPlot_Location_NorthEast)
+        self.dpg_plot_axis_y_id =  dpg.add_plot_axis(dpg.mvYAxis, label=self.get_plot_title(), lock_min=True)
+        self.dpg_dummy_series_id = dpg.add_line_series([], [], label='', parent=self.dpg_plot_axis_y_id)  # dummy for ymax>=100
       self.dpg_text = dpg.add_text()
 
     dpg.set_viewport_resize_callback(self.cb_resize)
@@ -112,6 +161,10 @@ class GuiView:
     # dpg.start_dearpygui()
     while dpg.is_dearpygui_running() and not self.is_exit:
       time.sleep(0.1)
+      snapshot, self.snapshot_version = self.snapshot_buffer.get_latest(self.snapshot_version)
+      if snapshot:
+        with self.profiler.measure('render'):
+          self.update_gui(snapshot)
       dpg.render_dearpygui_frame()
 
     dpg.destroy_context()
@@ -122,19 +175,33 @@ class GuiView:
 
 
   def cb_button_cpumem(self, sender, app_data, user_data):
-    self.plot_is_cpu = not self.plot_is_cpu
-    dpg.set_item_label(self.dpg_plot_id, self.get_plot_title())
+    self.command_channel.send(COMMAND_CPUMEM)
 
 
   def cb_button_reset(self, sender, app_data, user_data):
-    global g_reset_history_df
-    g_reset_history_df = True
-    self.color_dict = {}
-    self.theme_dict = {}
+    self.command_channel.send(COMMAND_RESET)
+    self.is_series_reset_requested = True
 
 
   def cb_button_pause(self, sender, app_data, user_data):
-    self.pause = not self.pause
+    self.command_channel.send(COMMAND_PAUSE)
+
+
+  def cb_button_profile(self, sender, app_data, user_data):
+    self.command_channel.send(COMMAND_PROFILE)
+
+
+  def cb_button_group(self, sender, app_data, user_data):
+    self.command_channel.send(COMMAND_GROUP)
+
+
+  def cb_button_stats(self, sender, app_data, user_data):
+    self.command_channel.send(COMMAND_STATS)
+
+
+  def cb_combo_range(self, sender, app_data, user_data):
+    self.command_channel.send(COMMAND_RANGE, TIME_RANGE_DICT[app_data])
+    self.last_fit_time = 0
 
 
   def cb_resize(self, sender, app_data):
@@ -146,32 +213,57 @@ class GuiView:
     dpg.set_item_height(self.dpg_plot_id, window_height / 2)
 
 
-  def update_gui(self, result_lines:list[str], df_cpu_history:pd.DataFrame, df_mem_history:pd.DataFrame):
-    if self.pause:
+  def update_gui(self, snapshot: GuiSnapshot):
+    if self.is_series_reset_requested:
+      self.is_series_reset_requested = False
+      for series in self.series_dict.values():
+        dpg.delete_item(series)
+      # themes are deleted too, otherwise names seen before keep their colors while new names reuse the palette from the start
+      for theme in self.theme_dict.values():
+        dpg.delete_item(theme)
+      self.series_dict = {}
+      self.color_dict = {}
+      self.theme_dict = {}
+    if self.plot_is_cpu != snapshot.plot_is_cpu:
+      self.plot_is_cpu = snapshot.plot_is_cpu
+      dpg.set_item_label(self.dpg_plot_id, self.get_plot_title())
+      dpg.set_item_label(self.dpg_plot_axis_y_id, self.get_plot_title())
+      self.last_fit_time = 0
+
+    dpg.set_value(self.dpg_text, '\n'.join(snapshot.panel_lines + snapshot.result_lines))
+    df = snapshot.df_history
+    if len(df.columns) == 0:
       return
-    if self.dpg_plot_axis_y_id:
-      dpg.delete_item(self.dpg_plot_axis_y_id)
-    self.dpg_plot_axis_y_id =  dpg.add_plot_axis(dpg.mvYAxis, label=self.get_plot_title(), lock_min=True, parent=self.dpg_plot_id)
-
-    df = df_cpu_history if self.plot_is_cpu else df_mem_history
     col_x = df.columns[0]
     cols_y = df.columns[1:]
-
     x = df[col_x].to_list()
+
+    # Series are created or deleted only when processes appear or disappear. Otherwise, only their values are updated
+    is_series_changed = False
+    for col_y in self.series_dict.keys() - set(cols_y):
+      dpg.delete_item(self.series_dict.pop(col_y))
+      is_series_changed = True
     for col_y in cols_y:
       y = df[col_y].to_list()
-      line_series = dpg.add_line_series(x, y, label=col_y[:min(40, len(col_y))].ljust(40), parent=self.dpg_plot_axis_y_id)
-      theme = self.get_theme(col_y)
-      dpg.bind_item_theme(line_series, theme)
-
+      series = self.series_dict.get(col_y)
+      if series is None:
+        series = dpg.add_line_series(x, y, label=col_y[:min(40, len(col_y))].ljust(40), parent=self.dpg_plot_axis_y_id)
+        dpg.bind_item_theme(series, self.get_theme(col_y))
+        self.series_dict[col_y] = series
+        is_series_changed = True
+      else:
+        dpg.set_value(series, [x, y])
 
-    if  self.plot_is_cpu:
-      dpg.add_line_series([x[0]], [110], label='', parent=self.dpg_plot_axis_y_id)  # dummy for ymax>=100
-    dpg.add_plot_legend(parent=self.dpg_plot_id, outside=True, location=dpg.mvPlot_Location_NorthEast)
-    dpg.fit_axis_data(self.dpg_plot_axis_x_id)
-    dpg.fit_axis_data(self.dpg_plot_axis_y_id)
+    if self.plot_is_cpu:
+      dpg.set_value(self.dpg_dummy_series_id, [[x[0]], [110]])
+    else:
+      dpg.set_value(self.dpg_dummy_series_id, [[], []])
 
-    dpg.set_value(self.dpg_text, '\n'.join(result_lines))
+    now = time.time()
+    if is_series_changed or now - self.last_fit_time >= self.FIT_AXIS_INTERVAL:
+      self.last_fit_time = now
+      dpg.fit_axis_data(self.dpg_plot_axis_x_id)
+      dpg.fit_axis_data(self.dpg_plot_axis_y_id)
 
 
   def get_color(self, process_name)->tuple[int]:
@@ -199,36 +291,65 @@ def gui_loop(view: GuiView):
 
 
 def gui_main(args):
-  global g_reset_history_df
-  top_runner = TopRunner(args.interval, args.filter)
-  data_container = DataContainer(args.csv)
-
-  view = GuiView()
+  profiler = StageProfiler()
+  top_runner = create_top_runner(args.backend, args.interval, args.filter, args.replay, args.replay_speed,
+                                 args.threads, args.aggregate, args.aggregator)
+  data_container = create_data_container(args, profiler=profiler)
+  top_runner.set_record_dir(data_container.csv_dir_name)
+
+  snapshot_buffer = SnapshotBuffer()
+  command_channel = CommandChannel()
+  view = GuiView(snapshot_buffer, command_channel, profiler)
   gui_thread = threading.Thread(target=gui_loop, args=(view,))
   gui_thread.start()
 
+  pause = False
+  plot_is_cpu = True
+  show_profile = False
+  show_stats = False
+  time_range = None
   try:
-    while True:
-      if g_reset_history_df:
-        data_container.reset_history()
-        g_reset_history_df = False
-
-      result_lines, result_show_all_lines = top_runner.run(args.num_process, True, args.only_ros)
+    while gui_thread.is_alive():
+      for command, value in command_channel.receive_all():
+        if command == COMMAND_RESET:
+          data_container.reset_history()
+        elif command == COMMAND_PAUSE:
+          pause = not pause
+        elif command == COMMAND_CPUMEM:
+          plot_is_cpu = not plot_is_cpu
+        elif command == COMMAND_PROFILE:
+          show_profile = not show_profile
+        elif command == COMMAND_STATS:
+          show_stats = not show_stats
+        elif command == COMMAND_GROUP:
+          top_runner.group_depth = (top_runner.group_depth + 1) % (GROUP_DEPTH_MAX + 1)
+        elif command == COMMAND_RANGE:
+          time_range = value
+
+      with profiler.measure('sample'):
+        result_lines, result_show_all_lines = top_runner.run(args.num_process, True, args.only_ros)
       if result_show_all_lines is None:
         time.sleep(0.1)
         continue
 
-      _, df_cpu_history, df_mem_history = data_container.run(top_runner, result_show_all_lines, args.num_process)
-      df_cpu_history = df_cpu_history.iloc[:, :min(args.num_process, len(df_cpu_history.columns))]
-      df_mem_history = df_mem_history.iloc[:, :min(args.num_process, len(df_mem_history.columns))]
-
-      if gui_thread.is_alive():
-        view.update_gui(result_lines, df_cpu_history, df_mem_history)
-      else:
-        break
+      data_container.run(top_runner, result_show_all_lines, args.num_process)
+      if pause:
+        continue
+      with profiler.measure('snapshot'):
+        if plot_is_cpu:
+          df_history = data_container.get_df_cpu_history(args.num_process, time_range)
+        else:
+          df_history = data_container.get_df_mem_history(args.num_process, time_range)
+        panel_lines = tuple(profiler.create_lines() + ['']) if show_profile else ()
+        if show_stats:
+          result_lines = data_container.add_stats_columns(top_runner, result_lines)
+        snapshot_buffer.publish(GuiSnapshot(tuple(result_lines), df_history, plot_is_cpu, panel_lines))
 
   except KeyboardInterrupt:
     pass
 
+  data_container.close()
+  if args.profile_json:
+    profiler.dump_json(args.profile_json)
   view.exit()
   gui_thread.join()
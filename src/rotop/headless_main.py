@@ -0,0 +1,146 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import json
+import os
+import resource
+import signal
+import time
+
+from .data_container import create_data_container
+from .profiler import StageProfiler
+from .top_runner import create_top_runner
+from .utility import create_logger
+
+
+logger = create_logger(__name__, log_filename='rotop.log')
+
+
+class SelfOverheadReporter:
+  """
+  Measure CPU time and memory used by rotop itself (including top command as a child process).
+  CPU time spent before the reporter is created (startup) is excluded.
+  RUSAGE_CHILDREN counts only children which have been waited for, so CPU time of running children is read from /proc.
+  """
+  REPORT_FILENAME = 'self_overhead.json'
+
+  def __init__(self, dir_name: str, child_pid_list: list[int]=()):
+    self.file_path = os.path.join(dir_name, self.REPORT_FILENAME)
+    self.child_pid_list = list(child_pid_list)
+    self.start_time = time.time()
+    self.start_monotonic = time.monotonic()
+    self.num_sample = 0
+    self.start_cpu_time = self.get_cpu_time()
+
+
+  def get_cpu_time(self) -> tuple[float, float]:
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_user = usage_self.ru_utime + usage_children.ru_utime
+    cpu_sys = usage_self.ru_stime + usage_children.ru_stime
+    for pid in self.child_pid_list:
+      child_user, child_sys = self.get_running_child_cpu_time(pid)
+      cpu_user += child_user
+      cpu_sys += child_sys
+    return (cpu_user, cpu_sys)
+
+
+  @staticmethod
+  def get_running_child_cpu_time(pid: int) -> tuple[float, float]:
+    """utime and stime of a running process. (0, 0) if it has finished (then it's counted in RUSAGE_CHILDREN)"""
+    try:
+      with open(f'/proc/{pid}/stat', 'r') as f:
+        # fields after the command, which may contain spaces and ')'. utime and stime are the 14th and 15th fields
+        field_list = f.read().rpartition(')')[2].split()
+      clock_tick = os.sysconf('SC_CLK_TCK')
+      return (int(field_list[11]) / clock_tick, int(field_list[12]) / clock_tick)
+    except (FileNotFoundError, ProcessLookupError, IndexError, ValueError):
+      return (0.0, 0.0)
+
+
+  def create_report(self) -> dict:
+    elapsed = max(time.monotonic() - self.start_monotonic, 1e-6)
+    cpu_user, cpu_sys = self.get_cpu_time()
+    cpu_user -= self.start_cpu_time[0]
+    cpu_sys -= self.start_cpu_time[1]
+    cpu_time = cpu_user + cpu_sys
+    return {
+      'start_time': self.start_time,
+      'elapsed_sec': elapsed,
+      'num_sample': self.num_sample,
+      'cpu_user_sec': cpu_user,
+      'cpu_sys_sec': cpu_sys,
+      'cpu_percent': cpu_time * 100 / elapsed,
+      'cpu_sec_per_sample': cpu_time / self.num_sample if self.num_sample > 0 else None,
+      'rss_kib': self.get_current_rss_kib(),
+      'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+  def write(self):
+    tmp_file_path = self.file_path + '.tmp'
+    with open(tmp_file_path, 'w', encoding='utf-8') as f:
+      json.dump(self.create_report(), f, indent=2)
+    os.replace(tmp_file_path, self.file_path)
+
+
+  @staticmethod
+  def get_current_rss_kib() -> int:
+    try:
+      with open('/proc/self/statm', 'r') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (FileNotFoundError, IndexError, ValueError):
+      return None
+
+
+def headless_main(args):
+  """Only sample and record data (or send it with --agent) without any view. Stop by SIGTERM or SIGINT"""
+  args.csv = args.csv or not args.agent
+  profiler = StageProfiler()
+  top_runner = create_top_runner(args.backend, args.interval, args.filter, args.replay, args.replay_speed,
+                                 args.threads, args.aggregate, args.aggregator)
+  data_container = create_data_container(args, keep_history=False, profiler=profiler)
+  top_runner.set_record_dir(data_container.csv_dir_name)
+  # the overhead report is written only when recording
+  reporter = SelfOverheadReporter(data_container.csv_dir_name, top_runner.get_child_pid_list()) if data_container.csv_dir_name else None
+  if data_container.csv_dir_name:
+    logger.info(f'recording to {data_container.csv_dir_name}')
+
+  is_exit = False
+  def request_exit(signum, frame):
+    nonlocal is_exit
+    is_exit = True
+  signal.signal(signal.SIGTERM, request_exit)
+  signal.signal(signal.SIGINT, request_exit)
+
+  try:
+    while not is_exit:
+      with profiler.measure('sample'):
+        result_lines, result_show_all_lines = top_runner.run(args.num_process, True, args.only_ros)
+      if result_show_all_lines is None:
+        if top_runner.is_finished():
+          break
+        time.sleep(0.1)
+        continue
+      data_container.run(top_runner, result_show_all_lines, args.num_process)
+      if reporter:
+        reporter.num_sample += 1
+        if reporter.num_sample % args.report_interval == 0:
+          reporter.write()
+  finally:
+    data_container.close()
+    if reporter:
+      reporter.write()
+    if args.profile_json:
+      profiler.dump_json(args.profile_json)
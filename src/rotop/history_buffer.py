@@ -0,0 +1,243 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+
+
+class HistoryBuffer:
+  """
+  Preallocated ring buffer holding one row per sample and one column slot per series (process).
+  Appending a sample and evicting the oldest one are O(1) regarding the history length.
+  DataFrame is created only when requested.
+  If max_num_column is set, columns not in the appended sample are dropped (most stale first) to keep the number of columns.
+  """
+  INITIAL_NUM_COLUMN = 64
+
+  def __init__(self, max_num_history: int, max_num_column: int=0):
+    self.max_num_history = max_num_history
+    self.max_num_column = max_num_column
+    self.reset()
+
+
+  def reset(self):
+    self.timestamps = np.zeros(self.max_num_history, dtype=np.float64)
+    self.values = np.full((self.max_num_history, self.INITIAL_NUM_COLUMN), np.nan, dtype=np.float64)
+    self.column_name_list: list[str] = []
+    self.column_index_dict: dict[str, int] = {}
+    self.head = 0   # index to be written next
+    self.size = 0
+
+
+  def __len__(self):
+    return self.size
+
+
+  def append(self, timestamp: float, name_list: list[str], value_list: list[float]):
+    if any(name not in self.column_index_dict for name in name_list):
+      self.add_columns(name_list)
+    index_list = [self.column_index_dict[name] for name in name_list]
+    row = self.head
+    self.timestamps[row] = timestamp
+    self.values[row, :len(self.column_name_list)] = np.nan
+    self.values[row, index_list] = value_list
+    self.head = (self.head + 1) % self.max_num_history
+    self.size = min(self.size + 1, self.max_num_history)
+
+
+  def add_columns(self, name_list: list[str]):
+    """Assign column slots to names which don't have a slot yet"""
+    new_name_list = [name for name in name_list if name not in self.column_index_dict]
+    if len(self.column_name_list) + len(new_name_list) > self.values.shape[1]:
+      self.compact()
+      new_name_list = [name for name in name_list if name not in self.column_index_dict]
+    if self.max_num_column > 0 and len(self.column_name_list) + len(new_name_list) > self.max_num_column:
+      self.drop_stale_columns(len(self.column_name_list) + len(new_name_list) - self.max_num_column, set(name_list))
+    while len(self.column_name_list) + len(new_name_list) > self.values.shape[1]:
+      self.values = np.concatenate([self.values, np.full(self.values.shape, np.nan, dtype=np.float64)], axis=1)
+    for name in new_name_list:
+      self.column_index_dict[name] = len(self.column_name_list)
+      self.column_name_list.append(name)
+
+
+  def compact(self):
+    """Release column slots which don't have any value in the current window (e.g. finished process)"""
+    num_column = len(self.column_name_list)
+    alive = ~np.all(np.isnan(self.values[:, :num_column]), axis=0)
+    if alive.all():
+      return
+    alive_index = np.flatnonzero(alive)
+    self.values[:, :len(alive_index)] = self.values[:, alive_index]
+    self.values[:, len(alive_index):] = np.nan
+    self.column_name_list = [self.column_name_list[i] for i in alive_index]
+    self.column_index_dict = {name: i for i, name in enumerate(self.column_name_list)}
+
+
+  def drop_stale_columns(self, num_drop: int, keep_name_set: set[str]):
+    """Drop columns whose last value is the oldest, except the ones in keep_name_set"""
+    num_column = len(self.column_name_list)
+    if self.size == 0:
+      # e.g. the first flush of a rollup, or after reset. argmax can't be applied to empty rows
+      last_row = np.full(num_column, -1)
+    else:
+      values = self.values[self.get_ordered_index(), :num_column]
+      has_value = ~np.isnan(values)
+      last_row = np.where(has_value.any(axis=0), values.shape[0] - 1 - np.argmax(has_value[::-1], axis=0), -1)
+    candidate_index = [i for i in np.argsort(last_row, kind='stable') if self.column_name_list[i] not in keep_name_set]
+    keep = np.ones(num_column, dtype=bool)
+    keep[candidate_index[:num_drop]] = False
+    keep_index = np.flatnonzero(keep)
+    self.values[:, :len(keep_index)] = self.values[:, keep_index]
+    self.values[:, len(keep_index):] = np.nan
+    self.column_name_list = [self.column_name_list[i] for i in keep_index]
+    self.column_index_dict = {name: i for i, name in enumerate(self.column_name_list)}
+
+
+  def get_ordered_index(self) -> np.ndarray:
+    """Row indices from the oldest to the newest"""
+    start = (self.head - self.size) % self.max_num_history
+    return (np.arange(self.size) + start) % self.max_num_history
+
+
+  def get_latest(self) -> dict[str, float]:
+    if self.size == 0:
+      return {}
+    row = self.values[(self.head - 1) % self.max_num_history]
+    return {name: row[i] for i, name in enumerate(self.column_name_list) if not np.isnan(row[i])}
+
+
+  def to_dataframe(self, sort=True, max_num_column: int=None) -> pd.DataFrame:
+    """
+    Create DataFrame whose first column is 'datetime' and the others are series.
+    If sort is True, series are sorted by the latest value in descending order
+    """
+    if self.size == 0:
+      return pd.DataFrame()
+    rows = self.get_ordered_index()
+    num_column = len(self.column_name_list)
+    values = self.values[rows, :num_column]
+    column_index = np.flatnonzero(~np.all(np.isnan(values), axis=0))
+    if sort:
+      latest = np.nan_to_num(values[-1, column_index], nan=-np.inf)
+      column_index = column_index[np.argsort(-latest, kind='stable')]
+    if max_num_column is not None:
+      column_index = column_index[:max_num_column]
+    df = pd.DataFrame(values[:, column_index], columns=[self.column_name_list[i] for i in column_index])
+    df.insert(0, 'datetime', self.timestamps[rows])
+    return df
+
+
+class RollupTier:
+  """
+  Min / mean / max of each series over fixed periods (e.g. 10 seconds), kept in HistoryBuffers.
+  Samples are accumulated into the current period, which is appended when a sample of the next period arrives.
+  """
+  KIND_LIST = ['min', 'mean', 'max']
+
+  def __init__(self, period: float, max_num_history: int, max_num_column: int=0):
+    self.period = period
+    self.max_num_column = max_num_column
+    self.buffer_dict = {kind: HistoryBuffer(max_num_history, max_num_column) for kind in self.KIND_LIST}
+    self.reset()
+
+
+  def reset(self):
+    for buffer in self.buffer_dict.values():
+      buffer.reset()
+    self.current_period = None
+    self.accumulator_dict: dict[str, list[float]] = {}   # name -> [count, sum, min, max]
+
+
+  def add(self, timestamp: float, name_list: list[str], value_list: list[float]):
+    period = timestamp // self.period
+    if self.current_period is not None and period != self.current_period:
+      self.flush()
+    self.current_period = period
+    for name, value in zip(name_list, value_list):
+      if value != value:  # NaN
+        continue
+      accumulator = self.accumulator_dict.get(name)
+      if accumulator is None:
+        self.accumulator_dict[name] = [1, value, value, value]
+      else:
+        accumulator[0] += 1
+        accumulator[1] += value
+        if value < accumulator[2]:
+          accumulator[2] = value
+        if value > accumulator[3]:
+          accumulator[3] = value
+
+
+  def flush(self):
+    if not self.accumulator_dict:
+      return
+    timestamp = self.current_period * self.period
+    accumulator_dict = self.accumulator_dict
+    if self.max_num_column > 0 and len(accumulator_dict) > self.max_num_column:
+      # more series than columns were seen in this period (e.g. process churn). Keep the ones with the highest peak
+      name_list = sorted(accumulator_dict.keys(), key=lambda name: accumulator_dict[name][3], reverse=True)[:self.max_num_column]
+      accumulator_dict = {name: accumulator_dict[name] for name in name_list}
+    name_list = list(accumulator_dict.keys())
+    accumulator_list = accumulator_dict.values()
+    self.buffer_dict['min'].append(timestamp, name_list, [accumulator[2] for accumulator in accumulator_list])
+    self.buffer_dict['mean'].append(timestamp, name_list, [accumulator[1] / accumulator[0] for accumulator in accumulator_list])
+    self.buffer_dict['max'].append(timestamp, name_list, [accumulator[3] for accumulator in accumulator_list])
+    self.accumulator_dict = {}
+
+
+class TieredHistory:
+  """
+  Raw samples for a short window, plus rollups (e.g. 10 seconds and 1 minute) for longer windows.
+  Rollups are updated incrementally as samples arrive. A DataFrame is created from the finest tier covering the requested time range.
+  """
+  def __init__(self, max_num_history: int, max_num_column: int=0, tier_list: list[tuple[float, int]]=()):
+    """tier_list is [(period in seconds, number of periods kept)] from fine to coarse"""
+    self.raw = HistoryBuffer(max_num_history, max_num_column)
+    self.tier_list = [RollupTier(period, num, max_num_column) for period, num in tier_list if num > 0]
+
+
+  def __len__(self):
+    return len(self.raw)
+
+
+  def reset(self):
+    self.raw.reset()
+    for tier in self.tier_list:
+      tier.reset()
+
+
+  def append(self, timestamp: float, name_list: list[str], value_list: list[float]):
+    self.raw.append(timestamp, name_list, value_list)
+    for tier in self.tier_list:
+      tier.add(timestamp, name_list, value_list)
+
+
+  def select_buffer(self, time_range: float=None, kind: str='mean') -> HistoryBuffer:
+    if time_range is None or len(self.raw) == 0 or not self.tier_list:
+      return self.raw
+    start = self.raw.timestamps[(self.raw.head - 1) % self.raw.max_num_history] - time_range
+    candidate_list = [self.raw] + [tier.buffer_dict[kind] for tier in self.tier_list]
+    for buffer in candidate_list:
+      if len(buffer) > 0 and buffer.timestamps[buffer.get_ordered_index()[0]] <= start:
+        return buffer
+    # no tier covers the whole range. Use the one covering the longest
+    return min((buffer for buffer in candidate_list if len(buffer) > 0), key=lambda buffer: buffer.timestamps[buffer.get_ordered_index()[0]])
+
+
+  def to_dataframe(self, sort=True, max_num_column: int=None, time_range: float=None, kind: str='mean') -> pd.DataFrame:
+    """time_range is the length in seconds until the latest sample. None means the raw window"""
+    df = self.select_buffer(time_range, kind).to_dataframe(sort, max_num_column)
+    if time_range is not None and len(df) > 0:
+      df = df[df['datetime'] >= df['datetime'].iloc[-1] - time_range]
+    return df
@@ -0,0 +1,62 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+from typing import Callable, Hashable
+import re
+
+
+class ProcessIdentity:
+  __slots__ = ('name', 'is_ros', 'is_match_filter', 'namespace')
+
+  def __init__(self, name: str, is_ros: bool, is_match_filter: bool, namespace: str=None):
+    self.name = name
+    self.is_ros = is_ros
+    self.is_match_filter = is_match_filter
+    self.namespace = namespace
+
+
+class ProcessIdentityCache:
+  """
+  Cache of results which don't change during the lifetime of a process (display name, ROS or not, filter verdict, ROS namespace).
+  Key is something identifying a process, e.g. (PID, start time).
+  Entries not used during one frame are evicted by swapping two generations, so the cost of eviction is O(1).
+  """
+  def __init__(self, filter_re: re.Pattern, ros_re: re.Pattern, parse_command: Callable[[str], str], parse_namespace: Callable[[str], str]):
+    self.filter_re = filter_re
+    self.ros_re = ros_re
+    self.parse_command = parse_command
+    self.parse_namespace = parse_namespace
+    self.current_dict: dict[Hashable, ProcessIdentity] = {}
+    self.previous_dict: dict[Hashable, ProcessIdentity] = {}
+
+
+  def __len__(self):
+    return len(self.current_dict) + len(self.previous_dict)
+
+
+  def get(self, key: Hashable, command: str) -> ProcessIdentity:
+    identity = self.current_dict.get(key)
+    if identity is None:
+      identity = self.previous_dict.pop(key, None)
+      if identity is None:
+        identity = ProcessIdentity(self.parse_command(command), self.ros_re.match(command) is not None, self.filter_re.match(command) is not None,
+                                   self.parse_namespace(command))
+      self.current_dict[key] = identity
+    return identity
+
+
+  def next_generation(self):
+    """Call once per frame. Entries of processes which didn't appear in the frame are discarded"""
+    self.previous_dict = self.current_dict
+    self.current_dict = {}
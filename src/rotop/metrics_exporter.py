@@ -0,0 +1,156 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import re
+import threading
+
+from .utility import create_logger
+
+
+logger = create_logger(__name__, log_filename='rotop.log')
+
+
+def escape_label(value: str) -> str:
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value: float) -> str:
+  return 'NaN' if value != value else repr(float(value))
+
+
+def strip_pid(name: str) -> str:
+  """'node_name (1234)' -> 'node_name', so that a restarted process keeps its series"""
+  command, separator, pid = name.rpartition(' (')
+  return command if separator and pid.endswith(')') and pid[:-1].isdigit() else name
+
+
+class MetricsExporter:
+  """
+  Serve /metrics in Prometheus text format (or OpenMetrics if requested by Accept header) from the latest sample.
+  The exposition is built once per sample and cached, so the cost of scraping doesn't depend on the scrape frequency.
+  Processes are labeled by name without PID, and values of processes with the same name are summed.
+  To bound the number of series, only names matching the allowlist and the top max_num_process names by %CPU are exported.
+  The others are summed into 'other'.
+  """
+  CONTENT_TYPE_TEXT = 'text/plain; version=0.0.4; charset=utf-8'
+  CONTENT_TYPE_OPENMETRICS = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+  OTHER_NAME = 'other'
+
+  def __init__(self, port: int, max_num_process: int=20, allowlist: str=None, bind: str='127.0.0.1'):
+    """Listen only on localhost by default, because the metrics expose the process list of this host"""
+    self.max_num_process = max_num_process
+    self.allowlist_re = re.compile(allowlist) if allowlist else None
+    self.lock = threading.Lock()
+    self.exposition = b''
+    exporter = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+          self.send_error(404)
+          return
+        is_openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+        body = exporter.get_exposition(is_openmetrics)
+        self.send_response(200)
+        self.send_header('Content-Type', exporter.CONTENT_TYPE_OPENMETRICS if is_openmetrics else exporter.CONTENT_TYPE_TEXT)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        # don't write to stderr, which is used by curses
+        logger.debug(format % args)
+
+    self.server = ThreadingHTTPServer((bind, port), Handler)
+    self.server.daemon_threads = True
+    self.port = self.server.server_address[1]
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+    logger.info(f'Metrics are served on {bind}:{self.port}')
+
+
+  def get_exposition(self, is_openmetrics: bool=False) -> bytes:
+    with self.lock:
+      exposition = self.exposition
+    return exposition + b'# EOF\n' if is_openmetrics else exposition
+
+
+  def update(self, timestamp: float, total_list: list[float], name_list: list[str], pid_list: list[int],
+             cpu_list: list[float], mem_list: list[float], rss_list: list[int]):
+    """Rows whose pid is 0 are groups (--aggregate) except 'other'. rss is in KiB"""
+    process_dict: dict[str, list] = {}   # name -> [cpu, mem, rss, num_process]
+    group_dict: dict[str, list] = {}
+    for name, pid, cpu, mem, rss in zip(name_list, pid_list, cpu_list, mem_list, rss_list):
+      target_dict = group_dict if not pid and name != self.OTHER_NAME else process_dict
+      values = target_dict.setdefault(strip_pid(name), [0.0, 0.0, 0, 0])
+      values[0] += cpu if cpu == cpu else 0.0
+      values[1] += mem if mem == mem else 0.0
+      values[2] += rss
+      values[3] += 1
+
+    lines = [
+      '# HELP rotop_last_sample_timestamp_seconds Time of the latest sample.',
+      '# TYPE rotop_last_sample_timestamp_seconds gauge',
+      f'rotop_last_sample_timestamp_seconds {format_value(timestamp)}',
+      '# HELP rotop_system_cpu_percent CPU usage of the system.',
+      '# TYPE rotop_system_cpu_percent gauge',
+    ]
+    for mode, value in zip(['user', 'sys', 'idle'], total_list):
+      lines.append(f'rotop_system_cpu_percent{{mode="{mode}"}} {format_value(value)}')
+    process_dict = self.limit_cardinality(process_dict)
+    self.add_metric(lines, 'rotop_process_cpu_percent', 'CPU usage of processes with the same name (100 is one core).', 'name', process_dict, 0)
+    self.add_metric(lines, 'rotop_process_memory_percent', 'Memory usage of processes with the same name.', 'name', process_dict, 1)
+    self.add_metric(lines, 'rotop_process_resident_memory_bytes', 'Resident memory of processes with the same name.', 'name', process_dict, 2, 1024)
+    self.add_metric(lines, 'rotop_process_count', 'Number of processes with the same name.', 'name', process_dict, 3)
+    if group_dict:
+      group_dict = self.limit_cardinality(group_dict)
+      self.add_metric(lines, 'rotop_group_cpu_percent', 'CPU usage of groups by ROS namespace or launch subtree.', 'group', group_dict, 0)
+      self.add_metric(lines, 'rotop_group_memory_percent', 'Memory usage of groups by ROS namespace or launch subtree.', 'group', group_dict, 1)
+    exposition = ('\n'.join(lines) + '\n').encode('utf-8')
+    with self.lock:
+      self.exposition = exposition
+
+
+  def limit_cardinality(self, value_dict: dict[str, list]) -> dict[str, list]:
+    name_list = sorted(value_dict.keys(), key=lambda name: value_dict[name][0], reverse=True)
+    result_dict = {}
+    other = None
+    num_top = 0
+    for name in name_list:
+      is_allowed = bool(self.allowlist_re and self.allowlist_re.search(name))
+      if name != self.OTHER_NAME and (is_allowed or num_top < self.max_num_process):
+        num_top += 0 if is_allowed else 1
+        result_dict[name] = value_dict[name]
+        continue
+      other = other or [0.0, 0.0, 0, 0]
+      for i, value in enumerate(value_dict[name]):
+        other[i] += value
+    if other:
+      result_dict[self.OTHER_NAME] = other
+    return result_dict
+
+
+  @staticmethod
+  def add_metric(lines: list[str], metric: str, help: str, label: str, value_dict: dict[str, list], index: int, scale: int=1):
+    lines.append(f'# HELP {metric} {help}')
+    lines.append(f'# TYPE {metric} gauge')
+    for name, values in value_dict.items():
+      value = values[index] * scale
+      lines.append(f'{metric}{{{label}="{escape_label(name)}"}} {value if isinstance(value, int) else format_value(value)}')
+
+
+  def close(self):
+    self.server.shutdown()
+    self.server.server_close()
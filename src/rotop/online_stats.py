@@ -0,0 +1,153 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import csv
+import math
+
+
+class P2Quantile:
+  """
+  Streaming estimation of a quantile with constant memory (P-square algorithm by Jain and Chlamtac).
+  Five markers are kept and their heights are adjusted with piecewise-parabolic interpolation.
+  """
+  __slots__ = ('p', 'count', 'heights', 'positions', 'desired_positions', 'increments')
+
+  def __init__(self, p: float):
+    self.p = p
+    self.count = 0
+    self.heights: list[float] = []
+    self.positions = [1, 2, 3, 4, 5]
+    self.desired_positions = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+    self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+
+  def add(self, x: float):
+    self.count += 1
+    heights = self.heights
+    if self.count <= 5:
+      heights.append(x)
+      if self.count == 5:
+        heights.sort()
+      return
+
+    if x < heights[0]:
+      heights[0] = x
+      k = 0
+    elif x >= heights[4]:
+      heights[4] = x
+      k = 3
+    else:
+      k = 0
+      while x >= heights[k + 1]:
+        k += 1
+    positions = self.positions
+    for i in range(k + 1, 5):
+      positions[i] += 1
+    for i in range(5):
+      self.desired_positions[i] += self.increments[i]
+
+    for i in range(1, 4):
+      d = self.desired_positions[i] - positions[i]
+      if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+        d = 1 if d > 0 else -1
+        height = self.parabolic(i, d)
+        if not heights[i - 1] < height < heights[i + 1]:
+          height = heights[i] + d * (heights[i + d] - heights[i]) / (positions[i + d] - positions[i])
+        heights[i] = height
+        positions[i] += d
+
+
+  def parabolic(self, i: int, d: int) -> float:
+    q = self.heights
+    n = self.positions
+    return q[i] + d / (n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                                               + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+
+  def get(self) -> float:
+    if self.count == 0:
+      return math.nan
+    if self.count <= 5:
+      return sorted(self.heights)[round(self.p * (self.count - 1))]
+    return self.heights[2]
+
+
+class RunningStats:
+  """Mean and variance (Welford), min, max, p95 and p99 of one series, updated one value at a time"""
+  __slots__ = ('count', 'mean', 'm2', 'min', 'max', 'p95', 'p99')
+
+  def __init__(self):
+    self.count = 0
+    self.mean = 0.0
+    self.m2 = 0.0
+    self.min = math.inf
+    self.max = -math.inf
+    self.p95 = P2Quantile(0.95)
+    self.p99 = P2Quantile(0.99)
+
+
+  def add(self, x: float):
+    if math.isnan(x):
+      return
+    self.count += 1
+    delta = x - self.mean
+    self.mean += delta / self.count
+    self.m2 += delta * (x - self.mean)
+    self.min = min(self.min, x)
+    self.max = max(self.max, x)
+    self.p95.add(x)
+    self.p99.add(x)
+
+
+  def get_std(self) -> float:
+    """Sample standard deviation, same as pandas"""
+    return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else math.nan
+
+
+class StatsTable:
+  """RunningStats of each series. Statistics of finished processes are kept until the end of the capture"""
+  COLUMN_LIST = ['name', 'count', 'mean', 'std', 'min', 'max', 'p95', 'p99']
+
+  def __init__(self):
+    self.stats_dict: dict[str, RunningStats] = {}
+
+
+  def __len__(self):
+    return len(self.stats_dict)
+
+
+  def update(self, name_list: list[str], value_list: list[float]):
+    for name, value in zip(name_list, value_list):
+      stats = self.stats_dict.get(name)
+      if stats is None:
+        stats = RunningStats()
+        self.stats_dict[name] = stats
+      stats.add(value)
+
+
+  def get(self, name: str) -> RunningStats:
+    return self.stats_dict.get(name)
+
+
+  def get_sorted_list(self) -> list[tuple[str, RunningStats]]:
+    """Sorted by mean in descending order"""
+    return sorted(((name, stats) for name, stats in self.stats_dict.items() if stats.count > 0), key=lambda item: item[1].mean, reverse=True)
+
+
+  def write_csv(self, file_path: str):
+    with open(file_path, 'w', newline='', encoding='utf-8') as f:
+      writer = csv.writer(f)
+      writer.writerow(self.COLUMN_LIST)
+      for name, stats in self.get_sorted_list():
+        writer.writerow([name, stats.count, stats.mean, stats.get_std(), stats.min, stats.max, stats.p95.get(), stats.p99.get()])
@@ -0,0 +1,62 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+from typing import Any
+import queue
+import threading
+
+
+class SnapshotBuffer:
+  """
+  Holds only the latest snapshot published by the sampler thread.
+  The publisher never waits for the consumer, and the consumer takes the latest one at its own rate.
+  Snapshots must not be modified after they are published.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.snapshot = None
+    self.version = 0
+
+
+  def publish(self, snapshot: Any):
+    with self.lock:
+      self.snapshot = snapshot
+      self.version += 1
+
+
+  def get_latest(self, last_version: int) -> tuple[Any, int]:
+    """Return (snapshot, version) if a newer snapshot than last_version exists, otherwise (None, last_version)"""
+    with self.lock:
+      if self.version == last_version:
+        return None, last_version
+      return self.snapshot, self.version
+
+
+class CommandChannel:
+  """Commands from the view (e.g. button callbacks) to the sampler thread"""
+  def __init__(self):
+    self.queue = queue.SimpleQueue()
+
+
+  def send(self, command: str, value: Any=None):
+    self.queue.put((command, value))
+
+
+  def receive_all(self) -> list[tuple[str, Any]]:
+    command_list = []
+    while True:
+      try:
+        command_list.append(self.queue.get_nowait())
+      except queue.Empty:
+        return command_list
@@ -0,0 +1,365 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import os
+import pwd
+import time
+
+from .top_runner import TopRunnerBase
+from .utility import create_logger
+
+
+logger = create_logger(__name__, log_filename='rotop.log')
+
+
+class ProcRunner(TopRunnerBase):
+  """
+  Sampler reading /proc directly instead of running `top`.
+  %CPU is calculated from the difference of jiffies between two frames, in the same manner as top (100% = 1 core).
+  In thread mode, threads of each multi-threaded process are rolled up by their name (comm), e.g. executor threads of a
+  component container, and shown as rows following the process row.
+  """
+  PROC_DIR = '/proc'
+  THREAD_SEPARATOR = ' \\_ '
+  LINE_FORMAT = '{:>7} {:<8} {:>3} {:>3} {:>7} {:>6} {:>6} {:1} {:>5} {:>5} {:>9} {}'
+  HEADER = LINE_FORMAT.format('PID', 'USER', 'PR', 'NI', 'VIRT', 'RES', 'SHR', 'S', '%CPU', '%MEM', 'TIME+', 'COMMAND')
+
+  def __init__(self, interval, filter, threads=False):
+    super().__init__(interval, filter)
+    self.threads = threads
+    self.clk_tck = os.sysconf('SC_CLK_TCK')
+    self.page_kib = os.sysconf('SC_PAGE_SIZE') // 1024
+    self.user_name_dict = {}
+    self.prev_cpu_jiffies = None
+    self.prev_uptime_jiffies = 0
+    self.prev_process_jiffies = {}
+    self.next_time = 0
+    self.starttime_dict: dict[int, int] = {}
+    self.ppid_dict: dict[int, int] = {}
+    # (command, user) of each (pid, starttime). Entries of finished processes are discarded in the next frame
+    self.static_info_dict: dict[tuple[int, int], tuple[str, str]] = {}
+    self.previous_static_info_dict: dict[tuple[int, int], tuple[str, str]] = {}
+    # {tid: (comm, jiffies, starttime)} of each pid in the previous frame. Only tables of processes which consumed CPU are re-read
+    self.prev_thread_table_dict: dict[int, dict[int, tuple[str, int, int]]] = {}
+
+
+  @staticmethod
+  def is_available() -> bool:
+    return os.path.isfile(os.path.join(ProcRunner.PROC_DIR, 'stat'))
+
+
+  def get_wait_time(self) -> float:
+    return max(self.next_time - time.monotonic(), 0)
+
+
+  def read_frame(self) -> list[str]:
+    now = time.monotonic()
+    if now < self.next_time:
+      time.sleep(self.next_time - now)
+    self.next_time = max(self.next_time + self.interval, time.monotonic())
+
+    is_first = self.prev_cpu_jiffies is None
+    cpu_jiffies = self.read_cpu_jiffies()
+    uptime = self.read_uptime()
+    process_list = self.read_process_list()
+    if is_first:
+      self.update_previous(cpu_jiffies, uptime, process_list)
+      return None
+
+    # jiffies elapsed per core during the interval
+    num_cpu = max(cpu_jiffies[-1], 1)
+    delta_cpu_jiffies = [cur - prev for cur, prev in zip(cpu_jiffies[:-1], self.prev_cpu_jiffies[:-1])]
+    delta_total = max(sum(delta_cpu_jiffies), 1)
+    delta_per_core = delta_total / num_cpu
+
+    mem_info = self.read_mem_info()
+    mem_total = max(mem_info.get('MemTotal', 1), 1)
+    for process in process_list:
+      prev_jiffies = self.prev_process_jiffies.get(process['pid'])
+      if prev_jiffies is None:
+        prev_jiffies = process['jiffies'] if process['starttime'] < self.prev_uptime_jiffies else 0
+      process['cpu'] = max(process['jiffies'] - prev_jiffies, 0) * 100 / delta_per_core
+      process['mem'] = process['res'] * 100 / mem_total
+    process_list.sort(key=lambda process: process['cpu'], reverse=True)
+
+    lines = self.create_system_info_lines(uptime, process_list, delta_cpu_jiffies, delta_total, mem_info)
+    lines.append('')
+    lines.append(self.HEADER)
+    thread_table_dict = {}
+    for process in process_list:
+      lines.append(self.create_process_line(process))
+      if self.threads and process['num_threads'] > 1:
+        thread_table = self.read_thread_table(process)
+        if thread_table is None:
+          continue
+        thread_table_dict[process['pid']] = thread_table
+        for comm, cpu in self.create_thread_group_list(process['pid'], thread_table, delta_per_core):
+          lines.append(self.create_thread_group_line(process, comm, cpu))
+
+    self.prev_thread_table_dict = thread_table_dict
+    self.update_previous(cpu_jiffies, uptime, process_list)
+    return lines
+
+
+  def update_previous(self, cpu_jiffies, uptime, process_list):
+    self.prev_cpu_jiffies = cpu_jiffies
+    self.prev_uptime_jiffies = uptime * self.clk_tck
+    self.prev_process_jiffies = {process['pid']: process['jiffies'] for process in process_list}
+
+
+  def read_cpu_jiffies(self) -> list[int]:
+    """Return [user, nice, system, idle, iowait, irq, softirq, steal, num_cpu]"""
+    jiffies = [0] * 8
+    num_cpu = 0
+    with open(os.path.join(self.PROC_DIR, 'stat'), 'r') as f:
+      for line in f:
+        if line.startswith('cpu '):
+          values = line.split()[1:9]
+          jiffies = [int(value) for value in values] + [0] * (8 - len(values))
+        elif line.startswith('cpu'):
+          num_cpu += 1
+        else:
+          break
+    return jiffies + [num_cpu]
+
+
+  def read_uptime(self) -> float:
+    with open(os.path.join(self.PROC_DIR, 'uptime'), 'r') as f:
+      return float(f.read().split()[0])
+
+
+  def read_mem_info(self) -> dict[str, int]:
+    mem_info = {}
+    with open(os.path.join(self.PROC_DIR, 'meminfo'), 'r') as f:
+      for line in f:
+        key, value = line.split(':', 1)
+        mem_info[key] = int(value.split()[0])
+    return mem_info
+
+
+  def get_process_key(self, line: str, command_str: str):
+    pid = int(line[self.col_range_pid[0]:self.col_range_pid[1]])
+    if self.threads and self.THREAD_SEPARATOR in command_str:
+      return (pid, self.starttime_dict.get(pid), command_str.rpartition(self.THREAD_SEPARATOR)[2])
+    return (pid, self.starttime_dict.get(pid))
+
+
+  def get_ppid(self, pid: int) -> int:
+    return self.ppid_dict.get(pid)
+
+
+  def get_starttime(self, pid: int) -> int:
+    return self.starttime_dict.get(pid)
+
+
+  def is_process_line(self, command_str: str) -> bool:
+    return not (self.threads and self.THREAD_SEPARATOR in command_str)
+
+
+  def parse_command_str(self, command):
+    """Thread group rows are named '{process name}:{thread name}'"""
+    if self.threads and self.THREAD_SEPARATOR in command:
+      process_command, _, comm = command.rpartition(self.THREAD_SEPARATOR)
+      return f'{TopRunnerBase.parse_command_str(process_command)}:{comm}'
+    return TopRunnerBase.parse_command_str(command)
+
+
+  def read_process_list(self) -> list[dict]:
+    self.previous_static_info_dict = self.static_info_dict
+    self.static_info_dict = {}
+    process_list = []
+    for name in os.listdir(self.PROC_DIR):
+      if not name.isdigit():
+        continue
+      process = self.read_process(int(name))
+      if process:
+        process_list.append(process)
+    self.starttime_dict = {process['pid']: process['starttime'] for process in process_list}
+    self.ppid_dict = {process['pid']: process['ppid'] for process in process_list}
+    return process_list
+
+
+  def get_static_info(self, pid: int, starttime: int, process_dir: str, comm: str) -> tuple[str, str]:
+    """Command line and user don't change during the lifetime of a process, so read them only once"""
+    key = (pid, starttime)
+    static_info = self.static_info_dict.get(key) or self.previous_static_info_dict.get(key)
+    if static_info is None:
+      command = self.read_command(process_dir)
+      if command == '':
+        command = f'[{comm}]'
+      static_info = (command, self.get_user_name(os.stat(process_dir).st_uid))
+    self.static_info_dict[key] = static_info
+    return static_info
+
+
+  def read_process(self, pid: int) -> dict:
+    process_dir = os.path.join(self.PROC_DIR, str(pid))
+    try:
+      with open(os.path.join(process_dir, 'stat'), 'r') as f:
+        stat = f.read()
+      with open(os.path.join(process_dir, 'statm'), 'r') as f:
+        statm = f.read().split()
+      # comm may contain spaces and parentheses, so split after the last ')'
+      comm = stat[stat.find('(') + 1:stat.rfind(')')]
+      fields = stat[stat.rfind(')') + 2:].split()
+      command, user = self.get_static_info(pid, int(fields[19]), process_dir, comm)
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+      return None
+
+    return {
+      'pid': pid,
+      'user': user,
+      'state': fields[0],
+      'ppid': int(fields[1]),
+      'jiffies': int(fields[11]) + int(fields[12]),
+      'priority': fields[15],
+      'nice': fields[16],
+      'num_threads': int(fields[17]),
+      'starttime': int(fields[19]),
+      'virt': int(statm[0]) * self.page_kib,
+      'res': int(statm[1]) * self.page_kib,
+      'shr': int(statm[2]) * self.page_kib,
+      'command': command,
+    }
+
+
+  def read_thread_table(self, process: dict) -> dict[int, tuple[str, int, int]]:
+    """Return {tid: (comm, jiffies, starttime)}. The previous table is reused if the process didn't consume CPU since the previous frame"""
+    pid = process['pid']
+    prev_thread_table = self.prev_thread_table_dict.get(pid)
+    if prev_thread_table is not None and len(prev_thread_table) == process['num_threads'] \
+        and process['jiffies'] == self.prev_process_jiffies.get(pid):
+      return prev_thread_table
+
+    task_dir = os.path.join(self.PROC_DIR, str(pid), 'task')
+    thread_table = {}
+    try:
+      tid_list = os.listdir(task_dir)
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+      return None
+    for tid in tid_list:
+      try:
+        with open(os.path.join(task_dir, tid, 'stat'), 'r') as f:
+          stat = f.read()
+      except (FileNotFoundError, ProcessLookupError, PermissionError):
+        continue
+      fields = stat[stat.rfind(')') + 2:].split()
+      thread_table[int(tid)] = (stat[stat.find('(') + 1:stat.rfind(')')], int(fields[11]) + int(fields[12]), int(fields[19]))
+    return thread_table
+
+
+  def create_thread_group_list(self, pid: int, thread_table: dict[int, tuple[str, int, int]], delta_per_core: float) -> list[tuple[str, float]]:
+    """Roll up %CPU of threads by name. Return [(comm, cpu)] sorted by cpu"""
+    prev_thread_table = self.prev_thread_table_dict.get(pid, {})
+    cpu_dict = {}
+    for tid, (comm, jiffies, starttime) in thread_table.items():
+      prev_thread = prev_thread_table.get(tid)
+      if prev_thread:
+        prev_jiffies = prev_thread[1]
+      else:
+        prev_jiffies = jiffies if starttime < self.prev_uptime_jiffies else 0
+      cpu_dict[comm] = cpu_dict.get(comm, 0) + max(jiffies - prev_jiffies, 0) * 100 / delta_per_core
+    return sorted(cpu_dict.items(), key=lambda item: item[1], reverse=True)
+
+
+  def create_thread_group_line(self, process: dict, comm: str, cpu: float) -> str:
+    """Memory is shared among threads, so it's shown only in the process row"""
+    cpu_str = f'{cpu:.1f}' if cpu < 1000 else f'{cpu:.0f}'
+    return self.LINE_FORMAT.format(process['pid'], process['user'][:8], '', '', '', '', '', '', cpu_str, '0.0', '',
+                                   process['command'] + self.THREAD_SEPARATOR + comm)
+
+
+  @staticmethod
+  def read_command(process_dir: str) -> str:
+    with open(os.path.join(process_dir, 'cmdline'), 'rb') as f:
+      cmdline = f.read()
+    return cmdline.replace(b'\0', b' ').decode('utf-8', errors='replace').strip()
+
+
+  def get_user_name(self, uid: int) -> str:
+    if uid not in self.user_name_dict:
+      try:
+        self.user_name_dict[uid] = pwd.getpwuid(uid).pw_name
+      except KeyError:
+        self.user_name_dict[uid] = str(uid)
+    return self.user_name_dict[uid]
+
+
+  def create_system_info_lines(self, uptime, process_list, delta_cpu_jiffies, delta_total, mem_info) -> list[str]:
+    with open(os.path.join(self.PROC_DIR, 'loadavg'), 'r') as f:
+      load_average = f.read().split()[:3]
+    lines = []
+    lines.append(f'top - {time.strftime("%H:%M:%S")} up {self.format_uptime(uptime)},  load average: {", ".join(load_average)}')
+
+    states = [process['state'] for process in process_list]
+    lines.append(f'Tasks: {len(states):>3} total, {states.count("R"):>3} running, {states.count("S") + states.count("I") + states.count("D"):>3} sleeping, '
+                 f'{states.count("T") + states.count("t"):>3} stopped, {states.count("Z"):>3} zombie')
+
+    usage = [jiffies * 100 / delta_total for jiffies in delta_cpu_jiffies]
+    lines.append(f'%Cpu(s):{usage[0]:5.1f} us,{usage[2]:5.1f} sy,{usage[1]:5.1f} ni,{usage[3]:5.1f} id,'
+                 f'{usage[4]:5.1f} wa,{usage[5]:5.1f} hi,{usage[6]:5.1f} si,{usage[7]:5.1f} st')
+
+    mem_total = mem_info.get('MemTotal', 0) / 1024
+    mem_free = mem_info.get('MemFree', 0) / 1024
+    mem_buff_cache = (mem_info.get('Buffers', 0) + mem_info.get('Cached', 0) + mem_info.get('SReclaimable', 0)) / 1024
+    mem_used = mem_total - mem_free - mem_buff_cache
+    swap_total = mem_info.get('SwapTotal', 0) / 1024
+    swap_free = mem_info.get('SwapFree', 0) / 1024
+    mem_avail = mem_info.get('MemAvailable', 0) / 1024
+    lines.append(f'MiB Mem : {mem_total:8.1f} total, {mem_free:8.1f} free, {mem_used:8.1f} used, {mem_buff_cache:8.1f} buff/cache')
+    lines.append(f'MiB Swap: {swap_total:8.1f} total, {swap_free:8.1f} free, {swap_total - swap_free:8.1f} used. {mem_avail:8.1f} avail Mem')
+    return lines
+
+
+  def create_process_line(self, process: dict) -> str:
+    cpu = process['cpu']
+    cpu_str = f'{cpu:.1f}' if cpu < 1000 else f'{cpu:.0f}'
+    return self.LINE_FORMAT.format(
+      process['pid'], process['user'][:8], 'rt' if int(process['priority']) <= -100 else process['priority'], process['nice'],
+      self.format_kib(process['virt'], 7), self.format_kib(process['res'], 6), self.format_kib(process['shr'], 6),
+      process['state'], cpu_str, f'{process["mem"]:.1f}',
+      self.format_time(process['jiffies'] / self.clk_tck), process['command'])
+
+
+  @staticmethod
+  def format_kib(kib: int, width: int) -> str:
+    """Use a larger unit if the value doesn't fit in the column, like top does"""
+    kib_str = str(kib)
+    if len(kib_str) <= width:
+      return kib_str
+    for unit, scale in (('m', 1024), ('g', 1024 ** 2), ('t', 1024 ** 3)):
+      kib_str = f'{kib / scale:.1f}{unit}'
+      if len(kib_str) <= width:
+        return kib_str
+    return f'{kib / 1024 ** 3:.0f}t'
+
+
+  @staticmethod
+  def format_time(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    time_str = f'{minutes}:{seconds - minutes * 60:05.2f}'
+    if len(time_str) > 9:
+      time_str = f'{minutes // 60}h'
+    return time_str
+
+
+  @staticmethod
+  def format_uptime(uptime: float) -> str:
+    days = int(uptime // 86400)
+    hours = int(uptime % 86400 // 3600)
+    minutes = int(uptime % 3600 // 60)
+    day_str = f'{days} day{"s" if days > 1 else ""}, ' if days > 0 else ''
+    if hours > 0:
+      return f'{day_str}{hours:2d}:{minutes:02d}'
+    return f'{day_str}{minutes} min'
@@ -0,0 +1,130 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+from typing import Hashable
+import math
+
+
+class ProcessRegistry:
+  """
+  Bound the number of series recorded at the same time.
+  Each series (process) is identified by a key such as (name, start time) to handle PID reuse, and has a compact integer ID.
+  IDs of processes which are not seen for `evict_after` frames are released and reused.
+  When all IDs are in use, a new process takes the ID of the least significant one (lowest decayed peak of %CPU),
+  or its values are folded into the 'other' series if it is less significant than all of them.
+  """
+  OTHER_NAME = 'other'
+
+  def __init__(self, max_num_series: int=200, evict_after: int=60, decay: float=0.9):
+    self.max_num_series = max_num_series
+    self.evict_after = evict_after
+    self.decay = decay
+    self.frame = 0
+    self.id_dict: dict[Hashable, int] = {}
+    self.key_list: list[Hashable] = []
+    self.name_list: list[str] = []
+    self.last_seen_list: list[int] = []
+    self.score_list: list[float] = []
+    self.free_id_list: list[int] = []
+
+
+  def __len__(self):
+    return len(self.id_dict)
+
+
+  def get_id(self, key: Hashable) -> int:
+    return self.id_dict.get(key)
+
+
+  def get_name(self, id: int) -> str:
+    return self.name_list[id]
+
+
+  def update(self, key_list: list[Hashable], name_list: list[str], cpu_list: list[float], mem_list: list[float]) \
+      -> tuple[list[str], list[float], list[float], list[int]]:
+    """Return series of registered processes and 'other' (only if something is folded), and their IDs (None for 'other')"""
+    self.frame += 1
+    result_name_list = []
+    result_cpu_list = []
+    result_mem_list = []
+    result_id_list = []
+    other_cpu = 0.0
+    other_mem = 0.0
+    has_other = False
+    for key, name, cpu, mem in zip(key_list, name_list, cpu_list, mem_list):
+      cpu_value = 0.0 if math.isnan(cpu) else cpu
+      id = self.id_dict.get(key)
+      if id is None:
+        id = self.register(key, name, cpu_value)
+        if id is None:
+          other_cpu += cpu_value
+          other_mem += 0.0 if math.isnan(mem) else mem
+          has_other = True
+          continue
+      self.last_seen_list[id] = self.frame
+      self.score_list[id] = max(cpu_value, self.score_list[id] * self.decay)
+      result_name_list.append(name)
+      result_cpu_list.append(cpu)
+      result_mem_list.append(mem)
+      result_id_list.append(id)
+
+    self.evict_dead()
+    if has_other:
+      result_name_list.append(self.OTHER_NAME)
+      result_cpu_list.append(other_cpu)
+      result_mem_list.append(other_mem)
+      result_id_list.append(None)
+    return result_name_list, result_cpu_list, result_mem_list, result_id_list
+
+
+  def register(self, key: Hashable, name: str, cpu: float) -> int:
+    if self.max_num_series > 0 and len(self.id_dict) >= self.max_num_series:
+      # processes not seen in the previous frame are evicted first, then the least significant one.
+      # IDs already given in this frame are not candidates, otherwise two series would share an ID in the same sample
+      candidate_list = [id for id in self.id_dict.values() if self.last_seen_list[id] != self.frame]
+      if not candidate_list:
+        return None
+      victim = min(candidate_list, key=lambda id: (self.last_seen_list[id] >= self.frame - 1, self.score_list[id]))
+      if self.last_seen_list[victim] >= self.frame - 1 and self.score_list[victim] >= cpu:
+        return None
+      self.evict(victim)
+
+    if self.free_id_list:
+      id = self.free_id_list.pop()
+      self.key_list[id] = key
+      self.name_list[id] = name
+      self.last_seen_list[id] = self.frame
+      self.score_list[id] = cpu
+    else:
+      id = len(self.key_list)
+      self.key_list.append(key)
+      self.name_list.append(name)
+      self.last_seen_list.append(self.frame)
+      self.score_list.append(cpu)
+    self.id_dict[key] = id
+    return id
+
+
+  def evict(self, id: int):
+    del self.id_dict[self.key_list[id]]
+    self.key_list[id] = None
+    self.free_id_list.append(id)
+
+
+  def evict_dead(self):
+    if self.evict_after <= 0:
+      return
+    threshold = self.frame - self.evict_after
+    for id in [id for id in self.id_dict.values() if self.last_seen_list[id] < threshold]:
+      self.evict(id)
@@ -0,0 +1,120 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+from collections import deque
+import json
+import sys
+import time
+
+
+class StageTimer:
+  """Context manager measuring time and net allocated memory blocks of one stage"""
+  __slots__ = ('duration_list', 'alloc_list', 'count', 'start_time', 'start_blocks')
+
+  def __init__(self, window: int):
+    self.duration_list = deque(maxlen=window)
+    self.alloc_list = deque(maxlen=window)
+    self.count = 0
+    self.start_time = 0
+    self.start_blocks = 0
+
+
+  def __enter__(self):
+    self.start_blocks = sys.getallocatedblocks()
+    self.start_time = time.perf_counter()
+    return self
+
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.duration_list.append(time.perf_counter() - self.start_time)
+    self.alloc_list.append(sys.getallocatedblocks() - self.start_blocks)
+    self.count += 1
+    return False
+
+
+  def get_stats(self) -> dict:
+    if not self.duration_list:
+      return {'count': 0}
+    duration_list = sorted(self.duration_list)
+    return {
+      'count': self.count,
+      'last_ms': self.duration_list[-1] * 1e3,
+      'avg_ms': sum(duration_list) / len(duration_list) * 1e3,
+      'p99_ms': duration_list[int(0.99 * (len(duration_list) - 1))] * 1e3,
+      'max_ms': duration_list[-1] * 1e3,
+      'alloc_blocks_avg': sum(self.alloc_list) / len(self.alloc_list),
+    }
+
+
+class NullStageTimer:
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    return False
+
+
+class StageProfiler:
+  """
+  Per-stage timing of the main loop (e.g. wait, sample, parse, history, persist, render).
+  Rolling statistics are calculated over the last `window` measurements.
+  """
+  NULL_TIMER = NullStageTimer()
+
+  def __init__(self, enabled: bool=True, window: int=1000):
+    self.enabled = enabled
+    self.window = window
+    self.timer_dict: dict[str, StageTimer] = {}
+    self.start_time = time.perf_counter()
+    self.start_cpu_time = time.process_time()
+
+
+  def measure(self, stage: str):
+    if not self.enabled:
+      return self.NULL_TIMER
+    timer = self.timer_dict.get(stage)
+    if timer is None:
+      timer = StageTimer(self.window)
+      self.timer_dict[stage] = timer
+    return timer
+
+
+  def get_stats(self) -> dict:
+    elapsed = max(time.perf_counter() - self.start_time, 1e-9)
+    cpu_time = time.process_time() - self.start_cpu_time
+    return {
+      'elapsed_sec': elapsed,
+      'cpu_sec': cpu_time,
+      'cpu_percent': cpu_time * 100 / elapsed,
+      'allocated_blocks': sys.getallocatedblocks(),
+      # snapshot, because another thread (e.g. GUI) may add a stage while iterating
+      'stages': {stage: timer.get_stats() for stage, timer in list(self.timer_dict.items())},
+    }
+
+
+  def create_lines(self) -> list[str]:
+    stats = self.get_stats()
+    lines = [f'rotop self: cpu {stats["cpu_percent"]:5.1f}%, allocated blocks {stats["allocated_blocks"]}',
+             f'{"STAGE":<10} {"COUNT":>7} {"LAST[ms]":>9} {"AVG[ms]":>9} {"P99[ms]":>9} {"MAX[ms]":>9} {"ALLOC":>8}']
+    for stage, stage_stats in stats['stages'].items():
+      if stage_stats['count'] == 0:
+        continue
+      lines.append(f'{stage:<10} {stage_stats["count"]:>7} {stage_stats["last_ms"]:>9.2f} {stage_stats["avg_ms"]:>9.2f} '
+                   f'{stage_stats["p99_ms"]:>9.2f} {stage_stats["max_ms"]:>9.2f} {stage_stats["alloc_blocks_avg"]:>8.0f}')
+    return lines
+
+
+  def dump_json(self, file_path: str):
+    with open(file_path, 'w', encoding='utf-8') as f:
+      json.dump(self.get_stats(), f, indent=2)
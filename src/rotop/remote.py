@@ -0,0 +1,468 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Stream samples from rotop on each host (agent) to a central rotop (aggregator) over TCP.
+
+Message: type (4 bytes), payload size (u32), payload. Little endian
+  agent -> aggregator
+    'HELO' : version (u16), session id (u64), agent time (f64), utf-8 host name
+    'STRS' : string table entries. [id (u32), length (u16), utf-8 name] * n
+    'BTCH' : batch of samples. num_sample (u32), then for each sample:
+             seq (u32), timestamp (f64), user, sys, idle (f32 * 3),
+             num_update (u32), [name id (u32), cpu (f32), mem (f32)] * num_update,
+             num_remove (u32), [name id (u32)] * num_remove
+             Samples are delta encoded: only series whose values changed from the previous sample in the same connection are sent,
+             and series which disappeared are removed. So the first sample of a connection has all series.
+  aggregator -> agent
+    'ACKN' : seq (i64) of the last sample received from the session, -1 if none
+
+The agent keeps samples until they are acknowledged (up to max_backlog), and sends them again after reconnection (backfill).
+Timestamps are converted to the clock of the aggregator using the agent time in HELO.
+"""
+from __future__ import annotations
+from collections import deque
+from typing import NamedTuple
+import atexit
+import datetime
+import math
+import random
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from .csv_writer import CsvWriter
+from .proc_runner import ProcRunner
+from .top_runner import TopRunnerBase
+from .utility import create_logger
+
+
+logger = create_logger(__name__, log_filename='rotop.log')
+
+VERSION = 1
+MESSAGE_HEADER = struct.Struct('<4sI')
+HELLO = struct.Struct('<HQd')
+STRING_ENTRY = struct.Struct('<IH')
+COUNT = struct.Struct('<I')
+SAMPLE_HEADER = struct.Struct('<Idfff')
+UPDATE_ENTRY = struct.Struct('<Iff')
+ACK = struct.Struct('<q')
+TYPE_HELLO = b'HELO'
+TYPE_STRING = b'STRS'
+TYPE_BATCH = b'BTCH'
+TYPE_ACK = b'ACKN'
+TOTAL_NAME_LIST = ['user', 'sys', 'idle']
+
+
+class RemoteSample(NamedTuple):
+  seq: int
+  timestamp: float
+  total_list: list[float]
+  name_list: list[str]
+  cpu_list: list[float]
+  mem_list: list[float]
+
+
+def send_message(sock: socket.socket, type: bytes, payload: bytes):
+  sock.sendall(MESSAGE_HEADER.pack(type, len(payload)) + payload)
+
+
+def receive_exactly(sock: socket.socket, size: int) -> bytes:
+  data = bytearray()
+  while len(data) < size:
+    chunk = sock.recv(size - len(data))
+    if not chunk:
+      raise ConnectionError('connection closed')
+    data += chunk
+  return bytes(data)
+
+
+def receive_message(sock: socket.socket) -> tuple[bytes, bytes]:
+  type, size = MESSAGE_HEADER.unpack(receive_exactly(sock, MESSAGE_HEADER.size))
+  return type, receive_exactly(sock, size)
+
+
+def is_same_value(a: float, b: float) -> bool:
+  return a == b or (math.isnan(a) and math.isnan(b))
+
+
+class SampleEncoder:
+  """Encoder of one connection. Name IDs are shared by connections, but the aggregator learns them again in each connection"""
+  def __init__(self, name_id_dict: dict[str, int]):
+    self.name_id_dict = name_id_dict
+    self.sent_id_set: set[int] = set()
+    self.prev_value_dict: dict[int, tuple[float, float]] = {}
+
+
+  def encode(self, sample_list: list[RemoteSample]) -> bytes:
+    """STRS (if there are new names) and BTCH messages"""
+    new_name_list = []
+    batch = [COUNT.pack(len(sample_list))]
+    for sample in sample_list:
+      value_dict = {}
+      update_list = []
+      for name, cpu, mem in zip(sample.name_list, sample.cpu_list, sample.mem_list):
+        id = self.name_id_dict.get(name)
+        if id is None:
+          id = len(self.name_id_dict)
+          self.name_id_dict[name] = id
+        if id not in self.sent_id_set:
+          self.sent_id_set.add(id)
+          new_name_list.append((id, name))
+        value_dict[id] = (cpu, mem)
+        prev = self.prev_value_dict.get(id)
+        if prev is None or not is_same_value(prev[0], cpu) or not is_same_value(prev[1], mem):
+          update_list.append(UPDATE_ENTRY.pack(id, cpu, mem))
+      remove_list = [COUNT.pack(id) for id in self.prev_value_dict.keys() - value_dict.keys()]
+      self.prev_value_dict = value_dict
+      batch.append(SAMPLE_HEADER.pack(sample.seq, sample.timestamp, *sample.total_list))
+      batch.append(COUNT.pack(len(update_list)))
+      batch += update_list
+      batch.append(COUNT.pack(len(remove_list)))
+      batch += remove_list
+
+    message = b''
+    if new_name_list:
+      payload = b''.join(STRING_ENTRY.pack(id, len(encoded)) + encoded for id, encoded in ((id, name.encode('utf-8')) for id, name in new_name_list))
+      message += MESSAGE_HEADER.pack(TYPE_STRING, len(payload)) + payload
+    payload = b''.join(batch)
+    return message + MESSAGE_HEADER.pack(TYPE_BATCH, len(payload)) + payload
+
+
+class SampleDecoder:
+  """Decoder of one connection"""
+  def __init__(self):
+    self.name_dict: dict[int, str] = {}
+    self.value_dict: dict[int, tuple[float, float]] = {}
+
+
+  def decode_strings(self, payload: bytes):
+    offset = 0
+    while offset < len(payload):
+      id, length = STRING_ENTRY.unpack_from(payload, offset)
+      offset += STRING_ENTRY.size
+      self.name_dict[id] = payload[offset:offset + length].decode('utf-8', errors='replace')
+      offset += length
+
+
+  def decode_batch(self, payload: bytes) -> list[RemoteSample]:
+    sample_list = []
+    num_sample, = COUNT.unpack_from(payload, 0)
+    offset = COUNT.size
+    for _ in range(num_sample):
+      seq, timestamp, user, sys, idle = SAMPLE_HEADER.unpack_from(payload, offset)
+      offset += SAMPLE_HEADER.size
+      num_update, = COUNT.unpack_from(payload, offset)
+      offset += COUNT.size
+      for id, cpu, mem in UPDATE_ENTRY.iter_unpack(payload[offset:offset + num_update * UPDATE_ENTRY.size]):
+        self.value_dict[id] = (self.round(cpu), self.round(mem))
+      offset += num_update * UPDATE_ENTRY.size
+      num_remove, = COUNT.unpack_from(payload, offset)
+      offset += COUNT.size
+      for id, in COUNT.iter_unpack(payload[offset:offset + num_remove * COUNT.size]):
+        self.value_dict.pop(id, None)
+      offset += num_remove * COUNT.size
+      name_list = [self.name_dict.get(id, str(id)) for id in self.value_dict.keys()]
+      cpu_list = [value[0] for value in self.value_dict.values()]
+      mem_list = [value[1] for value in self.value_dict.values()]
+      sample_list.append(RemoteSample(seq, timestamp, [self.round(user), self.round(sys), self.round(idle)], name_list, cpu_list, mem_list))
+    return sample_list
+
+
+  @staticmethod
+  def round(value: float) -> float:
+    """Remove the error of f32 (e.g. 9.100000381469727), as values are percentages with one or two decimals"""
+    return round(value, 3)
+
+
+class RemoteAgent:
+  """
+  Send samples to the aggregator from a background thread, so that sampling is not blocked by the network.
+  Samples are sent in batches of batch_size (or after batch_interval seconds), and removed when the aggregator acknowledges them.
+  """
+  CONNECT_TIMEOUT = 5.0
+  ACK_TIMEOUT = 10.0
+  MAX_RETRY_INTERVAL = 30.0
+  MAX_BATCH = 100
+
+  def __init__(self, address: str, host_name: str=None, batch_size: int=5, batch_interval: float=5.0, max_backlog: int=3600):
+    host, _, port = address.rpartition(':')
+    self.address = (host or 'localhost', int(port))
+    self.host_name = host_name or socket.gethostname()
+    self.batch_size = max(batch_size, 1)
+    self.batch_interval = batch_interval
+    self.session_id = random.getrandbits(63)
+    self.name_id_dict: dict[str, int] = {}
+    self.backlog: deque[RemoteSample] = deque(maxlen=max_backlog)
+    self.next_seq = 0
+    self.oldest_unsent_time = None
+    self.condition = threading.Condition()
+    self.is_exit = False
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+
+  def send(self, timestamp: float, total_list: list[float], name_list: list[str], cpu_list: list[float], mem_list: list[float]):
+    with self.condition:
+      if len(self.backlog) == self.backlog.maxlen:
+        logger.warning(f'Backlog to {self.address} is full. The oldest sample is dropped')
+      self.backlog.append(RemoteSample(self.next_seq, timestamp, total_list, name_list, cpu_list, mem_list))
+      self.next_seq += 1
+      if self.oldest_unsent_time is None:
+        self.oldest_unsent_time = time.monotonic()
+      self.condition.notify()
+
+
+  def close(self):
+    with self.condition:
+      self.is_exit = True
+      self.condition.notify()
+    self.thread.join(self.CONNECT_TIMEOUT)
+
+
+  def run(self):
+    retry_interval = 1.0
+    while not self.is_exit:
+      try:
+        with socket.create_connection(self.address, self.CONNECT_TIMEOUT) as sock:
+          sock.settimeout(self.ACK_TIMEOUT)
+          self.communicate(sock)
+      except (OSError, ConnectionError, struct.error) as e:
+        if self.is_exit:
+          break
+        logger.info(f'Unable to send to {self.address}: {e}. Retry in {retry_interval} sec')
+        with self.condition:
+          self.condition.wait(retry_interval)
+        retry_interval = min(retry_interval * 2, self.MAX_RETRY_INTERVAL)
+        continue
+      retry_interval = 1.0
+
+
+  def communicate(self, sock: socket.socket):
+    send_message(sock, TYPE_HELLO, HELLO.pack(VERSION, self.session_id, time.time()) + self.host_name.encode('utf-8'))
+    acked_seq = self.receive_ack(sock)
+    logger.info(f'Connected to {self.address}. Resend from {acked_seq + 1}')
+    encoder = SampleEncoder(self.name_id_dict)
+    while True:
+      with self.condition:
+        self.condition.wait_for(lambda: self.is_exit or self.is_batch_ready(acked_seq), self.batch_interval)
+        sample_list = [sample for sample in self.backlog if sample.seq > acked_seq][:self.MAX_BATCH]
+        if self.is_exit and not sample_list:
+          return
+      if not sample_list:
+        continue
+      sock.sendall(encoder.encode(sample_list))
+      acked_seq = self.receive_ack(sock)
+      with self.condition:
+        while self.backlog and self.backlog[0].seq <= acked_seq:
+          self.backlog.popleft()
+        self.oldest_unsent_time = time.monotonic() if self.backlog else None
+      if self.is_exit and not self.backlog:
+        return
+
+
+  def is_batch_ready(self, acked_seq: int) -> bool:
+    num_unsent = self.next_seq - 1 - acked_seq
+    if num_unsent <= 0:
+      return False
+    return num_unsent >= self.batch_size or time.monotonic() - self.oldest_unsent_time >= self.batch_interval
+
+
+  @staticmethod
+  def receive_ack(sock: socket.socket) -> int:
+    type, payload = receive_message(sock)
+    if type != TYPE_ACK:
+      raise ConnectionError(f'unexpected message {type}')
+    return ACK.unpack(payload)[0]
+
+
+class RemoteHost:
+  """Latest sample and recording of one agent"""
+  def __init__(self, name: str):
+    self.name = name
+    self.session_id = None
+    self.last_seq = -1
+    self.latest: RemoteSample = None
+    self.csv_writer_list: list[CsvWriter] = None
+
+
+  def record(self, dir_name: str, sample: RemoteSample):
+    if self.csv_writer_list is None:
+      prefix = re.sub(r'[^0-9A-Za-z.-]', '-', self.name)
+      self.csv_writer_list = [CsvWriter(dir_name, f'{prefix}_{name}') for name in ['total', 'cpu', 'mem']]
+    timestamp = int(sample.timestamp)
+    self.csv_writer_list[0].write(timestamp, TOTAL_NAME_LIST, sample.total_list)
+    self.csv_writer_list[1].write(timestamp, sample.name_list, sample.cpu_list)
+    self.csv_writer_list[2].write(timestamp, sample.name_list, sample.mem_list)
+
+
+  def close(self):
+    for csv_writer in self.csv_writer_list or []:
+      csv_writer.close()
+
+
+class RemoteAggregator:
+  """
+  TCP server receiving samples from agents. Each connection is handled by its own thread.
+  All samples including backfilled ones are recorded per host if record_dir is set ({host}_cpu_000.csv, ...).
+  """
+  def __init__(self, port: int):
+    self.lock = threading.Lock()
+    self.host_dict: dict[str, RemoteHost] = {}
+    self.record_dir: str = None
+    aggregator = self
+
+    class Handler(socketserver.BaseRequestHandler):
+      def handle(self):
+        try:
+          aggregator.handle_connection(self.request, self.client_address)
+        except (OSError, ConnectionError, struct.error, ValueError) as e:
+          logger.info(f'Disconnected {self.client_address}: {e}')
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    self.server = socketserver.ThreadingTCPServer(('0.0.0.0', port), Handler)
+    self.server.daemon_threads = True
+    self.port = self.server.server_address[1]
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+    logger.info(f'Aggregator is listening on {self.port}')
+
+
+  def handle_connection(self, sock: socket.socket, client_address):
+    type, payload = receive_message(sock)
+    if type != TYPE_HELLO:
+      raise ValueError(f'unexpected message {type}')
+    version, session_id, agent_time = HELLO.unpack_from(payload)
+    if version != VERSION:
+      raise ValueError(f'unsupported version {version}')
+    clock_offset = time.time() - agent_time
+    with self.lock:
+      host_name = payload[HELLO.size:].decode('utf-8', errors='replace')
+      host = self.host_dict.get(host_name)
+      if host is None:
+        host = RemoteHost(host_name)
+        self.host_dict[host_name] = host
+      if host.session_id != session_id:
+        host.session_id = session_id
+        host.last_seq = -1
+      last_seq = host.last_seq
+    logger.info(f'Connected {host_name} from {client_address}. Clock offset is {clock_offset:.3f} sec')
+    send_message(sock, TYPE_ACK, ACK.pack(last_seq))
+
+    decoder = SampleDecoder()
+    while True:
+      type, payload = receive_message(sock)
+      if type == TYPE_STRING:
+        decoder.decode_strings(payload)
+        continue
+      if type != TYPE_BATCH:
+        raise ValueError(f'unexpected message {type}')
+      sample_list = decoder.decode_batch(payload)
+      with self.lock:
+        if host.session_id != session_id:
+          return    # the agent has reconnected with a new session
+        for sample in sample_list:
+          if sample.seq <= host.last_seq:
+            continue
+          sample = sample._replace(timestamp=sample.timestamp + clock_offset)
+          host.last_seq = sample.seq
+          if host.latest is None or sample.timestamp >= host.latest.timestamp:
+            host.latest = sample
+          if self.record_dir:
+            host.record(self.record_dir, sample)
+        last_seq = host.last_seq
+      send_message(sock, TYPE_ACK, ACK.pack(last_seq))
+
+
+  def get_latest_list(self, max_age: float) -> list[tuple[str, RemoteSample]]:
+    """Latest sample of each host, except hosts without samples in max_age seconds"""
+    now = time.time()
+    with self.lock:
+      return sorted((name, host.latest) for name, host in self.host_dict.items()
+                    if host.latest and now - host.latest.timestamp <= max_age)
+
+
+  def close(self):
+    self.server.shutdown()
+    self.server.server_close()
+    with self.lock:
+      for host in self.host_dict.values():
+        host.close()
+      self.record_dir = None
+
+
+class AggregatorRunner(TopRunnerBase):
+  """
+  Frames made from the latest samples of all agents, on the clock of the aggregator.
+  Series are named '{host}: {process}', and each host has '{host}: total' (100 - idle) as a group row.
+  The system line shows the average of hosts.
+  """
+  MAX_AGE = 30.0    # [sec] hosts without samples for this time are not shown
+
+  def __init__(self, port: int, interval, filter):
+    super().__init__(interval, filter)
+    self.aggregator = RemoteAggregator(port)
+    self.next_time = time.monotonic()
+    atexit.register(self.aggregator.close)
+
+
+  @staticmethod
+  def parse_command_str(command):
+    return command
+
+
+  def set_aggregate_mode(self, mode: str):
+    if mode != 'none':
+      logger.warning('Aggregation is not supported by aggregator, because PIDs of hosts are mixed')
+    super().set_aggregate_mode('none')
+
+
+  def set_record_dir(self, dir_name: str):
+    self.aggregator.record_dir = dir_name
+
+
+  def get_wait_time(self) -> float:
+    return max(self.next_time - time.monotonic(), 0)
+
+
+  def read_frame(self) -> list[str]:
+    now = time.monotonic()
+    if now < self.next_time:
+      time.sleep(self.next_time - now)
+    self.next_time = max(self.next_time + self.interval, time.monotonic())
+    self.frame_time = time.time()
+
+    latest_list = self.aggregator.get_latest_list(max(self.MAX_AGE, self.interval * 3))
+    total_list = [sum(sample.total_list[i] for _, sample in latest_list) / len(latest_list) if latest_list else math.nan
+                  for i in range(len(TOTAL_NAME_LIST))]
+    lines = [f'top - {datetime.datetime.fromtimestamp(self.frame_time).strftime("%H:%M:%S")} aggregator, {len(latest_list)} hosts,  load average: -',
+             f'%Cpu(s):{total_list[0]:5.1f} us,{total_list[1]:5.1f} sy,  0.0 ni,{total_list[2]:5.1f} id',
+             '',
+             ProcRunner.HEADER]
+    for host_name, sample in latest_list:
+      lines.append(ProcRunner.LINE_FORMAT.format('', '', '', '', '', '', '', '', f'{100 - sample.total_list[2]:.1f}', f'{math.nan:.1f}', '', f'{host_name}: total'))
+    process_list = []
+    for host_name, sample in latest_list:
+      for name, cpu, mem in zip(sample.name_list, sample.cpu_list, sample.mem_list):
+        command, separator, pid = name.rpartition(' (')
+        if not (separator and pid.endswith(')') and pid[:-1].isdigit()) or command.startswith('tree:'):
+          # 'other' and group rows of the agent (e.g. --aggregate) are shown as group lines without PID
+          command, pid = name, ''
+        process_list.append((cpu, mem, pid.rstrip(')'), f'{host_name}: {command}'))
+    process_list.sort(key=lambda process: process[0], reverse=True)
+    for cpu, mem, pid, command in process_list:
+      lines.append(ProcRunner.LINE_FORMAT.format(pid, '', '', '', '', '', '', '', f'{cpu:.1f}', f'{mem:.1f}', '', command))
+    return lines
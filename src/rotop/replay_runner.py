@@ -0,0 +1,174 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+from typing import Iterator
+import datetime
+import math
+import os
+import time
+
+from .proc_runner import ProcRunner
+from .top_runner import TopRunnerBase
+from .utility import create_logger
+
+
+logger = create_logger(__name__, log_filename='rotop.log')
+
+
+class ReplayRunnerBase(TopRunnerBase):
+  """
+  Feed recorded frames instead of live ones.
+  speed is 'asap' (as fast as possible) or 'realtime' (keep the intervals of the recording).
+  """
+  def __init__(self, interval, filter, speed='asap'):
+    super().__init__(interval, filter)
+    self.speed = speed
+    self.frame_iterator = self.iterate_frames()
+    self.next_frame = next(self.frame_iterator, None)
+    self.next_wall_time = 0
+
+
+  def iterate_frames(self) -> Iterator[tuple[float, list[str]]]:
+    """Yield (unix time, lines) of each frame"""
+    raise NotImplementedError
+
+
+  def is_finished(self) -> bool:
+    return self.next_frame is None
+
+
+  def get_wait_time(self) -> float:
+    if self.is_finished():
+      return None
+    return max(self.next_wall_time - time.monotonic(), 0)
+
+
+  def read_frame(self) -> list[str]:
+    if self.next_frame is None:
+      return None
+    now = time.monotonic()
+    if now < self.next_wall_time:
+      time.sleep(self.next_wall_time - now)
+
+    self.frame_time, lines = self.next_frame
+    self.next_frame = next(self.frame_iterator, None)
+    if self.speed == 'realtime' and self.next_frame:
+      frame_interval = self.next_frame[0] - self.frame_time
+      if not 0 < frame_interval < 3600:
+        frame_interval = self.interval
+      self.next_wall_time = time.monotonic() + frame_interval
+    return lines
+
+
+class TopReplayRunner(ReplayRunnerBase):
+  """
+  Replay a text file captured by top command. e.g.
+    top -cb -d 1 -o %CPU -w 512 > top_capture.txt
+  The date of frames is taken from the modification time of the file because top shows only time.
+  """
+  def __init__(self, file_path: str, interval, filter, speed='asap'):
+    self.file_path = file_path
+    super().__init__(interval, filter, speed)
+
+
+  def iterate_frames(self) -> Iterator[tuple[float, list[str]]]:
+    date = datetime.datetime.fromtimestamp(os.path.getmtime(self.file_path)).date()
+    last_time = None
+    lines = []
+    with open(self.file_path, 'r', encoding='utf-8', errors='replace') as f:
+      for line in f:
+        line = line.rstrip('\n')
+        if line.startswith('top - ') and lines:
+          last_time = self.get_frame_time(lines[0], date, last_time)
+          yield last_time, lines
+          lines = []
+        lines.append(line)
+    if lines:
+      yield self.get_frame_time(lines[0], date, last_time), lines
+
+
+  @staticmethod
+  def get_frame_time(first_line: str, date: datetime.date, last_time: float) -> float:
+    try:
+      clock = datetime.datetime.strptime(first_line.split()[2], '%H:%M:%S').time()
+    except (IndexError, ValueError):
+      return last_time + 1 if last_time else time.time()
+    frame_time = datetime.datetime.combine(date, clock).timestamp()
+    while last_time and frame_time < last_time:
+      frame_time += 24 * 3600   # over midnight
+    return frame_time
+
+
+class NativeReplayRunner(ReplayRunnerBase):
+  """
+  Replay data recorded by rotop with --record_format binary (a directory containing total.rtb, cpu.rtb and mem.rtb).
+  Process names are already parsed when recorded, so they are displayed as they are.
+  """
+  def __init__(self, dir_path: str, interval, filter, speed='asap'):
+    self.dir_path = dir_path
+    super().__init__(interval, filter, speed)
+
+
+  @staticmethod
+  def parse_command_str(command):
+    return command
+
+
+  def iterate_frames(self) -> Iterator[tuple[float, list[str]]]:
+    # files are written at the same time for each sample, so rows are joined by index (timestamps are not unique with interval < 1 sec)
+    total_row_iterator = self.iterate_rows('total.rtb')
+    mem_row_iterator = self.iterate_rows('mem.rtb')
+    for timestamp, cpu_dict in self.iterate_rows('cpu.rtb'):
+      total = next(total_row_iterator, (None, {}))[1]
+      mem = next(mem_row_iterator, (None, {}))[1]
+      process_list = []
+      for name, cpu in cpu_dict.items():
+        if math.isnan(cpu):
+          continue
+        command, separator, pid = name.rpartition(' (')
+        if not (separator and pid.endswith(')') and pid[:-1].isdigit()):
+          # not a process (e.g. 'other', group). Show it as a group line without PID
+          command, pid = name, ''
+        process_list.append((float(cpu), mem.get(name, math.nan), pid.rstrip(')'), command))
+      process_list.sort(key=lambda process: process[0], reverse=True)
+      lines = [f'top - {datetime.datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")} replay,  load average: -',
+               f'%Cpu(s):{total.get("user", math.nan):5.1f} us,{total.get("sys", math.nan):5.1f} sy,  0.0 ni,{total.get("idle", math.nan):5.1f} id',
+               '',
+               ProcRunner.HEADER]
+      for cpu, mem, pid, command in process_list:
+        lines.append(ProcRunner.LINE_FORMAT.format(pid, '', '', '', '', '', '', '', f'{cpu:.1f}', f'{mem:.1f}', '', command))
+      yield timestamp, lines
+
+
+  def iterate_rows(self, filename: str) -> Iterator[tuple[float, dict[str, float]]]:
+    """(timestamp, {name: value}) of each sample. Only one block is decoded at a time, so that a long recording doesn't need much memory"""
+    from .binary_log import BinaryLogReader
+    file_path = os.path.join(self.dir_path, filename)
+    if not os.path.exists(file_path):
+      return
+    reader = BinaryLogReader(file_path)
+    try:
+      for timestamps, names, values in reader.iterate_blocks():
+        for row, timestamp in enumerate(timestamps.tolist()):
+          yield timestamp, dict(zip(names, values[row].tolist()))
+    finally:
+      reader.close()
+
+
+def create_replay_runner(path: str, interval, filter, speed='asap') -> ReplayRunnerBase:
+  if os.path.isdir(path):
+    return NativeReplayRunner(path, interval, filter, speed)
+  if path.endswith('.rtb'):
+    return NativeReplayRunner(os.path.dirname(path) or '.', interval, filter, speed)
+  return TopReplayRunner(path, interval, filter, speed)
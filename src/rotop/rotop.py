@@ -14,11 +14,13 @@
 from __future__ import annotations
 import argparse
 import curses
-import time
+import select
+import sys
 
-from .data_container import DataContainer
-from .top_runner import TopRunner
-from .gui_main import gui_main
+from .curses_renderer import CursesRenderer
+from .data_container import DataContainer, create_data_container
+from .top_runner import TopRunnerBase, create_top_runner
+from .profiler import StageProfiler
 from .utility import create_logger
 try:
   from ._version import version
@@ -33,33 +35,68 @@ def main_curses(stdscr, args):
   curses.use_default_colors()
   # curses.init_color(0, 0, 0, 0)
   curses.curs_set(0)
-  stdscr.timeout(10)
+  stdscr.nodelay(True)
 
-  top_runner = TopRunner(args.interval, args.filter)
-  data_container = DataContainer(args.csv)
+  profiler = StageProfiler()
+  show_profile = False
+  show_stats = False
+  top_runner = create_top_runner(args.backend, args.interval, args.filter, args.replay, args.replay_speed,
+                                 args.threads, args.aggregate, args.aggregator)
+  data_container = create_data_container(args, keep_history=False, profiler=profiler)
+  top_runner.set_record_dir(data_container.csv_dir_name)
+  renderer = CursesRenderer(stdscr)
 
   try:
     while True:
-      max_y, max_x = stdscr.getmaxyx()
-      result_lines, result_show_all_lines = top_runner.run(max(max_y, args.num_process), max_x>160, args.only_ros)
-      if result_show_all_lines is None:
-        time.sleep(0.1)
-        continue
-
-      _ = data_container.run(top_runner, result_show_all_lines, args.num_process)
+      # Sleep until the next frame is ready or a key is pressed, instead of polling
+      wait_fd_list = [sys.stdin]
+      if top_runner.fileno() is not None:
+        wait_fd_list.append(top_runner.fileno())
+      wait_time = top_runner.get_wait_time()
+      with profiler.measure('wait'):
+        if wait_time is None or wait_time > 0:
+          readable_list, _, _ = select.select(wait_fd_list, [], [], wait_time)
+        else:
+          readable_list = []
 
-      stdscr.clear()
-      for i, line in enumerate(result_lines):
-        if i >= max_y - 1:
-          break
-        stdscr.addstr(i, 0, line[:max_x])
-
-      stdscr.refresh()
       key = stdscr.getch()
       if key == ord('q'):
         break
+      elif key == ord('p'):
+        show_profile = not show_profile
+      elif key == ord('s'):
+        show_stats = not show_stats
+      elif key == ord('+'):
+        top_runner.group_depth += 1
+      elif key == ord('-'):
+        top_runner.group_depth = max(top_runner.group_depth - 1, 0)
+      elif key == curses.KEY_RESIZE:
+        renderer.invalidate()
+      if readable_list == [sys.stdin]:
+        continue
+      wait_time = top_runner.get_wait_time()
+      if top_runner.fileno() is None and (wait_time is None or wait_time > 0):
+        continue
+
+      max_y, max_x = stdscr.getmaxyx()
+      with profiler.measure('sample'):
+        result_lines, result_show_all_lines = top_runner.run(max(max_y, args.num_process), max_x>160, args.only_ros)
+      if result_show_all_lines is None:
+        continue
+
+      data_container.run(top_runner, result_show_all_lines, args.num_process)
+      with profiler.measure('render'):
+        if show_stats:
+          result_lines = data_container.add_stats_columns(top_runner, result_lines)
+        if show_profile:
+          result_lines = profiler.create_lines() + [''] + result_lines
+        renderer.render(result_lines)
   except KeyboardInterrupt:
-    exit(0)
+    pass
+  finally:
+    data_container.close()
+    if args.profile_json:
+      profiler.dump_json(args.profile_json)
 
 
 def parse_args():
@@ -68,24 +105,85 @@ def parse_args():
   parser.add_argument('--interval', type=float, default=2, help="Update interval in seconds. Similar to the -d option of top.")
   parser.add_argument('--filter', type=str, default='.*', help="Only show processes fitting to this regular expression.")
   parser.add_argument('--csv', action='store_true', default=False, help="Activate saving data to csv file.")
+  parser.add_argument('--csv_max_row', type=int, default=DataContainer.MAX_ROW_CSV, help="Number of rows in one csv file.")
+  parser.add_argument('--csv_max_bytes', type=int, default=0, help="Size in bytes of one csv file. 0 means no limit.")
+  parser.add_argument('--csv_flush_interval', type=int, default=1, help="Number of samples written to csv file before flushing.")
+  parser.add_argument('--record_format', type=str, default='csv', choices=['csv', 'binary'], help="File format of data saved by --csv. 'binary' is compact and can be read by visualize_csv.py.")
   parser.add_argument('--gui', action='store_true', default=False, help="Use GUI including plotting of CPU loads.")
+  parser.add_argument('--headless', action='store_true', default=False, help="Only record data (implies --csv) without view. Stop by SIGTERM or Ctrl-C.")
+  parser.add_argument('--report_interval', type=int, default=60, help="Number of samples between updates of self overhead report in headless mode.")
   parser.add_argument('--num_process', type=int, default=30, help="Maximum number of processes that will be shown.")
   parser.add_argument('--only_ros', action='store_true', default=False, help="List only ROS 2 node processes.")
-
+  parser.add_argument('--num_history', type=int, default=DataContainer.MAX_NUM_HISTORY, help="Number of raw samples kept in memory for graph.")
+  parser.add_argument('--rollup_10s_history', type=int, default=DataContainer.ROLLUP_10S_HISTORY, help="Number of 10-second min/mean/max rollups kept in memory for graph of long ranges (GUI). 0 disables it.")
+  parser.add_argument('--rollup_1min_history', type=int, default=DataContainer.ROLLUP_1MIN_HISTORY, help="Number of 1-minute min/mean/max rollups kept in memory for graph of long ranges (GUI). 0 disables it.")
+  parser.add_argument('--max_series', type=int, default=DataContainer.MAX_NUM_SERIES, help="Maximum number of processes recorded at the same time. Less significant processes are folded into 'other'. 0 means no limit.")
+  parser.add_argument('--evict_after', type=int, default=DataContainer.EVICT_AFTER, help="Number of samples after which a finished process is removed from recording.")
+  parser.add_argument('--profile_json', type=str, default=None, help="Save timing of each stage of rotop itself to this json file on exit. Press 'p' (CUI) or 'PROFILE' (GUI) to show it.")
+  parser.add_argument('--backend', type=str, default='proc', choices=['proc', 'top'], help="How to sample processes. 'proc' reads /proc directly, 'top' runs top command.")
+  parser.add_argument('--threads', action='store_true', default=False, help="Show CPU usage of threads rolled up by thread name under each process (e.g. executors in a component container). Only for proc backend.")
+  parser.add_argument('--aggregate', type=str, default='none', choices=TopRunnerBase.AGGREGATE_MODE_LIST, help="Add sums of processes by ROS namespace and/or launch subtree (PPID chain, only for proc backend) as extra rows and series. Press '+'/'-' to expand/collapse rows.")
+  parser.add_argument('--replay', type=str, default=None, help="Replay a text file captured by `top -cb -w 512` or a directory recorded with --record_format binary, instead of sampling.")
+  parser.add_argument('--replay_speed', type=str, default='asap', choices=['asap', 'realtime'], help="'asap' replays as fast as possible, 'realtime' keeps the intervals of the recording.")
+
+  parser.add_argument('--agent', type=str, default=None, help="Send samples to an aggregator (rotop --aggregator PORT) at HOST:PORT. With --headless, nothing is recorded locally unless --csv is given.")
+  parser.add_argument('--agent_name', type=str, default=None, help="Host name sent by --agent. Default is the host name of this machine.")
+  parser.add_argument('--agent_batch', type=int, default=5, help="Number of samples sent at once by --agent.")
+  parser.add_argument('--agent_backlog', type=int, default=3600, help="Number of samples kept by --agent while the aggregator is unreachable. They are sent after reconnection.")
+  parser.add_argument('--aggregator', type=int, default=None, help="Show samples received from agents on this port instead of sampling this host. Series are named '{host}: {process}'. With --csv, data of each host is also recorded as {host}_cpu_000.csv etc.")
+  parser.add_argument('--shm', type=str, default=None, help="Publish the latest sample to shared memory (/dev/shm/SHM) for other local processes. Read it with rotop.shared_snapshot.SharedSnapshotReader.")
+  parser.add_argument('--shm_capacity', type=int, default=1024, help="Number of rows in the shared memory when --max_series is 0.")
+  parser.add_argument('--metrics_port', type=int, default=None, help="Serve the latest sample at http://localhost:METRICS_PORT/metrics in Prometheus / OpenMetrics text format.")
+  parser.add_argument('--metrics_bind', type=str, default='127.0.0.1', help="Address which --metrics_port listens on. Use 0.0.0.0 to be scraped from other hosts (the process list of this host is exposed).")
+  parser.add_argument('--metrics_top', type=int, default=20, help="Number of process names exported by --metrics_port, in order of %%CPU. Values of the others are summed into 'other'.")
+  parser.add_argument('--metrics_allowlist', type=str, default=None, help="Regular expression of process names always exported by --metrics_port in addition to --metrics_top.")
   args = parser.parse_args()
 
   logger.debug(f'filter: {args.filter}')
   logger.debug(f'csv: {args.csv}')
+  logger.debug(f'csv_max_row: {args.csv_max_row}')
+  logger.debug(f'csv_max_bytes: {args.csv_max_bytes}')
+  logger.debug(f'csv_flush_interval: {args.csv_flush_interval}')
+  logger.debug(f'record_format: {args.record_format}')
   logger.debug(f'gui: {args.gui}')
+  logger.debug(f'headless: {args.headless}')
+  logger.debug(f'report_interval: {args.report_interval}')
   logger.debug(f'num_process: {args.num_process}')
   logger.debug(f'only_ros: {args.only_ros}')
+  logger.debug(f'num_history: {args.num_history}')
+  logger.debug(f'rollup_10s_history: {args.rollup_10s_history}')
+  logger.debug(f'rollup_1min_history: {args.rollup_1min_history}')
+  logger.debug(f'max_series: {args.max_series}')
+  logger.debug(f'evict_after: {args.evict_after}')
+  logger.debug(f'profile_json: {args.profile_json}')
+  logger.debug(f'backend: {args.backend}')
+  logger.debug(f'threads: {args.threads}')
+  logger.debug(f'aggregate: {args.aggregate}')
+  logger.debug(f'replay: {args.replay}')
+  logger.debug(f'replay_speed: {args.replay_speed}')
+  logger.debug(f'agent: {args.agent}')
+  logger.debug(f'agent_name: {args.agent_name}')
+  logger.debug(f'agent_batch: {args.agent_batch}')
+  logger.debug(f'agent_backlog: {args.agent_backlog}')
+  logger.debug(f'aggregator: {args.aggregator}')
+  logger.debug(f'shm: {args.shm}')
+  logger.debug(f'shm_capacity: {args.shm_capacity}')
+  logger.debug(f'metrics_port: {args.metrics_port}')
+  logger.debug(f'metrics_bind: {args.metrics_bind}')
+  logger.debug(f'metrics_top: {args.metrics_top}')
+  logger.debug(f'metrics_allowlist: {args.metrics_allowlist}')
 
   return args
 
 
 def main():
   args = parse_args()
-  if args.gui:
+  # views are imported only when used, because gui_main imports Dear PyGui and pandas
+  if args.headless:
+    from .headless_main import headless_main
+    headless_main(args)
+  elif args.gui:
+    from .gui_main import gui_main
     gui_main(args)
   else:
     curses.wrapper(main_curses, args)
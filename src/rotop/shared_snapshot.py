@@ -0,0 +1,201 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Latest sample of rotop in shared memory (a file in /dev/shm), so that other local processes can read it without scanning /proc.
+
+Layout (little endian, fixed size):
+  offset 0  : magic 'RTSM', version (u16), reserved (u16), capacity (u32), name size (u32)
+  offset 16 : sequence number (u64). Odd while the writer is updating (seqlock)
+  offset 24 : timestamp (f64), user, sys, idle (f32 * 3), num_row (u32), crc32 (u32) of the frame header before crc, rows and names
+  offset 56 : rows. [pid (i32), name index (u32), %CPU (f32), %MEM (f32), RSS KiB (u64)] * capacity. Only num_row rows are valid
+  then      : names. utf-8, NUL padded, name size bytes * capacity. Name of a row is names[name index]
+              name index 0xFFFFFFFF means 'other' (sum of processes not tracked). PID is 0 for rows which are not a process (e.g. group)
+
+Name index is the ID given by ProcessRegistry, so it is stable while the process is alive and reused after it finishes.
+A reader copies the data, and accepts it only if the sequence number is the same even number before and after the copy and crc32 matches.
+crc32 detects torn reads also on CPUs with weak memory ordering, where Python can't issue memory barriers.
+"""
+from __future__ import annotations
+from typing import NamedTuple
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from .utility import create_logger
+
+
+logger = create_logger(__name__, log_filename='rotop.log')
+
+MAGIC = b'RTSM'
+VERSION = 1
+STATIC_HEADER = struct.Struct('<4sHHII')
+SEQ = struct.Struct('<Q')
+FRAME_HEADER = struct.Struct('<dfffI')
+CRC = struct.Struct('<I')
+ROW = struct.Struct('<iIffQ')
+SEQ_OFFSET = STATIC_HEADER.size
+FRAME_OFFSET = SEQ_OFFSET + SEQ.size
+CRC_OFFSET = FRAME_OFFSET + FRAME_HEADER.size
+ROW_OFFSET = 56
+OTHER_INDEX = 0xFFFFFFFF
+OTHER_NAME = 'other'
+NAME_SIZE = 128
+SHM_DIR = '/dev/shm'
+
+
+def get_snapshot_path(name: str) -> str:
+  """Name in /dev/shm, or a path if it contains '/'"""
+  return name if '/' in name else os.path.join(SHM_DIR, name)
+
+
+class SnapshotRow(NamedTuple):
+  pid: int
+  name: str
+  cpu: float
+  mem: float
+  rss_kib: int
+
+
+class Snapshot(NamedTuple):
+  seq: int
+  timestamp: float
+  total_list: tuple[float, float, float]   # user, sys, idle
+  row_list: list[SnapshotRow]
+
+
+class SharedSnapshotWriter:
+  """
+  Publish the latest sample. The file is created with the final size, and removed by close().
+  Names are written only when a name index gets a new name.
+  """
+  def __init__(self, name: str, capacity: int, name_size: int=NAME_SIZE):
+    self.file_path = get_snapshot_path(name)
+    self.capacity = capacity
+    self.name_size = name_size
+    self.name_offset = ROW_OFFSET + ROW.size * capacity
+    size = self.name_offset + name_size * capacity
+    tmp_file_path = self.file_path + '.tmp'
+    with open(tmp_file_path, 'wb') as f:
+      f.truncate(size)
+    with open(tmp_file_path, 'r+b') as f:
+      self.mm = mmap.mmap(f.fileno(), size)
+    self.mm[0:STATIC_HEADER.size] = STATIC_HEADER.pack(MAGIC, VERSION, 0, capacity, name_size)
+    self.seq = 0
+    os.replace(tmp_file_path, self.file_path)
+    self.name_list: list[str] = [None] * capacity
+    self.is_capacity_warned = False
+
+
+  def publish(self, timestamp: float, total_list: list[float], pid_list: list[int], index_list: list[int],
+              name_list: list[str], cpu_list: list[float], mem_list: list[float], rss_list: list[int]):
+    """index_list is the ID of each series (None for 'other'). pid is 0 and rss is 0 if unknown"""
+    # pack everything before entering the critical section, so that readers retry less
+    rows = bytearray()
+    name_update_list = []
+    for pid, index, name, cpu, mem, rss in zip(pid_list, index_list, name_list, cpu_list, mem_list, rss_list):
+      if index is None:
+        index = OTHER_INDEX
+      elif index >= self.capacity:
+        if not self.is_capacity_warned:
+          logger.warning(f'Shared snapshot is full ({self.capacity}). Series out of capacity are not published')
+          self.is_capacity_warned = True
+        continue
+      elif self.name_list[index] != name:
+        self.name_list[index] = name
+        name_update_list.append((index, name.encode('utf-8')[:self.name_size].ljust(self.name_size, b'\0')))
+      rows += ROW.pack(pid or 0, index, cpu, mem, rss)
+    num_row = len(rows) // ROW.size
+    frame_header = FRAME_HEADER.pack(timestamp, *total_list, num_row)
+
+    mm = self.mm
+    self.seq += 1
+    mm[SEQ_OFFSET:FRAME_OFFSET] = SEQ.pack(self.seq)
+    for index, encoded in name_update_list:
+      offset = self.name_offset + index * self.name_size
+      mm[offset:offset + self.name_size] = encoded
+    mm[ROW_OFFSET:ROW_OFFSET + len(rows)] = rows
+    crc = zlib.crc32(mm[self.name_offset:], zlib.crc32(rows, zlib.crc32(frame_header)))
+    mm[FRAME_OFFSET:CRC_OFFSET + CRC.size] = frame_header + CRC.pack(crc)
+    self.seq += 1
+    mm[SEQ_OFFSET:FRAME_OFFSET] = SEQ.pack(self.seq)
+
+
+  def close(self):
+    self.mm.close()
+    try:
+      os.remove(self.file_path)
+    except FileNotFoundError:
+      pass
+
+
+class SharedSnapshotReader:
+  """
+  Read the latest sample published by rotop (--shm NAME). e.g.
+    reader = SharedSnapshotReader('rotop')
+    snapshot = reader.read()
+    for row in snapshot.row_list: print(row.pid, row.name, row.cpu, row.mem, row.rss_kib)
+  """
+  MAX_RETRY = 100
+
+  def __init__(self, name: str):
+    self.file_path = get_snapshot_path(name)
+    with open(self.file_path, 'rb') as f:
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, _, self.capacity, self.name_size = STATIC_HEADER.unpack_from(self.mm, 0)
+    if magic != MAGIC or version != VERSION:
+      self.mm.close()
+      raise ValueError(f'{self.file_path} is not a rotop snapshot of version {VERSION}')
+    self.name_offset = ROW_OFFSET + ROW.size * self.capacity
+
+
+  def get_seq(self) -> int:
+    """Sequence number of the latest sample, to check an update without reading the sample"""
+    return SEQ.unpack_from(self.mm, SEQ_OFFSET)[0] & ~1
+
+
+  def read(self, last_seq: int=None) -> Snapshot:
+    """Latest sample, or None if it's not newer than last_seq (or it's being updated too frequently to read)"""
+    mm = self.mm
+    for _ in range(self.MAX_RETRY):
+      seq, = SEQ.unpack_from(mm, SEQ_OFFSET)
+      if seq & 1:
+        time.sleep(0)
+        continue
+      if seq == 0 or seq == last_seq:
+        return None
+      frame_header = mm[FRAME_OFFSET:CRC_OFFSET]
+      crc, = CRC.unpack_from(mm, CRC_OFFSET)
+      timestamp, user, sys, idle, num_row = FRAME_HEADER.unpack(frame_header)
+      rows = mm[ROW_OFFSET:ROW_OFFSET + ROW.size * min(num_row, self.capacity)]
+      names = mm[self.name_offset:]
+      if SEQ.unpack_from(mm, SEQ_OFFSET)[0] != seq:
+        continue
+      if zlib.crc32(names, zlib.crc32(rows, zlib.crc32(frame_header))) != crc:
+        continue
+      row_list = []
+      for pid, index, cpu, mem, rss in ROW.iter_unpack(rows):
+        if index == OTHER_INDEX:
+          name = OTHER_NAME
+        else:
+          offset = index * self.name_size
+          name = names[offset:offset + self.name_size].rstrip(b'\0').decode('utf-8', errors='replace')
+        row_list.append(SnapshotRow(pid, name, cpu, mem, rss))
+      return Snapshot(seq, timestamp, (user, sys, idle), row_list)
+    return None
+
+
+  def close(self):
+    self.mm.close()
@@ -13,44 +13,101 @@
 # limitations under the License.
 from __future__ import annotations
 import atexit
-import pexpect
 import re
 import signal
 
+from .aggregation import AggregationTree
+from .identity_cache import ProcessIdentityCache
 from .utility import create_logger
 
 
 logger = create_logger(__name__, log_filename='rotop.log')
 
 
-class TopRunner:
+class TopRunnerBase:
+  """
+  Common part of process samplers. A sampler provides frames in the same text format as `top -cb`,
+  so that DataContainer and the views don't need to care which backend is used.
+  """
+  AGGREGATE_MODE_LIST = ['none', 'namespace', 'tree', 'both']
+  MAX_TREE_DEPTH = 64
   def __init__(self, interval, filter):
-    self.child = pexpect.spawn(f'top -cb -d {interval} -o %CPU -w 512')
+    self.interval = interval
     self.filter_re = self.create_filter_re(filter)
     self.ros_re = self.create_filter_re('--ros-arg|/opt/ros')
+    self.identity_cache = ProcessIdentityCache(self.filter_re, self.ros_re, self.parse_command_str, self.parse_namespace)
+    self.aggregate_mode = 'none'
+    self.aggregation_tree: AggregationTree = None
+    self.group_depth = 1    # depth of group rows shown in result_lines. All groups are in result_show_all_lines
     self.col_range_list_to_display = None
     self.col_range_pid = None
     self.col_range_CPU = None
     self.col_range_MEM = None
+    self.col_range_RES = None
     self.col_range_command = None
-    self.next_after = ''
+    self.frame_time = None    # unix time of the last frame when it's not the current time (e.g. replay)
 
 
-  def __del__(self):
-    signal.signal(signal.SIGINT, signal.SIG_IGN)  # ignore ctrl-c while closing
-    self.child.close()
+  def read_frame(self) -> list[str]:
+    """Return lines of one frame (system information, process header, processes), or None if not ready"""
+    raise NotImplementedError
+
+
+  def fileno(self) -> int:
+    """File descriptor which becomes readable when the next frame is ready, or None if not available"""
+    return None
+
+
+  def get_wait_time(self) -> float:
+    """Time in seconds until the next frame is expected. None means waiting for fileno() only"""
+    return 0
+
+
+  def is_finished(self) -> bool:
+    """True if no more frames will come (e.g. end of replay)"""
+    return False
+
+
+  def set_aggregate_mode(self, mode: str):
+    """Show sums of processes by ROS namespace ('namespace'), by launch subtree ('tree'), or both"""
+    self.aggregate_mode = mode
+    self.aggregation_tree = AggregationTree() if mode != 'none' else None
+
+
+  def get_child_pid_list(self) -> list[int]:
+    """PIDs of child processes used for sampling (e.g. top command), to measure the overhead"""
+    return []
+
+
+  def set_record_dir(self, dir_name: str):
+    """Directory where data recorded by the sampler itself is saved (e.g. data of each host received by aggregator). None if not recording"""
+    pass
+
+
+  def get_ppid(self, pid: int) -> int:
+    """Parent PID, or None if the backend doesn't know it"""
+    return None
+
+
+  def get_starttime(self, pid: int) -> int:
+    """Start time of a process to distinguish reused PIDs, or None if the backend doesn't know it"""
+    return None
+
+
+  def is_process_line(self, command_str: str) -> bool:
+    """False for lines which are not a process itself (e.g. threads of a process)"""
+    return True
+
+
+  def get_process_key(self, line: str, command_str: str):
+    """Key identifying a process for ProcessIdentityCache. Results cached are derived only from the command string"""
+    return (line[self.col_range_pid[0]:self.col_range_pid[1]], command_str)
 
 
   def run(self, max_num_process, show_all=False, only_ros=False):
-    # get the result string of top command
-    self.child.expect(r'top - .*load average:')
-    before = self.child.before
-    previous_after = self.next_after
-    self.next_after = self.child.after
-    if before == '' or previous_after == '' or self.next_after == '':
+    orgial_lines = self.read_frame()
+    if orgial_lines is None:
       return None, None
-    top_str = (previous_after + before).decode('utf-8')
-    orgial_lines = top_str.splitlines()
 
     result_lines = []
     result_show_all_lines = []
@@ -74,18 +131,33 @@ class TopRunner:
     result_lines[-1] = process_header
 
     # Process Information
+    # all processes are visited when aggregating, because groups need processes which are not shown
+    is_full = False
+    aggregate_list = []
+    frame_process_dict = {}
     for line in orgial_lines[row_process_info:]:
       if self.col_range_command and self.col_range_command[0] > 0 and len(line) > self.col_range_command[0]:
+        command_str = line[self.col_range_command[0]:]
+        key = self.get_process_key(line, command_str)
+        identity = self.identity_cache.get(key, command_str)
+        is_aggregated = self.aggregation_tree is not None and self.is_process_line(command_str)
+        if is_aggregated:
+          pid = int(line[self.col_range_pid[0]:self.col_range_pid[1]])
+          frame_process_dict[pid] = (key, identity)
+        if not identity.is_match_filter:
+          continue
+        if only_ros and not identity.is_ros:
+          continue
+        if is_aggregated:
+          aggregate_list.append((key, pid, identity, line))
+        if is_full:
+          continue
+
         process_info_org = line[:self.col_range_command[0]]
         process_info = ''
         for range in self.col_range_list_to_display:
           process_info += process_info_org[range[0]:range[1]]
-        command_str = line[self.col_range_command[0]:]
-        if not self.filter_re.match(command_str):
-          continue
-        if only_ros and not self.ros_re.match(command_str):
-          continue
-        command_str = self.parse_command_str(command_str)
+        command_str = identity.name
 
         line = process_info + command_str
         show_all_line = process_info_org + command_str
@@ -93,18 +165,91 @@ class TopRunner:
         result_lines.append(line)
         result_show_all_lines.append(show_all_line)
         if len(result_lines) >= row_process_info + max_num_process:
-          break
+          if self.aggregation_tree is None:
+            break
+          is_full = True
+    self.identity_cache.next_generation()
+
+    if self.aggregation_tree is not None:
+      group_lines, group_show_all_lines = self.aggregate(aggregate_list, frame_process_dict)
+      result_lines[row_process_info:row_process_info] = group_lines
+      result_show_all_lines[row_process_info:row_process_info] = group_show_all_lines
 
     return result_lines, result_show_all_lines
 
 
+  def aggregate(self, aggregate_list: list, frame_process_dict: dict) -> tuple[list[str], list[str]]:
+    """Update groups and return lines of groups. Group lines don't have PID"""
+    for key, pid, identity, line in aggregate_list:
+      cpu = float(line[self.col_range_CPU[0]:self.col_range_CPU[1]])
+      mem = float(line[self.col_range_MEM[0]:self.col_range_MEM[1]])
+      if key in self.aggregation_tree:
+        self.aggregation_tree.update(key, cpu, mem)
+      else:
+        self.aggregation_tree.update(key, cpu, mem, self.create_group_list(pid, identity, frame_process_dict))
+    self.aggregation_tree.next_generation()
+
+    group_lines = []
+    group_show_all_lines = []
+    # a group of only one process is the same as the process row
+    for node in self.aggregation_tree.create_row_list(min_num_process=2):
+      group_info_org = self.create_group_info(node.cpu, node.mem)
+      group_show_all_lines.append(group_info_org + node.name)
+      if node.depth < self.group_depth:
+        group_info = ''
+        for range in self.col_range_list_to_display:
+          group_info += group_info_org[range[0]:range[1]]
+        group_lines.append(group_info + '  ' * node.depth + node.name)
+    return group_lines, group_show_all_lines
+
+
+  def create_group_list(self, pid: int, identity, frame_process_dict: dict) -> list[tuple]:
+    """Groups from root to leaf. Namespace groups are made from __ns, and tree groups are ROS processes in the PPID chain"""
+    group_list = []
+    if self.aggregate_mode in ('namespace', 'both') and identity.namespace:
+      path = ''
+      parent_key = None
+      for name in identity.namespace.split('/'):
+        if name == '':
+          continue
+        path += '/' + name
+        group_list.append((('ns', path), f'ns:{path}', parent_key))
+        parent_key = ('ns', path)
+
+    if self.aggregate_mode in ('tree', 'both'):
+      ancestor_list = []
+      current_pid = pid
+      for _ in range(self.MAX_TREE_DEPTH):
+        process = frame_process_dict.get(current_pid)
+        if process is None:
+          break
+        if process[1].is_ros:
+          ancestor_list.append((current_pid, process[0], process[1]))
+        current_pid = self.get_ppid(current_pid)
+      parent_key = None
+      for ancestor_pid, ancestor_key, ancestor_identity in reversed(ancestor_list):
+        group_list.append((('tree', ancestor_key), f'tree:{ancestor_identity.name} ({ancestor_pid})', parent_key))
+        parent_key = ('tree', ancestor_key)
+    return group_list
+
+
+  def create_group_info(self, cpu: float, mem: float) -> str:
+    """Columns before COMMAND of a group line. Only %CPU and %MEM are filled"""
+    group_info = [' '] * self.col_range_command[0]
+    for col_range, value in ((self.col_range_CPU, cpu), (self.col_range_MEM, mem)):
+      value_str = f'{max(value, 0):.1f}'[-(col_range[1] - col_range[0]):]
+      group_info[col_range[1] - len(value_str):col_range[1]] = value_str
+    return ''.join(group_info)
+
+
   def analyze_cols(self, process_header: str, show_all: bool):
     if self.col_range_command is None or self.col_range_command[0] == -1:
       self.col_range_list_to_display = self.get_col_range_list_to_display(process_header, show_all)
-      self.col_range_pid = TopRunner.get_col_range_PID(process_header)
-      self.col_range_CPU = TopRunner.get_col_range_CPU(process_header)
-      self.col_range_MEM = TopRunner.get_col_range_MEM(process_header)
-      self.col_range_command = TopRunner.get_col_range_command(process_header)
+      self.col_range_pid = TopRunnerBase.get_col_range_PID(process_header)
+      self.col_range_CPU = TopRunnerBase.get_col_range_CPU(process_header)
+      self.col_range_MEM = TopRunnerBase.get_col_range_MEM(process_header)
+      self.col_range_RES = TopRunnerBase.get_col_range_RES(process_header)
+      self.col_range_command = TopRunnerBase.get_col_range_command(process_header)
     return
 
 
@@ -154,6 +299,26 @@ class TopRunner:
     return (start_col, end_col)
 
 
+  @staticmethod
+  def get_col_range_RES(process_info_header_line: str):
+    start_col = process_info_header_line.find('VIRT') + len('VIRT')
+    end_col = process_info_header_line.find('RES') + len('RES')
+    return (start_col, end_col)
+
+
+  @staticmethod
+  def parse_kib(value_str: str) -> int:
+    """Memory size in top format (e.g. '123456', '1.2g') in KiB, or None if it's empty"""
+    value_str = value_str.strip()
+    if not value_str:
+      return None
+    scale = {'m': 1024, 'g': 1024 ** 2, 't': 1024 ** 3, 'p': 1024 ** 4, 'e': 1024 ** 5}.get(value_str[-1])
+    try:
+      return int(float(value_str[:-1]) * scale) if scale else int(value_str)
+    except ValueError:
+      return None
+
+
   @staticmethod
   def get_col_range_list_to_display(process_info_header_line: str, show_all=False):
     range_list = []
@@ -210,6 +375,15 @@ class TopRunner:
     return cmd
 
 
+  @staticmethod
+  def parse_namespace(command):
+    idx_ns = command.find('__ns:=')
+    if idx_ns < 0:
+      return None
+    ns = command[idx_ns + len('__ns:='):].split()
+    return ns[0] if ns else None
+
+
   @staticmethod
   def parse_command_str(command):
     param_for_ros2 = ['__node', '__ns']
@@ -217,10 +391,70 @@ class TopRunner:
         # kernel process
         command = command
     elif any(item in command for item in param_for_ros2):
-        command = TopRunner.parse_component_container_command(command)
+        command = TopRunnerBase.parse_component_container_command(command)
     elif 'python' in command:
-        command = TopRunner.parse_python_command(command)
+        command = TopRunnerBase.parse_python_command(command)
     else:
         # normal process
         command = command.split()[0].split('/')[-1]
-    return command
\ No newline at end of file
+    return command
+
+
+class TopRunner(TopRunnerBase):
+  def __init__(self, interval, filter):
+    super().__init__(interval, filter)
+    import pexpect
+    self.child = pexpect.spawn(f'top -cb -d {interval} -o %CPU -w 512')
+    self.next_after = ''
+
+
+  def __del__(self):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # ignore ctrl-c while closing
+    self.child.close()
+
+
+  def fileno(self) -> int:
+    return self.child.child_fd
+
+
+  def get_child_pid_list(self) -> list[int]:
+    return [self.child.pid]
+
+
+  def get_wait_time(self) -> float:
+    return None
+
+
+  def read_frame(self) -> list[str]:
+    # get the result string of top command
+    self.child.expect(r'top - .*load average:')
+    before = self.child.before
+    previous_after = self.next_after
+    self.next_after = self.child.after
+    if before == '' or previous_after == '' or self.next_after == '':
+      return None
+    top_str = (previous_after + before).decode('utf-8')
+    return top_str.splitlines()
+
+
+def create_top_runner(backend: str, interval, filter, replay: str=None, replay_speed: str='asap', threads: bool=False,
+                      aggregate: str='none', aggregator_port: int=None) -> TopRunnerBase:
+  top_runner = None
+  if aggregator_port is not None:
+    from .remote import AggregatorRunner
+    top_runner = AggregatorRunner(aggregator_port, interval, filter)
+  elif replay:
+    from .replay_runner import create_replay_runner
+    top_runner = create_replay_runner(replay, interval, filter, replay_speed)
+  elif backend == 'proc':
+    from .proc_runner import ProcRunner
+    if ProcRunner.is_available():
+      top_runner = ProcRunner(interval, filter, threads)
+    else:
+      logger.info('/proc is not available. Use top command instead')
+  if top_runner is None:
+    if threads:
+      logger.warning('Thread mode is supported only by proc backend')
+    top_runner = TopRunner(interval, filter)
+  top_runner.set_aggregate_mode(aggregate)
+  return top_runner
@@ -12,18 +12,35 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import annotations
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from distutils.util import strtobool
 from pathlib import Path
 import argparse
+import csv
+import glob
+import itertools
+import json
 import logging
+import numpy as np
 import pandas as pd
 import os
 import sys
+import threading
+import time
 import flask
-from bokeh.models import DatetimeTickFormatter, HoverTool, Legend
+from bokeh.document import Document
+from bokeh.embed import file_html
+from bokeh.layouts import column
+from bokeh.models import ColumnDataSource, CustomJS, DatetimeTickFormatter, Div, HoverTool, Legend
 from bokeh.plotting import figure, save
 from bokeh.resources import CDN
 from bokeh.palettes import Category10, Category20
+try:
+  from rotop.binary_log import BinaryLogReader
+except ImportError:
+  sys.path.append(str(Path(__file__).resolve().parent.parent))
+  from rotop.binary_log import BinaryLogReader
 
 
 logger = logging.getLogger(__name__)
@@ -40,39 +57,62 @@ def parse_args():
     description=f'rotop csv visualizer')
   parser.add_argument('csv_path', nargs=1, type=str)
   parser.add_argument('--max_process_num', type=int, default=30, help="Max num to display process.")
+  parser.add_argument('--num_workers', type=int, default=None, help="Number of workers to read files and render graphs. Default is the number of CPUs.")
+  parser.add_argument('--max_points', type=int, default=2000, help="Max number of points per process in graph. Data is downsampled keeping min/max. 0 means no limit.")
+  parser.add_argument('--serve', action='store_true', default=False, help="Serve pages with full resolution data for zoomed range.")
+  parser.add_argument('--port', type=int, default=8080, help="Port number for --serve.")
+  parser.add_argument('--bind', type=str, default='127.0.0.1', help="Address which --serve / --live listens on. Use 0.0.0.0 to be accessed from other hosts (the process list of the recorded host is exposed).")
+  parser.add_argument('--live', action='store_true', default=False, help="Serve pages following csv files being written by `rotop --csv` (implies --serve). New samples are pushed to browsers.")
+  parser.add_argument('--window', type=float, default=600, help="Time range [sec] shown by --live.")
+  parser.add_argument('--start', type=float, default=None, help="Start time (unix time) to display. Only for binary log (*.rtb).")
+  parser.add_argument('--end', type=float, default=None, help="End time (unix time) to display. Only for binary log (*.rtb).")
+  parser.add_argument('--no_cache', action='store_true', default=False, help=f"Don't use parse results cached in {CACHE_DIR_NAME} of the log directory.")
   args = parser.parse_args()
   args.csv_path = args.csv_path[0]
   logger.debug(f'csv_path: {args.csv_path}')
   logger.debug(f'max_process_num: {args.max_process_num}')
+  logger.debug(f'num_workers: {args.num_workers}')
+  logger.debug(f'max_points: {args.max_points}')
+  logger.debug(f'serve: {args.serve}')
+  logger.debug(f'port: {args.port}')
+  logger.debug(f'bind: {args.bind}')
+  logger.debug(f'live: {args.live}')
+  logger.debug(f'window: {args.window}')
+  logger.debug(f'start: {args.start}')
+  logger.debug(f'end: {args.end}')
+  logger.debug(f'no_cache: {args.no_cache}')
   return args
 
 
 def find_csv_files_from_filename(csv_path: Path) -> list[Path]:
   prefix = '_'.join(str(csv_path.stem).split('_')[:-1])
   number_base = str(csv_path.stem).split('_')[-1:][0]
+  # list the directory once instead of probing each number
+  file_dict = {}
+  for file in csv_path.parent.glob(glob.escape(prefix) + '_*' + csv_path.suffix):
+    number = file.stem[len(prefix) + 1:]
+    if len(number) == len(number_base) and number.isdigit():
+      file_dict[int(number)] = file
   file_list = []
-  for i in range(999):
-    number = f'{i:0{len(number_base)}}'
-    filename = csv_path.parent.joinpath(prefix + '_' + number + csv_path.suffix)
-    file = Path(filename)
-    if file.exists():
-      file_list.append(file)
-    else:
-      break
+  while len(file_list) in file_dict:
+    file_list.append(file_dict[len(file_list)])
   return file_list
 
 
 def find_csv_files_from_dir(csv_path: Path) -> dict[str, list[Path]]:
   prefix_name_list = []
   file_list = []
+  file_dict = {}
   for file in csv_path.iterdir():
+    if file.suffix == '.rtb':
+      file_dict[file.stem] = [file]
+      continue
     if file.suffix != '.csv':
       continue
     prefix = '_'.join(str(file.stem).split('_')[:-1])
     if prefix not in prefix_name_list:
       prefix_name_list.append(prefix)
       file_list.append(file)
-  file_dict = {}
   for i, prefix_name in enumerate(prefix_name_list):
     file_dict[prefix_name] = find_csv_files_from_filename(file_list[i])
   return file_dict
@@ -82,6 +122,8 @@ def find_csv_files_from_path(csv_path: Path) -> dict[str, list[Path]]:
   if csv_path.is_dir():
     return find_csv_files_from_dir(csv_path)
   elif csv_path.is_file():
+    if csv_path.suffix == '.rtb':
+      return {csv_path.stem: [csv_path]}
     if csv_path.suffix != '.csv':
       return None
     prefix = '_'.join(str(csv_path.stem).split('_')[:-1])
@@ -90,16 +132,192 @@ def find_csv_files_from_path(csv_path: Path) -> dict[str, list[Path]]:
     return None
 
 
-def create_df_from_csv_files(file_list: list[Path]):
-  df_total = pd.DataFrame()
-  for file in file_list:
-    df = pd.read_csv(file, index_col=0)
-    df_total = pd.concat([df_total, df], axis=0)
-  df_total = df_total.sort_index()
+def read_csv_file(file: Path) -> pd.DataFrame:
+  # A file being written by rotop may have new columns which are not in its header line yet. They are in the sidecar file.
+  sidecar = file.with_name(file.name + '.columns')
+  if sidecar.exists():
+    names = pd.read_csv(sidecar, nrows=0).columns.to_list()
+    return pd.read_csv(file, header=None, skiprows=1, names=names, index_col=0)
+  return pd.read_csv(file, index_col=0)
 
-  def unixtime_to_datetime(unix_time):
-      return pd.to_datetime(unix_time, unit='s')
-  df_total.index = df_total.index.map(unixtime_to_datetime)
+
+def create_df_from_csv_files(file_list: list[Path], num_workers: int=None, cache: ParseCache=None):
+  # pandas releases GIL while parsing, so threads are enough
+  with ThreadPoolExecutor(max_workers=num_workers) as executor:
+    df_list = list(executor.map(cache.read_chunk if cache else read_csv_file, file_list))
+  df_total = pd.concat(df_list, axis=0) if df_list else pd.DataFrame()
+  return format_df(df_total)
+
+
+def create_df_from_binary_file(file: Path, start: float=None, end: float=None):
+  reader = BinaryLogReader(file)
+  timestamps, names, values = reader.read(start, end)
+  reader.close()
+  df_total = pd.DataFrame(values, columns=names, index=pd.Index(timestamps, name='datetime'))
+  return format_df(df_total)
+
+
+def create_df_from_files(file_list: list[Path], start: float=None, end: float=None, num_workers: int=None, cache: ParseCache=None):
+  if cache:
+    signature = cache.get_signature(file_list, start, end)
+    df = cache.load_df(signature)
+    if df is not None:
+      return df
+  if len(file_list) == 1 and file_list[0].suffix == '.rtb':
+    df = create_df_from_binary_file(file_list[0], start, end)
+  else:
+    df = create_df_from_csv_files(file_list, num_workers, cache)
+  if cache:
+    cache.save_df(signature, df)
+  return df
+
+
+CACHE_DIR_NAME = '.visualize_cache'
+
+
+class ParseCache:
+  """
+  Sidecar cache of parse results of one prefix (e.g. cpu) in {rotop_log_dir}/.visualize_cache.
+  Each csv chunk is pickled, and its mtime and size are kept in a manifest ({prefix}.json), so that only new or changed chunks are parsed.
+  The merged DataFrame, Stats and the parameters of the rendered page are kept with the signature of all files,
+  and are used as they are when nothing is changed.
+  Pickle is used instead of Parquet/Feather not to add pyarrow to dependencies.
+  """
+  VERSION = 1
+
+  def __init__(self, rotop_log_dir: Path, prefix: str, enabled: bool=True):
+    self.cache_dir = rotop_log_dir.joinpath(CACHE_DIR_NAME)
+    self.prefix = prefix
+    self.enabled = enabled
+    self.manifest_path = self.cache_dir.joinpath(f'{prefix}.json')
+    self.manifest = self.load_manifest()
+
+
+  def load_manifest(self) -> dict:
+    manifest = {'version': self.VERSION, 'chunks': {}, 'df': None, 'stats': None, 'page': None}
+    if not self.enabled or not self.manifest_path.exists():
+      return manifest
+    try:
+      with open(self.manifest_path, 'r', encoding='utf-8') as f:
+        loaded = json.load(f)
+    except (OSError, ValueError) as e:
+      logger.warning(f'Ignore cache: {e}')
+      return manifest
+    return loaded if loaded.get('version') == self.VERSION else manifest
+
+
+  def save(self):
+    if not self.enabled:
+      return
+    try:
+      tmp_path = self.manifest_path.with_suffix('.tmp')
+      with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(self.manifest, f)
+      os.replace(tmp_path, self.manifest_path)
+    except OSError as e:
+      logger.warning(f'Unable to save cache: {e}')
+
+
+  @staticmethod
+  def get_file_signature(file: Path) -> list:
+    stat = file.stat()
+    signature = [file.name, stat.st_mtime_ns, stat.st_size]
+    # columns in the sidecar file of a csv being written change the parse result
+    sidecar = file.with_name(file.name + '.columns')
+    if sidecar.exists():
+      stat = sidecar.stat()
+      signature += [stat.st_mtime_ns, stat.st_size]
+    return signature
+
+
+  def get_signature(self, file_list: list[Path], start: float=None, end: float=None) -> list:
+    return [self.get_file_signature(file) for file in file_list] + [start, end]
+
+
+  def write_pickle(self, obj, file_name: str) -> bool:
+    if not self.enabled:
+      return False
+    try:
+      path = self.cache_dir.joinpath(file_name)
+      path.parent.mkdir(parents=True, exist_ok=True)
+      obj.to_pickle(path)
+      return True
+    except OSError as e:
+      logger.warning(f'Unable to write cache: {e}')
+      self.enabled = False
+      return False
+
+
+  def read_pickle(self, file_name: str) -> pd.DataFrame:
+    try:
+      return pd.read_pickle(self.cache_dir.joinpath(file_name))
+    except Exception as e:
+      logger.warning(f'Ignore cache: {e}')
+      return None
+
+
+  def read_chunk(self, file: Path) -> pd.DataFrame:
+    signature = self.get_file_signature(file)
+    entry = self.manifest['chunks'].get(file.name)
+    if self.enabled and entry and entry['signature'] == signature:
+      df = self.read_pickle(entry['file'])
+      if df is not None:
+        return df
+    df = read_csv_file(file)
+    file_name = f'{self.prefix}/{file.stem}.pkl'
+    if self.write_pickle(df, file_name):
+      self.manifest['chunks'][file.name] = {'signature': signature, 'file': file_name}
+    return df
+
+
+  def load_df(self, signature: list) -> pd.DataFrame:
+    entry = self.manifest['df']
+    if not self.enabled or not entry or entry['signature'] != signature:
+      return None
+    return self.read_pickle(entry['file'])
+
+
+  def save_df(self, signature: list, df: pd.DataFrame):
+    file_name = f'{self.prefix}.pkl'
+    if self.write_pickle(df, file_name):
+      self.manifest['df'] = {'signature': signature, 'file': file_name}
+
+
+  def load_stats(self, signature: list) -> list[Stats]:
+    entry = self.manifest['stats']
+    if not self.enabled or not entry or entry['signature'] != signature:
+      return None
+    return [Stats(*values) for values in entry['values']]
+
+
+  def save_stats(self, signature: list, stats_list: list[Stats]):
+    # NaN is written as NaN by json, and read back as float('nan')
+    self.manifest['stats'] = {'signature': signature,
+                              'values': [[stats.name, float(stats.mean), float(stats.std), float(stats.max)] for stats in stats_list]}
+
+
+  def is_page_up_to_date(self, signature: list, options: dict, file_list: list[Path]) -> bool:
+    entry = self.manifest['page']
+    return self.enabled and entry is not None and entry['signature'] == signature and entry['options'] == options \
+      and all(file.exists() for file in file_list)
+
+
+  def save_page(self, signature: list, options: dict):
+    self.manifest['page'] = {'signature': signature, 'options': options}
+
+
+  def prune(self, file_list: list[Path]):
+    """Remove chunks which no longer exist"""
+    name_set = {file.name for file in file_list}
+    for name in list(self.manifest['chunks'].keys()):
+      if name not in name_set:
+        entry = self.manifest['chunks'].pop(name)
+        self.cache_dir.joinpath(entry['file']).unlink(missing_ok=True)
+
+
+def format_df(df_total: pd.DataFrame):
+  df_total = df_total.sort_index()
+  df_total.index = pd.to_datetime(df_total.index, unit='s')
 
   if 'idle' in df_total.columns:
     df_total['idle'] = 100 - df_total['idle']
@@ -114,16 +332,57 @@ def generate_color_from_integer(number):
 generate_color_from_integer.palette = Category10[10] + Category20[20]
 
 
-def create_graph(dest_dir: Path, name: str, unit: str, df: pd.DataFrame, width=1200, height=400) -> Path:
-  # workaround: Overwrite date time as UTC with time difference because it looks Bokeh doesn't care time　zone appropriately
-  fix_time_zone = pd.Timedelta(hours=9)
+# workaround: Overwrite date time as UTC with time difference because it looks Bokeh doesn't care time　zone appropriately
+FIX_TIME_ZONE = pd.Timedelta(hours=9)
+
+
+def downsample_minmax(df: pd.DataFrame, max_points: int) -> pd.DataFrame:
+  """
+  Reduce the number of rows to max_points keeping spikes.
+  Rows are split into max_points/2 buckets, and each bucket is represented by min and max of each column.
+  """
+  num_row = len(df)
+  if max_points <= 0 or num_row <= max_points:
+    return df
+  num_bucket = max(max_points // 2, 1)
+  starts = np.unique(np.linspace(0, num_row, num_bucket + 1).astype(np.int64)[:-1])
+  ends = np.append(starts[1:], num_row) - 1
+  values = df.to_numpy(dtype=np.float64)
+  index = df.index.to_numpy()
+
+  x = np.empty(len(starts) * 2, dtype=index.dtype)
+  x[0::2] = index[starts]
+  x[1::2] = index[ends]
+  y = np.empty((len(starts) * 2, values.shape[1]), dtype=np.float64)
+  with np.errstate(invalid='ignore'):
+    y[0::2] = np.fmin.reduceat(values, starts, axis=0)
+    y[1::2] = np.fmax.reduceat(values, starts, axis=0)
+  return pd.DataFrame(y, index=pd.Index(x, name=df.index.name), columns=df.columns)
+
+
+def create_graph_data(df: pd.DataFrame, max_points: int) -> dict[str, list]:
+  """Data for ColumnDataSource. Columns are named as y0, y1, ... because process names may contain any character"""
+  df = downsample_minmax(df, max_points)
+  data = {'datetime': df.index + FIX_TIME_ZONE}
+  for i, col_name in enumerate(df.columns):
+    data[f'y{i}'] = df[col_name].to_numpy()
+  return data
+
+
+def get_graph_file_path(dest_dir: Path, name: str) -> Path:
+  return dest_dir.joinpath(dest_dir).joinpath(name.replace(' ', '_').lower() + '.html')
+
+
+def create_figure(name: str, unit: str, source: ColumnDataSource, column_list: list[str], width=1200, height=400):
   y_axis_label = f'{name} [{unit}]'
-  line_plot = figure(width=width, frame_height=height, title=f'{name}', x_axis_label=None, y_axis_label=y_axis_label, x_axis_type='datetime')
+  line_plot = figure(width=width, frame_height=height, title=f'{name}', x_axis_label=None, y_axis_label=y_axis_label, x_axis_type='datetime',
+                     output_backend='webgl')
   legend_list = []
-  for i, col_name in enumerate(df.columns):
-    item = line_plot.line(x=df.index + fix_time_zone, y=df[col_name], line_width=2, color=generate_color_from_integer(i), name=col_name, legend_label=col_name)
+  for i, col_name in enumerate(column_list):
+    item = line_plot.line(x='datetime', y=f'y{i}', source=source, line_width=2, color=generate_color_from_integer(i), name=col_name, legend_label=col_name)
     legend_list.append((col_name, [item]))
-  line_plot.x_range.start = df.index[0] + fix_time_zone
+    # each line has its own hover tool because the column of the value differs. They are not shown in the toolbar
+    line_plot.add_tools(HoverTool(renderers=[item], tooltips=[('Label', '$name'), ('Value', f'@y{i}')], visible=False))
   line_plot.y_range.start = 0
 
   line_plot.xaxis.formatter = DatetimeTickFormatter(
@@ -135,13 +394,38 @@ def create_graph(dest_dir: Path, name: str, unit: str, df: pd.DataFrame, width=1
                                 seconds="%m/%d %H:%M:%S")
 
   legend = Legend(items=legend_list, click_policy='mute', location='left')
-  if len(df.columns) > 10:
+  if len(column_list) > 10:
     line_plot.legend.visible = False
     line_plot.add_layout(legend, 'below')
-  hover = HoverTool(tooltips=[('Label', '$name'), ('Value', '@y')])
-  line_plot.add_tools(hover)
-
-  graph_file_path = dest_dir.joinpath(dest_dir).joinpath(name.replace(' ', '_').lower() + '.html')
+  return line_plot
+
+
+def create_graph(dest_dir: Path, name: str, unit: str, df: pd.DataFrame, width=1200, height=400, max_points=2000) -> Path:
+  source = ColumnDataSource(data=create_graph_data(df, max_points))
+  line_plot = create_figure(name, unit, source, df.columns.to_list(), width, height)
+  line_plot.x_range.start = df.index[0] + FIX_TIME_ZONE
+
+  # When the page is served by --serve, reload data of the visible range in full resolution after zooming
+  line_plot.x_range.js_on_change('end', CustomJS(args=dict(source=source, x_range=line_plot.x_range, name=name), code='''
+    if (!window.location.protocol.startsWith('http')) {
+      return;
+    }
+    clearTimeout(window.rotop_range_timer);
+    window.rotop_range_timer = setTimeout(() => {
+      fetch(`/range/${name}?start=${x_range.start}&end=${x_range.end}`)
+        .then((response) => response.ok ? response.json() : null)
+        .then((data) => {
+          if (data) {
+            for (const key in data) {
+              data[key] = data[key].map((value) => value === null ? NaN : value);
+            }
+            source.data = data;
+          }
+        });
+    }, 300);
+  '''))
+
+  graph_file_path = get_graph_file_path(dest_dir, name)
   Path.mkdir(graph_file_path.parent, exist_ok=True)
   save(line_plot, title=name, filename=graph_file_path, resources=CDN)
   return graph_file_path
@@ -174,25 +458,449 @@ def create_page(dest_file: Path, title: str, unit: str, graph_file_path: Path, s
       f_html.write(rendered)
 
 
+@app.route('/')
+def serve_top():
+  if 'ROTOP_LIVE_DICT' in app.config:
+    return flask.redirect('live/' + next(iter(app.config['ROTOP_LIVE_DICT'])))
+  index_file_list = sorted(Path(app.config['ROTOP_DEST_DIR']).glob('index_*.html'))
+  if not index_file_list:
+    flask.abort(404)
+  return flask.redirect(index_file_list[0].name)
+
+
+@app.route('/range/<prefix>')
+def serve_range(prefix: str):
+  """Data of the range in full resolution (or reduced to max_points if the range is still too long)"""
+  df = app.config['ROTOP_DF_DICT'].get(prefix)
+  if df is None:
+    flask.abort(404)
+  start = pd.to_datetime(float(flask.request.args['start']), unit='ms') - FIX_TIME_ZONE
+  end = pd.to_datetime(float(flask.request.args['end']), unit='ms') - FIX_TIME_ZONE
+  data = create_graph_data(df.loc[start:end], app.config['ROTOP_MAX_POINTS'])
+  response = {'datetime': ((data.pop('datetime') - pd.Timestamp(0)) / pd.Timedelta(milliseconds=1)).to_list()}
+  for key, values in data.items():
+    response[key] = [None if np.isnan(value) else float(value) for value in values]
+  return flask.jsonify(response)
+
+
+@app.route('/<path:path>')
+def serve_file(path: str):
+  return flask.send_from_directory(app.config['ROTOP_DEST_DIR'], path)
+
+
+LIVE_POLL_INTERVAL = 1.0   # [sec]
+LIVE_KEEP_ALIVE_INTERVAL = 15.0   # [sec]
+
+
+class CsvTailer:
+  """
+  Read rows appended to {prefix}_000.csv, {prefix}_001.csv, ... while rotop is writing them.
+  Only complete lines are consumed. New columns are taken from the sidecar file ({file}.columns).
+  When rotop closes a file, its header line may be rewritten (the file is replaced). Then the file is read again skipping the rows already read.
+  """
+  def __init__(self, rotop_log_dir: Path, prefix: str, index: int=0):
+    self.rotop_log_dir = rotop_log_dir
+    self.prefix = prefix
+    self.index = index
+    self.reset_file()
+
+
+  def reset_file(self):
+    self.offset = 0
+    self.num_row = 0
+    self.inode = None
+    self.column_name_list: list[str] = None
+    self.sidecar_mtime = None
+
+
+  def get_file_path(self, index: int) -> Path:
+    return self.rotop_log_dir.joinpath(f'{self.prefix}_{index:03d}.csv')
+
+
+  def poll(self) -> list[tuple[float, dict[str, float]]]:
+    row_list = []
+    while True:
+      # rotop doesn't write a file anymore once the next one exists. Check it before reading, so that no row is left
+      has_next = self.get_file_path(self.index + 1).exists()
+      row_list += self.read_file()
+      if not has_next:
+        return row_list
+      self.index += 1
+      self.reset_file()
+
+
+  def read_file(self) -> list[tuple[float, dict[str, float]]]:
+    file_path = self.get_file_path(self.index)
+    try:
+      stat = file_path.stat()
+    except FileNotFoundError:
+      return []
+    num_skip = 0
+    if self.inode is not None and stat.st_ino != self.inode:
+      num_skip = self.num_row
+      self.reset_file()
+    self.inode = stat.st_ino
+    if stat.st_size <= self.offset:
+      return []
+    with open(file_path, 'rb') as f:
+      f.seek(self.offset)
+      data = f.read()
+    end = data.rfind(b'\n') + 1
+    if end == 0:
+      return []
+    self.offset += end
+    lines = data[:end].decode('utf-8').splitlines()
+    if self.column_name_list is None:
+      self.column_name_list = next(csv.reader(lines[:1]))[1:]
+      lines = lines[1:]
+    # the sidecar is written before rows having new columns, so read it after the rows
+    self.read_sidecar(file_path.with_name(file_path.name + '.columns'))
+
+    row_list = []
+    for fields in csv.reader(lines):
+      self.num_row += 1
+      if self.num_row <= num_skip or not fields:
+        continue
+      values = {name: float(value) for name, value in zip(self.column_name_list, fields[1:]) if value != ''}
+      row_list.append((float(fields[0]), values))
+    return row_list
+
+
+  def read_sidecar(self, sidecar: Path):
+    try:
+      mtime = sidecar.stat().st_mtime_ns
+    except FileNotFoundError:
+      return
+    if mtime == self.sidecar_mtime:
+      return
+    with open(sidecar, 'r', newline='', encoding='utf-8') as f:
+      header = next(csv.reader(f), None)
+    if header and len(header) - 1 > len(self.column_name_list):
+      self.column_name_list = header[1:]
+    self.sidecar_mtime = mtime
+
+
+class LiveFeed:
+  """
+  Samples of one prefix in the last window_sec seconds, updated from csv files being written by rotop.
+  Each sample has a sequence number, so that each client gets only samples newer than the ones it already has.
+  """
+  def __init__(self, rotop_log_dir: Path, prefix: str, window_sec: float):
+    self.prefix = prefix
+    self.window_sec = window_sec
+    self.tailer = CsvTailer(rotop_log_dir, prefix, self.find_start_index(rotop_log_dir, prefix, window_sec))
+    self.sample_list: deque[tuple[int, float, dict[str, float]]] = deque()   # (sequence number, unix time, values)
+    self.next_seq = 0
+    self.condition = threading.Condition()
+    self.update()
+
+
+  @staticmethod
+  def find_start_index(rotop_log_dir: Path, prefix: str, window_sec: float) -> int:
+    """Index of the newest file which starts before the window, so that only the current window is loaded"""
+    file_list = find_csv_files_from_filename(rotop_log_dir.joinpath(f'{prefix}_000.csv'))
+    if not file_list:
+      return 0
+    start = file_list[-1].stat().st_mtime - window_sec
+    for index in reversed(range(len(file_list))):
+      with open(file_list[index], 'r', encoding='utf-8') as f:
+        f.readline()
+        first_line = f.readline()
+      try:
+        if float(first_line.split(',')[0]) <= start:
+          return index
+      except ValueError:
+        continue
+    return 0
+
+
+  def update(self):
+    row_list = self.tailer.poll()
+    if not row_list:
+      return
+    with self.condition:
+      for timestamp, values in row_list:
+        # the same conversion as format_df
+        if 'idle' in values:
+          values['total'] = 100 - values.pop('idle')
+        self.sample_list.append((self.next_seq, timestamp, values))
+        self.next_seq += 1
+      latest = self.sample_list[-1][1]
+      while self.sample_list[0][1] < latest - self.window_sec:
+        self.sample_list.popleft()
+      self.condition.notify_all()
+
+
+  def get_since(self, seq: int) -> list[tuple[int, float, dict[str, float]]]:
+    with self.condition:
+      if not self.sample_list:
+        return []
+      start = max(seq + 1 - self.sample_list[0][0], 0)
+      return list(itertools.islice(self.sample_list, start, None))
+
+
+  def wait_since(self, seq: int, timeout: float) -> list[tuple[int, float, dict[str, float]]]:
+    with self.condition:
+      self.condition.wait_for(lambda: self.next_seq - 1 > seq, timeout)
+    return self.get_since(seq)
+
+
+  def run(self):
+    while True:
+      time.sleep(LIVE_POLL_INTERVAL)
+      try:
+        self.update()
+      except Exception as e:
+        logger.warning(f'{self.prefix}: unable to read: {e}')
+
+
+def to_bokeh_time(timestamp: float) -> float:
+  """Unix time to milliseconds of Bokeh datetime axis, with FIX_TIME_ZONE"""
+  return timestamp * 1000 + FIX_TIME_ZONE / pd.Timedelta(milliseconds=1)
+
+
+def create_live_page(feed: LiveFeed, prefix_list: list[str], max_process_num: int) -> str:
+  """
+  Page showing the current window. New samples are pushed by /stream/<prefix> (server-sent events) and appended with ColumnDataSource.stream
+  The figure has max_process_num lines (slots). Slots are given to the top processes (mean in the window) when the page is loaded,
+  and a process appearing later takes a free slot, a slot whose process has no value in the window, or the least significant slot
+  if the new one is more significant, so that processes started after loading the page are also shown.
+  """
+  sample_list = feed.get_since(-1)
+  sum_dict: dict[str, float] = {}
+  for _, _, values in sample_list:
+    for name, value in values.items():
+      sum_dict[name] = sum_dict.get(name, 0.0) + value
+  column_list = sorted(sum_dict.keys(), key=lambda name: sum_dict[name], reverse=True)[:max_process_num]
+  slot_list = column_list + [''] * (max_process_num - len(column_list))   # '' is a free slot
+
+  data = {'datetime': [to_bokeh_time(timestamp) for _, timestamp, _ in sample_list]}
+  for i, name in enumerate(slot_list):
+    data[f'y{i}'] = [values.get(name, np.nan) for _, _, values in sample_list]
+  source = ColumnDataSource(data=data)
+  # labels of free slots must be unique, otherwise their legend items are merged into one
+  line_plot = create_figure(feed.prefix, '%', source, [name or f'(slot {i})' for i, name in enumerate(slot_list)])
+  line_plot.x_range.follow = 'end'
+  line_plot.x_range.follow_interval = feed.window_sec * 1000
+  renderer_list = line_plot.renderers
+  legend_item_list = [item for legend in line_plot.legend for item in legend.items]
+  for renderer, name in zip(renderer_list, slot_list):
+    if not name:
+      renderer.name = ''
+      renderer.visible = False
+  for item in legend_item_list:
+    item.visible = item.renderers[0].visible
+
+  # keep about window_sec of samples in the browser too
+  if len(sample_list) >= 2:
+    interval = max((sample_list[-1][1] - sample_list[0][1]) / (len(sample_list) - 1), 0.001)
+  else:
+    interval = 1.0
+  rollover = int(feed.window_sec / interval) + 1
+  last_seq = sample_list[-1][0] if sample_list else -1
+
+  link_list = [f'<a href="/live/{prefix}">{prefix}</a>' if prefix != feed.prefix else f'<b>{prefix}</b>' for prefix in prefix_list]
+  document = Document()
+  document.add_root(column(Div(text=' | '.join(link_list)), line_plot))
+  document.js_on_event('document_ready', CustomJS(
+    args=dict(source=source, slot_list=slot_list, renderer_list=renderer_list, legend_item_list=legend_item_list, prefix=feed.prefix,
+              last_seq=last_seq, rollover=rollover, time_offset=to_bokeh_time(0)), code=LIVE_PAGE_SCRIPT))
+  return file_html(document, CDN, f'{feed.prefix} (live)')
+
+
+LIVE_PAGE_SCRIPT = '''
+  // mean of each slot in the window, calculated only when a new series needs a slot
+  let mean_list = null;
+  const get_mean_list = () => {
+    if (mean_list === null) {
+      mean_list = slot_list.map((name, i) => {
+        let sum = 0;
+        let count = 0;
+        for (const value of source.data[`y${i}`]) {
+          if (!Number.isNaN(value)) {
+            sum += value;
+            count++;
+          }
+        }
+        return name === '' || count === 0 ? -1 : sum / count;
+      });
+    }
+    return mean_list;
+  };
+
+  const find_slot = (value) => {
+    const mean_list = get_mean_list();
+    let min_index = 0;
+    mean_list.forEach((mean, i) => {
+      if (mean < mean_list[min_index]) {
+        min_index = i;
+      }
+    });
+    return mean_list[min_index] < 0 || value > mean_list[min_index] ? min_index : -1;
+  };
+
+  const assign_slot = (i, name, value) => {
+    slot_list[i] = name;
+    mean_list[i] = value;
+    const data = Object.assign({}, source.data);
+    data[`y${i}`] = new Array(data.datetime.length).fill(NaN);
+    source.data = data;
+    renderer_list[i].name = name;
+    renderer_list[i].visible = true;
+    for (const item of legend_item_list) {
+      if (item.renderers.includes(renderer_list[i])) {
+        item.label = {value: name};
+        item.visible = true;
+      }
+    }
+  };
+
+  const events = new EventSource(`/stream/${prefix}?since=${last_seq}`);
+  events.onmessage = (event) => {
+    const sample_list = JSON.parse(event.data);
+    mean_list = null;
+    for (const [timestamp, values] of sample_list) {
+      for (const name in values) {
+        if (!slot_list.includes(name)) {
+          const i = find_slot(values[name]);
+          if (i >= 0) {
+            assign_slot(i, name, values[name]);
+          }
+        }
+      }
+    }
+    const data = {datetime: []};
+    slot_list.forEach((name, i) => data[`y${i}`] = []);
+    for (const [timestamp, values] of sample_list) {
+      data.datetime.push(timestamp * 1000 + time_offset);
+      slot_list.forEach((name, i) => data[`y${i}`].push(name in values ? values[name] : NaN));
+    }
+    source.stream(data, rollover);
+  };
+'''
+
+
+@app.route('/live/<prefix>')
+def serve_live(prefix: str):
+  feed = app.config['ROTOP_LIVE_DICT'].get(prefix)
+  if feed is None:
+    flask.abort(404)
+  return create_live_page(feed, list(app.config['ROTOP_LIVE_DICT'].keys()), app.config['ROTOP_MAX_PROCESS_NUM'])
+
+
+@app.route('/stream/<prefix>')
+def serve_stream(prefix: str):
+  """Server-sent events. Each event is a list of [unix time, {name: value}] newer than Last-Event-ID (or 'since')"""
+  feed = app.config['ROTOP_LIVE_DICT'].get(prefix)
+  if feed is None:
+    flask.abort(404)
+  seq = int(flask.request.headers.get('Last-Event-ID', flask.request.args.get('since', -1)))
+
+  def generate():
+    nonlocal seq
+    while True:
+      sample_list = feed.wait_since(seq, LIVE_KEEP_ALIVE_INTERVAL)
+      if not sample_list:
+        yield ': keep-alive\n\n'
+        continue
+      seq = sample_list[-1][0]
+      yield f'id: {seq}\ndata: {json.dumps([[timestamp, values] for _, timestamp, values in sample_list])}\n\n'
+
+  return flask.Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+def serve_live_feeds(rotop_log_dir: Path, prefix_list: list[str], args):
+  """Serve pages which follow csv files being written by `rotop --csv`, instead of rendering static pages"""
+  feed_dict = {prefix: LiveFeed(rotop_log_dir, prefix, args.window) for prefix in prefix_list}
+  for feed in feed_dict.values():
+    threading.Thread(target=feed.run, daemon=True).start()
+  app.config['ROTOP_LIVE_DICT'] = feed_dict
+  app.config['ROTOP_MAX_PROCESS_NUM'] = args.max_process_num
+  app.run(host=args.bind, port=args.port, threaded=True)
+
+
+def read_summary(prefix: str, file_list: list[Path], rotop_log_dir: Path) -> list[Stats]:
+  """Statistics calculated by rotop during capture. None if not available or older than the data"""
+  summary_file = rotop_log_dir.joinpath(prefix + '.summary')
+  if not summary_file.exists() or summary_file.stat().st_mtime < max(file.stat().st_mtime for file in file_list):
+    return None
+  df_summary = pd.read_csv(summary_file, keep_default_na=False, na_values=['nan'])
+  stats_list = []
+  for name, value_mean, value_std, value_min, value_max in zip(df_summary['name'], df_summary['mean'], df_summary['std'], df_summary['min'], df_summary['max']):
+    if prefix == 'total' and name == 'idle':
+      # the same conversion as format_df
+      name, value_mean, value_max = 'total', 100 - value_mean, 100 - value_min
+    stats_list.append(Stats(str(name), value_mean, value_std, value_max))
+  return stats_list
+
+
+def visualize_files(prefix: str, file_list: list[Path], dest_dir: Path, rotop_log_dir: Path, start: float=None, end: float=None, num_workers: int=None,
+                    max_points: int=2000, use_cache: bool=True):
+  cache = ParseCache(rotop_log_dir, prefix, use_cache)
+  signature = cache.get_signature(file_list, start, end)
+  # the summary file may be updated after the data (at the end of capture)
+  summary_file = rotop_log_dir.joinpath(prefix + '.summary')
+  stats_signature = signature + [cache.get_file_signature(summary_file) if summary_file.exists() else None]
+  page_file_path = dest_dir.joinpath(f'index_{prefix}.html')
+  page_options = {'dest_dir': str(dest_dir.resolve()), 'max_points': max_points}
+  if cache.is_page_up_to_date(stats_signature, page_options, [page_file_path, get_graph_file_path(dest_dir, prefix)]):
+    logger.info(f'{prefix}: not changed since the last run')
+    return
+
+  df = create_df_from_files(file_list, start, end, num_workers, cache)
+  if df.empty:
+    logger.warning(f'{prefix}: no samples in range')
+    cache.save()
+    return
+  graph_file_path = create_graph(dest_dir, prefix, '%', df, max_points=max_points)
+  stats_list = cache.load_stats(stats_signature)
+  if stats_list is None:
+    stats_list = read_summary(prefix, file_list, rotop_log_dir) if start is None and end is None else None
+    if stats_list is None:
+      df_mean, df_std, df_max = df.mean(), df.std(), df.max()
+      stats_list = [Stats(col_name, df_mean[col_name], df_std[col_name], df_max[col_name]) for col_name in df.columns]
+    cache.save_stats(stats_signature, stats_list)
+  stats_list = sorted(stats_list, key=lambda stats: stats.mean, reverse=True)
+  create_page(page_file_path, f'{str(rotop_log_dir.stem)}_{prefix}', '%', graph_file_path, stats_list)
+  cache.save_page(stats_signature, page_options)
+  cache.prune(file_list)
+  cache.save()
+
+
 def main():
   args = parse_args()
   csv_path = Path(args.csv_path)
   csv_file_dict = find_csv_files_from_path(csv_path)
-  if csv_file_dict is None:
+  if not csv_file_dict:
     logger.error('Unable to find csv file')
+    return
 
   rotop_log_dir = csv_path if csv_path.is_dir() else csv_path.parent
   dest_dir = rotop_log_dir
 
-  for prefix, csv_file_list in csv_file_dict.items():
-    stats_list: list[Stats] = []
-    df = create_df_from_csv_files(csv_file_list)
-    graph_file_path = create_graph(dest_dir, prefix, '%', df)
-    for col_name in df.columns:
-      df_for_item = df[col_name]
-      stats_list.append(Stats(col_name, df_for_item.mean(), df_for_item.std(), df_for_item.max()))
-    stats_list = sorted(stats_list, key=lambda stats: stats.mean, reverse=True)
-    create_page(dest_dir.joinpath(f'index_{prefix}.html'), f'{str(rotop_log_dir.stem)}_{prefix}', '%', graph_file_path, stats_list)
+  if args.live:
+    prefix_list = [prefix for prefix, file_list in csv_file_dict.items() if file_list and file_list[0].suffix == '.csv']
+    if not prefix_list:
+      logger.error('Unable to find csv file to follow')
+      return
+    serve_live_feeds(rotop_log_dir, prefix_list, args)
+    return
+
+  # each prefix (total, cpu, mem) is independent, so render them in parallel
+  with ProcessPoolExecutor(max_workers=min(len(csv_file_dict), args.num_workers or os.cpu_count())) as executor:
+    future_list = [executor.submit(visualize_files, prefix, csv_file_list, dest_dir, rotop_log_dir, args.start, args.end, args.num_workers, args.max_points,
+                                   not args.no_cache)
+                   for prefix, csv_file_list in csv_file_dict.items()]
+    for future in future_list:
+      future.result()
+
+  if args.serve:
+    app.config['ROTOP_DEST_DIR'] = dest_dir.resolve()
+    app.config['ROTOP_MAX_POINTS'] = args.max_points
+    app.config['ROTOP_DF_DICT'] = {prefix: create_df_from_files(csv_file_list, args.start, args.end, args.num_workers,
+                                                                ParseCache(rotop_log_dir, prefix, not args.no_cache))
+                                   for prefix, csv_file_list in csv_file_dict.items()}
+    app.run(host=args.bind, port=args.port)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,99 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import array
+import math
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from rotop.binary_log import BinaryLogReader, BinaryLogWriter, INDEX_SUFFIX, to_little_endian_bytes
+
+
+def write_log(dir_name: str, num_row: int=10, block_row: int=4) -> str:
+  writer = BinaryLogWriter(dir_name, 'cpu', block_row)
+  for i in range(num_row):
+    # 'b' appears from the 3rd row, and 'c' only in the 6th row
+    name_list = ['a'] + (['b'] if i >= 2 else []) + (['c'] if i == 5 else [])
+    writer.write(1000.0 + i, name_list, [float(i), i * 2.0, -1.0][:len(name_list)])
+  writer.close()
+  return writer.file_path
+
+
+def test_round_trip(tmp_path):
+  file_path = write_log(str(tmp_path))
+  reader = BinaryLogReader(file_path)
+  timestamps, names, values = reader.read()
+  reader.close()
+  assert timestamps.tolist() == [1000.0 + i for i in range(10)]
+  assert names == ['a', 'b', 'c']
+  assert values[:, 0].tolist() == [float(i) for i in range(10)]
+  assert np.isnan(values[:2, 1]).all()
+  assert values[2:, 1].tolist() == [i * 2.0 for i in range(2, 10)]
+  assert values[5, 2] == -1.0
+  assert np.isnan(np.delete(values[:, 2], 5)).all()
+
+
+def test_read_time_range(tmp_path):
+  reader = BinaryLogReader(write_log(str(tmp_path)))
+  assert reader.get_time_range() == (1000.0, 1009.0)
+  timestamps, names, values = reader.read(1003, 1006)
+  assert timestamps.tolist() == [1003.0, 1004.0, 1005.0, 1006.0]
+  assert values[:, names.index('a')].tolist() == [3.0, 4.0, 5.0, 6.0]
+  timestamps, _, values = reader.read(2000, 3000)
+  assert len(timestamps) == 0 and values.shape[0] == 0
+  reader.close()
+
+
+def test_read_without_index(tmp_path):
+  file_path = write_log(str(tmp_path))
+  os.remove(file_path + INDEX_SUFFIX)
+  reader = BinaryLogReader(file_path)
+  timestamps, names, _ = reader.read()
+  reader.close()
+  assert len(timestamps) == 10
+  assert names == ['a', 'b', 'c']
+
+
+def test_read_truncated_file(tmp_path):
+  """A file being written may end in the middle of a record. Complete blocks are still read"""
+  file_path = write_log(str(tmp_path))
+  with open(file_path, 'r+b') as f:
+    f.truncate(os.path.getsize(file_path) - 3)
+  reader = BinaryLogReader(file_path)
+  timestamps, _, _ = reader.read()
+  reader.close()
+  assert timestamps.tolist() == [1000.0 + i for i in range(8)]
+
+
+def test_not_a_binary_log(tmp_path):
+  file_path = tmp_path / 'cpu.rtb'
+  file_path.write_bytes(b'datetime,a\n')
+  with pytest.raises(ValueError):
+    BinaryLogReader(str(file_path))
+
+
+def test_payload_is_little_endian():
+  assert to_little_endian_bytes(array.array('d', [1.5, math.pi])) == struct.pack('<2d', 1.5, math.pi)
+  assert to_little_endian_bytes(array.array('f', [2.5])) == struct.pack('<f', 2.5)
+
+
+def test_iterate_blocks(tmp_path):
+  reader = BinaryLogReader(write_log(str(tmp_path)))
+  block_list = list(reader.iterate_blocks(1003, 1006))
+  reader.close()
+  assert [timestamps.tolist() for timestamps, _, _ in block_list] == [[1003.0], [1004.0, 1005.0, 1006.0]]
+  assert block_list[1][1] == ['a', 'b', 'c']
+  assert block_list[1][2][1].tolist() == [5.0, 10.0, -1.0]
@@ -0,0 +1,94 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import csv
+import math
+import os
+
+from rotop.csv_writer import CsvWriter
+
+
+def read_csv(file_path: str) -> list[list[str]]:
+  with open(file_path, newline='', encoding='utf-8') as f:
+    return list(csv.reader(f))
+
+
+def test_write_rows(tmp_path):
+  writer = CsvWriter(str(tmp_path), 'cpu')
+  writer.write(1, ['a', 'b'], [1.0, 2.0])
+  writer.write(2, ['b', 'a'], [4.0, 3.0])
+  writer.close()
+  assert read_csv(tmp_path / 'cpu_000.csv') == [['datetime', 'a', 'b'], ['1', '1.0', '2.0'], ['2', '3.0', '4.0']]
+  assert not os.path.exists(tmp_path / ('cpu_000.csv' + CsvWriter.SIDECAR_SUFFIX))
+
+
+def test_empty_cells(tmp_path):
+  writer = CsvWriter(str(tmp_path), 'cpu')
+  writer.write(1, ['a', 'b', 'c'], [1.0, 2.0, 3.0])
+  writer.write(2, ['a', 'b'], [math.nan, 5.0])
+  writer.close()
+  # NaN is an empty cell, and trailing empty cells are omitted
+  assert read_csv(tmp_path / 'cpu_000.csv')[2] == ['2', '', '5.0']
+
+
+def test_sidecar_and_finalize_header(tmp_path):
+  writer = CsvWriter(str(tmp_path), 'cpu')
+  file_path = tmp_path / 'cpu_000.csv'
+  sidecar_path = tmp_path / ('cpu_000.csv' + CsvWriter.SIDECAR_SUFFIX)
+  writer.write(1, ['a'], [1.0])
+  assert not os.path.exists(sidecar_path)
+  writer.write(2, ['a', 'b'], [2.0, 3.0])
+
+  # while the file is open, the header in the file is old and the sidecar has the current one
+  assert read_csv(file_path)[0] == ['datetime', 'a']
+  assert read_csv(sidecar_path) == [['datetime', 'a', 'b']]
+
+  writer.close()
+  assert read_csv(file_path) == [['datetime', 'a', 'b'], ['1', '1.0'], ['2', '2.0', '3.0']]
+  assert not os.path.exists(sidecar_path)
+  assert not os.path.exists(str(file_path) + '.tmp')
+
+
+def test_rotate_by_max_row(tmp_path):
+  writer = CsvWriter(str(tmp_path), 'cpu', max_row=2)
+  for i in range(5):
+    writer.write(i, ['a'], [float(i)])
+  writer.close()
+  assert sorted(os.listdir(tmp_path)) == ['cpu_000.csv', 'cpu_001.csv', 'cpu_002.csv']
+  assert read_csv(tmp_path / 'cpu_001.csv') == [['datetime', 'a'], ['2', '2.0'], ['3', '3.0']]
+  assert read_csv(tmp_path / 'cpu_002.csv') == [['datetime', 'a'], ['4', '4.0']]
+
+
+def test_rotate_by_max_bytes(tmp_path):
+  writer = CsvWriter(str(tmp_path), 'cpu', max_row=1000, max_bytes=40)
+  for i in range(6):
+    writer.write(i, ['a'], [float(i)])
+  writer.close()
+  file_name_list = sorted(os.listdir(tmp_path))
+  assert len(file_name_list) > 1
+  for file_name in file_name_list[:-1]:
+    # a file is rotated by the first row reaching the limit, and the counted size is the real size
+    file_size = os.path.getsize(tmp_path / file_name)
+    assert file_size >= 40
+    assert file_size - len('5,5.0\r\n') < 40
+  num_row = sum(len(read_csv(tmp_path / file_name)) - 1 for file_name in file_name_list)
+  assert num_row == 6
+
+
+def test_new_file_after_rotation_has_all_columns(tmp_path):
+  writer = CsvWriter(str(tmp_path), 'cpu', max_row=1)
+  writer.write(1, ['a'], [1.0])
+  writer.write(2, ['a', 'b'], [2.0, 3.0])
+  writer.close()
+  assert read_csv(tmp_path / 'cpu_000.csv') == [['datetime', 'a'], ['1', '1.0']]
+  assert read_csv(tmp_path / 'cpu_001.csv') == [['datetime', 'a', 'b'], ['2', '2.0', '3.0']]
@@ -0,0 +1,124 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import math
+
+import numpy as np
+import pytest
+
+from rotop.data_container import DataContainer
+from rotop.history_buffer import HistoryBuffer, RollupTier, TieredHistory
+
+
+def test_history_buffer_ring():
+  buffer = HistoryBuffer(3)
+  for i in range(5):
+    buffer.append(100 + i, ['a'], [float(i)])
+  df = buffer.to_dataframe()
+  assert len(buffer) == 3
+  assert df['datetime'].tolist() == [102, 103, 104]
+  assert df['a'].tolist() == [2.0, 3.0, 4.0]
+
+
+def test_history_buffer_missing_value_is_nan():
+  buffer = HistoryBuffer(10)
+  buffer.append(100, ['a', 'b'], [1.0, 2.0])
+  buffer.append(101, ['a'], [3.0])
+  df = buffer.to_dataframe(sort=False)
+  assert df['a'].tolist() == [1.0, 3.0]
+  assert df['b'].iloc[0] == 2.0
+  assert math.isnan(df['b'].iloc[1])
+  assert buffer.get_latest() == {'a': 3.0}
+
+
+def test_history_buffer_sort_and_max_num_column():
+  buffer = HistoryBuffer(10)
+  buffer.append(100, ['a', 'b', 'c'], [1.0, 3.0, 2.0])
+  df = buffer.to_dataframe(sort=True, max_num_column=2)
+  assert df.columns.tolist() == ['datetime', 'b', 'c']
+
+
+def test_history_buffer_grows_columns():
+  buffer = HistoryBuffer(4)
+  name_list = [f'p{i}' for i in range(HistoryBuffer.INITIAL_NUM_COLUMN * 2 + 1)]
+  buffer.append(100, name_list, list(range(len(name_list))))
+  assert buffer.get_latest()[name_list[-1]] == len(name_list) - 1
+
+
+def test_history_buffer_compacts_finished_columns():
+  buffer = HistoryBuffer(2)
+  for i in range(HistoryBuffer.INITIAL_NUM_COLUMN * 3):
+    buffer.append(100 + i, [f'p{i}'], [1.0])
+  # columns which went out of the window are reused instead of growing the buffer
+  assert buffer.values.shape[1] == HistoryBuffer.INITIAL_NUM_COLUMN
+  assert buffer.to_dataframe(sort=False).columns.tolist() == ['datetime', f'p{HistoryBuffer.INITIAL_NUM_COLUMN * 3 - 2}', f'p{HistoryBuffer.INITIAL_NUM_COLUMN * 3 - 1}']
+
+
+def test_history_buffer_drops_stale_columns():
+  buffer = HistoryBuffer(10, max_num_column=2)
+  buffer.append(100, ['a'], [1.0])
+  buffer.append(101, ['b'], [1.0])
+  buffer.append(102, ['c'], [1.0])
+  assert buffer.column_name_list == ['b', 'c']
+
+
+@pytest.mark.parametrize('num_name', [3, 10])
+def test_history_buffer_drops_columns_when_empty(num_name):
+  buffer = HistoryBuffer(10, max_num_column=2)
+  buffer.add_columns(['x', 'y'])
+  buffer.append(100, [f'p{i}' for i in range(num_name)], [1.0] * num_name)
+  assert 'x' not in buffer.column_index_dict
+  assert 'y' not in buffer.column_index_dict
+
+
+def test_rollup_tier_min_mean_max():
+  tier = RollupTier(10, 10)
+  for timestamp, value in [(100, 1.0), (105, 3.0), (109, 2.0), (110, 5.0)]:
+    tier.add(timestamp, ['a'], [value])
+  assert tier.buffer_dict['min'].get_latest() == {'a': 1.0}
+  assert tier.buffer_dict['mean'].get_latest() == {'a': 2.0}
+  assert tier.buffer_dict['max'].get_latest() == {'a': 3.0}
+  # the current period is not flushed yet
+  assert len(tier.buffer_dict['mean']) == 1
+
+
+def test_rollup_tier_caps_columns_of_one_period():
+  tier = RollupTier(10, 10, max_num_column=3)
+  for i in range(8):
+    tier.add(100 + i, [f'p{i}'], [float(i)])
+  tier.add(110, ['p0'], [0.0])
+  assert sorted(tier.buffer_dict['max'].get_latest().keys()) == ['p5', 'p6', 'p7']
+
+
+def test_tiered_history_selects_tier_by_range():
+  history = TieredHistory(10, tier_list=[(10, 100), (60, 100)])
+  for i in range(600):
+    history.append(1000 + i, ['a'], [float(i % 10)])
+  assert len(history.to_dataframe()) == 10
+  assert history.select_buffer(5) is history.raw
+  assert history.select_buffer(300) is history.tier_list[0].buffer_dict['mean']
+  df = history.to_dataframe(time_range=300)
+  assert df['datetime'].iloc[-1] - df['datetime'].iloc[0] <= 300
+  assert np.allclose(df['a'], 4.5)
+
+
+def test_data_container_history_with_process_churn():
+  """Regression: names seen in one rollup period outnumbered max_num_column and the first flush crashed"""
+  data_container = DataContainer(False, 100, max_num_series=5)
+  for frame in range(200):
+    name_list = [f'p{frame}_{i} ({frame * 100 + i})' for i in range(8)]
+    name_list, cpu_list, mem_list, _ = data_container.process_registry.update(name_list, name_list, [float(i) for i in range(8)], [1.0] * 8)
+    data_container.cpu_history.append(1000 + frame * 2, name_list, cpu_list)
+  data_container.reset_history()
+  data_container.cpu_history.append(2000, name_list, cpu_list)
+  assert len(data_container.get_df_cpu_history(time_range=3600)) > 0
@@ -0,0 +1,85 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import csv
+import math
+import random
+import statistics
+
+import pytest
+
+from rotop.online_stats import P2Quantile, RunningStats, StatsTable
+
+
+def test_quantile_empty():
+  assert math.isnan(P2Quantile(0.95).get())
+
+
+@pytest.mark.parametrize('num', [1, 2, 3, 4, 5])
+def test_quantile_exact_while_few_samples(num):
+  quantile = P2Quantile(0.95)
+  for x in reversed(range(1, num + 1)):
+    quantile.add(float(x))
+  assert quantile.get() == float(num)
+
+
+@pytest.mark.parametrize('p', [0.5, 0.95, 0.99])
+def test_quantile_converges(p):
+  rng = random.Random(0)
+  quantile = P2Quantile(p)
+  value_list = [rng.uniform(0, 100) for _ in range(20000)]
+  for x in value_list:
+    quantile.add(x)
+  expected = statistics.quantiles(value_list, n=100)[round(p * 100) - 1]
+  assert quantile.get() == pytest.approx(expected, abs=1.0)
+
+
+def test_running_stats():
+  rng = random.Random(1)
+  value_list = [rng.gauss(50, 10) for _ in range(1000)]
+  stats = RunningStats()
+  for x in value_list:
+    stats.add(x)
+  stats.add(math.nan)
+  assert stats.count == len(value_list)
+  assert stats.mean == pytest.approx(statistics.mean(value_list))
+  assert stats.get_std() == pytest.approx(statistics.stdev(value_list))
+  assert stats.min == min(value_list)
+  assert stats.max == max(value_list)
+
+
+def test_running_stats_single_value():
+  stats = RunningStats()
+  stats.add(3.0)
+  assert stats.mean == 3.0
+  assert math.isnan(stats.get_std())
+
+
+def test_stats_table(tmp_path):
+  table = StatsTable()
+  table.update(['a', 'b'], [1.0, 10.0])
+  table.update(['a', 'b', 'c'], [3.0, 20.0, math.nan])
+  assert len(table) == 3
+  assert table.get('a').mean == 2.0
+  assert table.get('x') is None
+  # 'c' has no valid sample
+  assert [name for name, _ in table.get_sorted_list()] == ['b', 'a']
+
+  file_path = tmp_path / 'stats.csv'
+  table.write_csv(str(file_path))
+  with open(file_path, newline='') as f:
+    row_list = list(csv.reader(f))
+  assert row_list[0] == StatsTable.COLUMN_LIST
+  assert [row[0] for row in row_list[1:]] == ['b', 'a']
+  assert float(row_list[1][2]) == 15.0
+  assert float(row_list[1][5]) == 20.0
@@ -0,0 +1,89 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from rotop.process_registry import ProcessRegistry
+
+
+def update(registry: ProcessRegistry, cpu_dict: dict[str, float]):
+  name_list = list(cpu_dict.keys())
+  return registry.update(name_list, name_list, list(cpu_dict.values()), [1.0] * len(name_list))
+
+
+def test_ids_are_stable():
+  registry = ProcessRegistry(10, 60)
+  _, _, _, id_list = update(registry, {'a': 1.0, 'b': 2.0})
+  assert id_list == [0, 1]
+  name_list, _, _, id_list = update(registry, {'b': 2.0, 'a': 1.0, 'c': 0.0})
+  assert name_list == ['b', 'a', 'c']
+  assert id_list == [1, 0, 2]
+  assert registry.get_name(2) == 'c'
+
+
+def test_same_name_with_different_key():
+  """A PID reused by another process is a different series because the key includes the start time"""
+  registry = ProcessRegistry(10, 60)
+  registry.update([('a (1)', 100)], ['a (1)'], [1.0], [1.0])
+  _, _, _, id_list = registry.update([('a (1)', 200)], ['a (1)'], [1.0], [1.0])
+  assert id_list == [1]
+
+
+def test_evict_after():
+  registry = ProcessRegistry(10, evict_after=2)
+  update(registry, {'a': 1.0, 'b': 1.0})
+  update(registry, {'a': 1.0})
+  assert registry.get_id('b') is not None
+  update(registry, {'a': 1.0})
+  update(registry, {'a': 1.0})
+  assert registry.get_id('b') is None
+  # the released ID is reused
+  _, _, _, id_list = update(registry, {'a': 1.0, 'c': 1.0})
+  assert id_list == [0, 1]
+
+
+def test_fold_into_other():
+  registry = ProcessRegistry(2, 60)
+  name_list, cpu_list, mem_list, id_list = update(registry, {'a': 5.0, 'b': 4.0, 'c': 1.0, 'd': 2.0})
+  assert name_list == ['a', 'b', ProcessRegistry.OTHER_NAME]
+  assert cpu_list == [5.0, 4.0, 3.0]
+  assert mem_list == [1.0, 1.0, 2.0]
+  assert id_list == [0, 1, None]
+
+
+def test_significant_process_takes_id_of_least_significant_one():
+  registry = ProcessRegistry(2, 60)
+  update(registry, {'a': 5.0, 'b': 1.0})
+  name_list, _, _, id_list = update(registry, {'a': 5.0, 'b': 1.0, 'c': 3.0})
+  # 'b' was seen earlier in this frame, so its ID can't be given to 'c'
+  assert name_list == ['a', 'b', ProcessRegistry.OTHER_NAME]
+  name_list, _, _, id_list = update(registry, {'c': 3.0, 'a': 5.0})
+  # 'b' is not seen in this frame yet, so 'c' takes its ID
+  assert name_list == ['c', 'a']
+  assert id_list == [1, 0]
+  assert registry.get_id('b') is None
+
+
+def test_ids_are_unique_in_one_frame():
+  """Regression: a new process took the ID of a process registered earlier in the same frame"""
+  registry = ProcessRegistry(2, 60)
+  update(registry, {'a': 1.0, 'b': 1.0})
+  _, _, _, id_list = update(registry, {'a': 0.0, 'c': 50.0, 'd': 60.0})
+  ids = [id for id in id_list if id is not None]
+  assert len(ids) == len(set(ids))
+
+
+def test_no_limit():
+  registry = ProcessRegistry(0, 0)
+  cpu_dict = {f'p{i}': 1.0 for i in range(1000)}
+  name_list, _, _, _ = update(registry, cpu_dict)
+  assert len(name_list) == 1000
+  assert len(registry) == 1000
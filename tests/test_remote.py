@@ -0,0 +1,100 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import math
+
+from rotop.remote import MESSAGE_HEADER, TYPE_BATCH, TYPE_STRING, UPDATE_ENTRY, RemoteSample, SampleDecoder, SampleEncoder
+
+
+def split_messages(data: bytes) -> list[tuple[bytes, bytes]]:
+  message_list = []
+  offset = 0
+  while offset < len(data):
+    type, size = MESSAGE_HEADER.unpack_from(data, offset)
+    offset += MESSAGE_HEADER.size
+    message_list.append((type, data[offset:offset + size]))
+    offset += size
+  return message_list
+
+
+def decode(decoder: SampleDecoder, data: bytes) -> list[RemoteSample]:
+  sample_list = []
+  for type, payload in split_messages(data):
+    if type == TYPE_STRING:
+      decoder.decode_strings(payload)
+    elif type == TYPE_BATCH:
+      sample_list += decoder.decode_batch(payload)
+  return sample_list
+
+
+def to_dict(sample: RemoteSample) -> dict[str, tuple[float, float]]:
+  return {name: (cpu, mem) for name, cpu, mem in zip(sample.name_list, sample.cpu_list, sample.mem_list)}
+
+
+def create_sample(seq: int, value_dict: dict[str, tuple[float, float]]) -> RemoteSample:
+  return RemoteSample(seq, 1000.0 + seq, [10.1, 5.2, 84.7], list(value_dict.keys()),
+                      [value[0] for value in value_dict.values()], [value[1] for value in value_dict.values()])
+
+
+def test_round_trip():
+  value_dict_list = [
+    {'a (1)': (10.1, 1.5), 'b (2)': (0.0, 2.25)},
+    {'a (1)': (12.3, 1.5), 'b (2)': (0.0, 2.25), 'ノード (3)': (1.0, 0.1)},   # new series
+    {'a (1)': (12.3, 1.5), 'ノード (3)': (math.nan, 0.1)},                   # removed series and NaN
+    {'a (1)': (12.3, 1.5), 'ノード (3)': (math.nan, 0.1), 'b (2)': (3.0, 2.0)},  # series appears again
+  ]
+  encoder = SampleEncoder({})
+  decoder = SampleDecoder()
+  sample_list = []
+  for seq, value_dict in enumerate(value_dict_list):
+    sample_list += decode(decoder, encoder.encode([create_sample(seq, value_dict)]))
+
+  assert [sample.seq for sample in sample_list] == [0, 1, 2, 3]
+  for sample, value_dict in zip(sample_list, value_dict_list):
+    assert sample.timestamp == 1000.0 + sample.seq
+    assert sample.total_list == [10.1, 5.2, 84.7]
+    decoded_dict = to_dict(sample)
+    assert decoded_dict.keys() == value_dict.keys()
+    for name, (cpu, mem) in value_dict.items():
+      assert decoded_dict[name][0] == cpu or (math.isnan(cpu) and math.isnan(decoded_dict[name][0]))
+      assert decoded_dict[name][1] == mem
+
+
+def test_multiple_samples_in_one_batch():
+  encoder = SampleEncoder({})
+  decoder = SampleDecoder()
+  sample_list = decode(decoder, encoder.encode([create_sample(0, {'a': (1.0, 1.0)}), create_sample(1, {'a': (2.0, 1.0), 'b': (3.0, 0.5)})]))
+  assert [to_dict(sample) for sample in sample_list] == [{'a': (1.0, 1.0)}, {'a': (2.0, 1.0), 'b': (3.0, 0.5)}]
+
+
+def test_delta_encoding():
+  encoder = SampleEncoder({})
+  first = encoder.encode([create_sample(0, {'a': (1.0, 1.0), 'b': (2.0, 2.0), 'c': (math.nan, 3.0)})])
+  assert [type for type, _ in split_messages(first)] == [TYPE_STRING, TYPE_BATCH]
+
+  # only the changed series is sent, NaN is the same as NaN, and the string table is not sent again
+  second = encoder.encode([create_sample(1, {'a': (1.0, 1.0), 'b': (2.5, 2.0), 'c': (math.nan, 3.0)})])
+  message_list = split_messages(second)
+  assert [type for type, _ in message_list] == [TYPE_BATCH]
+  first_batch = split_messages(first)[1][1]
+  assert len(first_batch) - len(message_list[0][1]) == 2 * UPDATE_ENTRY.size
+
+
+def test_name_ids_are_shared_by_connections():
+  """A new connection sends the string table again with the same IDs"""
+  name_id_dict = {}
+  SampleEncoder(name_id_dict).encode([create_sample(0, {'a': (1.0, 1.0)})])
+  data = SampleEncoder(name_id_dict).encode([create_sample(1, {'b': (1.0, 1.0), 'a': (2.0, 1.0)})])
+  assert name_id_dict == {'a': 0, 'b': 1}
+  sample_list = decode(SampleDecoder(), data)
+  assert to_dict(sample_list[0]) == {'b': (1.0, 1.0), 'a': (2.0, 1.0)}
@@ -0,0 +1,46 @@
+# Copyright 2023 iwatake2222
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from rotop.binary_log import BinaryLogWriter
+from rotop.data_container import DataContainer
+from rotop.replay_runner import NativeReplayRunner
+
+
+def test_native_replay(tmp_path):
+  dir_name = str(tmp_path)
+  writer_total = BinaryLogWriter(dir_name, 'total', 2)
+  writer_cpu = BinaryLogWriter(dir_name, 'cpu', 2)
+  writer_mem = BinaryLogWriter(dir_name, 'mem', 2)
+  for i in range(5):
+    # several samples in the same second (interval < 1 sec)
+    timestamp = 1000 + i // 2
+    name_list = ['talker (10)', 'ns:/demo', 'other']
+    writer_total.write(timestamp, ['user', 'sys', 'idle'], [i, 1.0, 90.0])
+    writer_cpu.write(timestamp, name_list, [10.0 + i, 20.0, 1.0])
+    writer_mem.write(timestamp, name_list, [float(i), 2.0, 3.0])
+  for writer in [writer_total, writer_cpu, writer_mem]:
+    writer.close()
+
+  top_runner = NativeReplayRunner(dir_name, 1, '.*')
+  frame_list = []
+  while not top_runner.is_finished():
+    _, lines = top_runner.run(100, True)
+    frame_list.append(DataContainer.parse_top(top_runner, lines, 100))
+  assert len(frame_list) == 5
+  for i, (_, total_list, process_list, cpu_list, mem_list, pid_list, _) in enumerate(frame_list):
+    assert total_list[0] == i
+    row_dict = {name: (cpu, mem, pid) for name, cpu, mem, pid in zip(process_list, cpu_list, mem_list, pid_list)}
+    assert row_dict['talker (10)'] == (10.0 + i, float(i), '10')
+    # rows without PID are kept as group lines
+    assert row_dict['ns:/demo'] == (20.0, 2.0, '')
+    assert row_dict['other'] == (1.0, 3.0, '')